@@ -0,0 +1,528 @@
+import json
+import time
+from collections import namedtuple
+
+import numpy as np
+import redis
+
+from metrics import ALERTS_TRIGGERED, PUSH_DELIVERY_DURATION, PUSH_NOTIFICATIONS
+from models import PriceAlert, AlertDirection, DeviceToken
+from push_service import PNS, prune_invalid_tokens
+from redis_client import get_redis
+
+TriggeredAlert = namedtuple("TriggeredAlert", ["alert_id", "user_uid", "ticker", "target_price", "direction", "price"])
+
+# Keeps IN (...) lists under SQLite's bind-parameter limit; Postgres gets one statement per chunk too.
+_IN_CHUNK = 10000
+
+
+class _Side:
+    """Alerts for one ticker and direction, sorted by target price."""
+
+    __slots__ = ("targets", "ids", "users")
+
+    def __init__(self, targets, ids, users):
+        self.targets = targets  # float64, ascending
+        self.ids = ids          # int64, aligned with targets
+        self.users = users      # object (user_uid), aligned with targets
+
+    def __len__(self):
+        return len(self.targets)
+
+
+class AlertBook:
+    """
+    Active price alerts indexed by ticker, with ABOVE and BELOW thresholds kept in sorted
+    arrays. Checking a price is one binary search per direction:
+
+    - ABOVE fires for every target <= price (a prefix of the ascending targets).
+    - BELOW fires for every target >= price (a suffix of the ascending targets).
+    """
+
+    def __init__(self):
+        self._above = {}  # ticker -> _Side
+        self._below = {}  # ticker -> _Side
+
+    def __len__(self):
+        return sum(len(s) for s in self._above.values()) + sum(len(s) for s in self._below.values())
+
+    def tickers(self):
+        return sorted(set(self._above) | set(self._below))
+
+    @classmethod
+    def from_arrays(cls, ids, user_uids, tickers, targets, is_above):
+        """Builds the book in one vectorized sort over (ticker, direction, target)."""
+        book = cls()
+        if len(ids) == 0:
+            return book
+        ids = np.asarray(ids, dtype=np.int64)
+        users = np.asarray(user_uids, dtype=object)
+        targets = np.asarray(targets, dtype=np.float64)
+        is_above = np.asarray(is_above, dtype=bool)
+        ticker_codes, ticker_names = _factorize(tickers)
+
+        order = np.lexsort((targets, is_above, ticker_codes))
+        ids, users, targets = ids[order], users[order], targets[order]
+        codes, is_above = ticker_codes[order], is_above[order]
+
+        # Boundaries of each (ticker, direction) run in the sorted arrays.
+        group_key = codes * 2 + is_above
+        starts = np.flatnonzero(np.r_[True, group_key[1:] != group_key[:-1]])
+        ends = np.r_[starts[1:], len(group_key)]
+        for start, end in zip(starts, ends):
+            side = _Side(targets[start:end], ids[start:end], users[start:end])
+            index = book._above if is_above[start] else book._below
+            index[ticker_names[codes[start]]] = side
+        return book
+
+    @classmethod
+    def load(cls, db):
+        """Loads every active alert from the database (plain columns, no ORM objects)."""
+        rows = (
+            db.query(PriceAlert.id, PriceAlert.user_uid, PriceAlert.ticker, PriceAlert.target_price, PriceAlert.direction)
+            .filter(PriceAlert.is_active == True)
+            .yield_per(50000)
+        )
+        ids, users, tickers, targets, is_above = [], [], [], [], []
+        for alert_id, user_uid, ticker, target, direction in rows:
+            ids.append(alert_id)
+            users.append(user_uid)
+            tickers.append(ticker)
+            targets.append(target)
+            is_above.append(direction == AlertDirection.ABOVE)
+        return cls.from_arrays(ids, users, tickers, targets, is_above)
+
+    def add(self, alert_id, user_uid, ticker, target_price, is_above):
+        """Inserts one alert, keeping the side sorted. Re-adding an existing id is a no-op."""
+        index = self._above if is_above else self._below
+        side = index.get(ticker)
+        if side is None:
+            index[ticker] = _Side(np.array([target_price], dtype=np.float64), np.array([alert_id], dtype=np.int64),
+                                  np.array([user_uid], dtype=object))
+            return
+        if np.any(side.ids == alert_id):
+            return
+        pos = np.searchsorted(side.targets, target_price)
+        index[ticker] = _Side(np.insert(side.targets, pos, target_price), np.insert(side.ids, pos, alert_id),
+                              np.insert(side.users, pos, user_uid))
+
+    def remove(self, alert_id, ticker, is_above):
+        """Drops one alert (e.g. deleted by the user). Unknown ids are ignored."""
+        index = self._above if is_above else self._below
+        side = index.get(ticker)
+        if side is None:
+            return
+        keep = side.ids != alert_id
+        if keep.all():
+            return
+        if not keep.any():
+            del index[ticker]
+        else:
+            index[ticker] = _Side(side.targets[keep], side.ids[keep], side.users[keep])
+
+    def evaluate(self, prices, pop=False):
+        """
+        Returns a TriggeredBatch of every alert crossed by `prices` ({ticker: price}).
+        With pop=True the triggered alerts are also removed from the book, so a stream of
+        trades never fires the same alert twice.
+        """
+        parts = []  # (side, lo, hi, direction, ticker, price)
+        for ticker, price in prices.items():
+            if price is None:
+                continue
+            side = self._above.get(ticker)
+            if side is not None:
+                k = np.searchsorted(side.targets, price, side="right")
+                if k:
+                    parts.append((side, 0, k, AlertDirection.ABOVE, ticker, price))
+            side = self._below.get(ticker)
+            if side is not None:
+                k = np.searchsorted(side.targets, price, side="left")
+                if k < len(side):
+                    parts.append((side, k, len(side), AlertDirection.BELOW, ticker, price))
+        batch = TriggeredBatch(parts)
+        if pop:
+            for side, lo, hi, direction, ticker, _ in parts:
+                index = self._above if direction == AlertDirection.ABOVE else self._below
+                # Fired alerts are always a prefix (ABOVE) or suffix (BELOW) of the side.
+                rest = slice(hi, None) if lo == 0 else slice(0, lo)
+                if len(side.targets[rest]):
+                    index[ticker] = _Side(side.targets[rest], side.ids[rest], side.users[rest])
+                else:
+                    del index[ticker]
+        return batch
+
+
+class TriggeredBatch:
+    """Columnar set of triggered alerts; iterating yields TriggeredAlert tuples."""
+
+    def __init__(self, parts):
+        self._parts = parts
+        self.alert_ids = (np.concatenate([side.ids[lo:hi] for side, lo, hi, *_ in parts])
+                          if parts else np.empty(0, dtype=np.int64))
+        self.user_uids = (np.concatenate([side.users[lo:hi] for side, lo, hi, *_ in parts])
+                          if parts else np.empty(0, dtype=object))
+
+    def __len__(self):
+        return len(self.alert_ids)
+
+    def __iter__(self):
+        for side, lo, hi, direction, ticker, price in self._parts:
+            for i in range(lo, hi):
+                yield TriggeredAlert(int(side.ids[i]), side.users[i], ticker, float(side.targets[i]), direction, price)
+
+
+def _factorize(values):
+    """Returns (codes, uniques) for a sequence of strings, like pandas.factorize."""
+    uniques, codes = np.unique(np.asarray(values, dtype=object).astype(str), return_inverse=True)
+    return codes.astype(np.int64), uniques.tolist()
+
+
+def _chunks(items, size=_IN_CHUNK):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def deactivate_alerts(db, alert_ids):
+    """
+    Marks alerts inactive with bulk UPDATEs (no ORM objects loaded) and returns the ids
+    this call flipped from active. An alert another evaluator (or an earlier run) already
+    deactivated is not returned, so it is never notified twice. Caller commits.
+    """
+    table = PriceAlert.__table__
+    dialect = db.get_bind().dialect
+    flipped = []
+    for chunk in _chunks(list(alert_ids)):
+        if getattr(dialect, "update_returning", getattr(dialect, "full_returning", False)):
+            statement = (table.update().where(table.c.id.in_(chunk), table.c.is_active == True)
+                         .values(is_active=False).returning(table.c.id))
+            flipped.extend(row[0] for row in db.execute(statement))
+        else:
+            # No UPDATE ... RETURNING: one conditional UPDATE per alert, kept if it changed a row
+            for alert_id in chunk:
+                statement = table.update().where(table.c.id == alert_id, table.c.is_active == True).values(is_active=False)
+                if db.execute(statement).rowcount:
+                    flipped.append(alert_id)
+    return flipped
+
+
+def load_device_tokens(db, user_uids):
+    """Returns {user_uid: [token, ...]} for all users in one query (per chunk of users)."""
+    tokens = {}
+    for chunk in _chunks(sorted(set(user_uids))):
+        for user_uid, token in db.query(DeviceToken.user_uid, DeviceToken.token).filter(DeviceToken.user_uid.in_(chunk)):
+            tokens.setdefault(user_uid, []).append(token)
+    return tokens
+
+
+def format_alert_message(alert):
+    """(title, body) for a TriggeredAlert push notification."""
+    title = f"Price Alert: {alert.ticker}"
+    body = f"{alert.ticker} has reached your target of ${alert.target_price:.2f}. Current price: ${alert.price:.2f}"
+    return title, body
+
+
+def deliver_triggered_alerts(db, triggered_alerts):
+    """
+    Deactivates triggered alerts, then pushes to every device of every triggered user in
+    one concurrent batch and deletes tokens APNs rejected. Commits. Returns a summary dict.
+    """
+    # Deactivate in bulk and commit before notifying, so a failed push never re-fires. Only
+    # alerts this call flipped are notified: another evaluator (the stream and the poller, or
+    # a resync that re-added an alert popped moments earlier) may have fired the rest.
+    flipped = set(deactivate_alerts(db, triggered_alerts.alert_ids.tolist()))
+    db.commit()
+    REDIS_ALERT_BOOK.remove_triggered(triggered_alerts)
+    ALERTS_TRIGGERED.inc(len(flipped))
+
+    # Device tokens for every triggered user in one query (no per-alert lookups)
+    fired = [alert for alert in triggered_alerts if alert.alert_id in flipped]
+    user_tokens = load_device_tokens(db, [alert.user_uid for alert in fired])
+    messages = []
+    for alert in fired:
+        print(f"ALERT TRIGGERED: {alert.ticker} hit target {alert.target_price}. Current: {alert.price}")
+        payload = PNS.build_payload(*format_alert_message(alert))
+        messages.extend((token, payload) for token in user_tokens.get(alert.user_uid, []))
+
+    # Concurrent delivery over the HTTP/2 connection; dead tokens are deleted in one statement
+    with PUSH_DELIVERY_DURATION.time():
+        push = PNS.send_batch(messages)
+    PUSH_NOTIFICATIONS.inc(len(messages))
+    pruned = prune_invalid_tokens(db, push.invalid_tokens)
+    db.commit()
+    return {"triggered": len(fired), "already_fired": len(triggered_alerts) - len(fired),
+            "pushed": len(messages), "pruned_tokens": pruned}
+
+
+# --- Alert book sync: create/delete events for long-running consumers (alert_stream.py) ---
+ALERT_EVENTS_CHANNEL = "alerts:events"
+
+def alert_event(op, alert):
+    """Serializes a PriceAlert create ("add") or delete ("remove") event."""
+    return json.dumps({
+        "op": op,
+        "id": alert.id,
+        "user_uid": alert.user_uid,
+        "ticker": alert.ticker,
+        "target_price": alert.target_price,
+        "direction": alert.direction.value,
+    })
+
+def publish_alert_event(op, alert):
+    """Best effort: consumers also resync from the database periodically."""
+    client = get_redis()
+    if client is None:
+        return
+    try:
+        client.publish(ALERT_EVENTS_CHANNEL, alert_event(op, alert))
+    except redis.exceptions.RedisError as e:
+        print(f"Could not publish alert event ({op} {alert.id}): {e}")
+
+def apply_alert_event(book, message):
+    """Applies a serialized alert event to an AlertBook."""
+    event = json.loads(message)
+    is_above = event["direction"] == AlertDirection.ABOVE.value
+    if event["op"] == "add":
+        book.add(event["id"], event["user_uid"], event["ticker"], event["target_price"], is_above)
+    elif event["op"] == "remove":
+        book.remove(event["id"], event["ticker"], is_above)
+
+
+# --- Redis-resident alert book (shared by every worker; see tasks.reconcile_alert_book) ---
+ALERT_TICKERS_KEY = "alerts:tickers"  # SET of tickers that may have active alerts
+ALERT_BOOK_READY_KEY = "alerts:ready"  # Set by the first successful reconcile
+# Popped alerts stay "in flight" (not yet deactivated in the database) for at most this long;
+# reconcile neither re-adds nor counts them meanwhile.
+ALERT_INFLIGHT_SECONDS = 600
+
+# Range query and removal in one atomic step, so two workers can never fire the same alert.
+# Popped members are recorded in the ticker's in-flight ZSET (scored by pop time).
+_EVALUATE_LUA = """
+local above = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'WITHSCORES')
+local below = redis.call('ZRANGEBYSCORE', KEYS[2], ARGV[1], '+inf', 'WITHSCORES')
+if ARGV[2] == '1' then
+    if #above > 0 then redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1]) end
+    if #below > 0 then redis.call('ZREMRANGEBYSCORE', KEYS[2], ARGV[1], '+inf') end
+    local popped = 0
+    for _, side in ipairs({above, below}) do
+        for i = 1, #side, 2 do
+            redis.call('ZADD', KEYS[3], ARGV[3], side[i])
+            popped = popped + 1
+        end
+    end
+    if popped > 0 then redis.call('EXPIRE', KEYS[3], ARGV[4]) end
+end
+return {above, below}
+"""
+
+
+def _side_key(ticker, is_above):
+    # Hash tag keeps both directions of a ticker in one cluster slot (the script touches both).
+    return f"alerts:{{{ticker}}}:{'above' if is_above else 'below'}"
+
+def _inflight_key(ticker):
+    return f"alerts:{{{ticker}}}:inflight"
+
+def _member(alert_id, user_uid):
+    return f"{alert_id}:{user_uid}"
+
+def _side_from_members(pairs):
+    """_Side from ZRANGE ... WITHSCORES output (ascending by target)."""
+    ids, users, targets = [], [], []
+    for i in range(0, len(pairs), 2):
+        alert_id, user_uid = pairs[i].decode().split(":", 1)
+        ids.append(int(alert_id))
+        users.append(user_uid)
+        targets.append(float(pairs[i + 1]))
+    return _Side(np.array(targets, dtype=np.float64), np.array(ids, dtype=np.int64), np.array(users, dtype=object))
+
+
+class RedisAlertBook:
+    """
+    Active alerts as per-ticker sorted sets of thresholds (one per direction), scored by
+    target price. Kept current on create/delete/trigger; evaluation is two ZRANGEBYSCORE
+    queries per ticker against the current price and never touches the database.
+    """
+
+    def __init__(self):
+        self._evaluate = None
+
+    def _client(self):
+        client = get_redis()
+        if client is not None and self._evaluate is None:
+            self._evaluate = client.register_script(_EVALUATE_LUA)
+        return client
+
+    def ready(self):
+        """True once reconcile has seeded the book (otherwise callers read the database)."""
+        client = self._client()
+        if client is None:
+            return False
+        try:
+            return bool(client.exists(ALERT_BOOK_READY_KEY))
+        except redis.exceptions.RedisError:
+            return False
+
+    def add(self, alert_id, user_uid, ticker, target_price, is_above):
+        pipe = self._client().pipeline(transaction=False)
+        pipe.zadd(_side_key(ticker, is_above), {_member(alert_id, user_uid): float(target_price)})
+        pipe.sadd(ALERT_TICKERS_KEY, ticker)
+        pipe.execute()
+
+    def remove(self, alert_id, user_uid, ticker, is_above):
+        self._client().zrem(_side_key(ticker, is_above), _member(alert_id, user_uid))
+
+    def add_alert(self, alert):
+        """Best effort for a PriceAlert row; reconcile repairs anything missed."""
+        self._best_effort(self.add, alert, alert.target_price)
+
+    def remove_alert(self, alert):
+        self._best_effort(self.remove, alert)
+
+    def _best_effort(self, op, alert, *target):
+        if self._client() is None:
+            return
+        try:
+            op(alert.id, alert.user_uid, alert.ticker, *target, alert.direction == AlertDirection.ABOVE)
+        except redis.exceptions.RedisError as e:
+            print(f"Alert book update failed for alert {alert.id}: {e}")
+
+    def remove_triggered(self, triggered_alerts):
+        """Drops fired alerts (a no-op for ones evaluate(pop=True) already removed)."""
+        if self._client() is None or not len(triggered_alerts):
+            return
+        try:
+            pipe = self._client().pipeline(transaction=False)
+            for alert in triggered_alerts:
+                pipe.zrem(_side_key(alert.ticker, alert.direction == AlertDirection.ABOVE),
+                          _member(alert.alert_id, alert.user_uid))
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            print(f"Alert book cleanup failed: {e}")
+
+    def tickers(self):
+        return sorted(t.decode() for t in self._client().smembers(ALERT_TICKERS_KEY))
+
+    def to_alert_book(self):
+        """Every alert in the book as an in-process AlertBook (pipelined reads, no database scan)."""
+        client = self._client()
+        keys = [(t, is_above) for t in self.tickers() for is_above in (True, False)]
+        pipe = client.pipeline(transaction=False)
+        for ticker, is_above in keys:
+            pipe.zrange(_side_key(ticker, is_above), 0, -1, withscores=True)
+        ids, users, tickers, targets, sides = [], [], [], [], []
+        for (ticker, is_above), members in zip(keys, pipe.execute()):
+            for member, target in members:
+                alert_id, user_uid = member.decode().split(":", 1)
+                ids.append(int(alert_id))
+                users.append(user_uid)
+                tickers.append(ticker)
+                targets.append(target)
+                sides.append(is_above)
+        return AlertBook.from_arrays(ids, users, tickers, targets, sides)
+
+    def evaluate(self, prices, pop=False):
+        """Same contract as AlertBook.evaluate; with pop=True fired alerts leave the book atomically."""
+        client = self._client()
+        items = [(t, p) for t, p in prices.items() if p is not None]
+        now = repr(time.time())
+        pipe = client.pipeline(transaction=False)
+        for ticker, price in items:
+            self._evaluate(keys=[_side_key(ticker, True), _side_key(ticker, False), _inflight_key(ticker)],
+                           args=[repr(float(price)), "1" if pop else "0", now, ALERT_INFLIGHT_SECONDS],
+                           client=pipe)
+        parts = []
+        for (ticker, price), (above, below) in zip(items, pipe.execute()):
+            if above:
+                side = _side_from_members(above)
+                parts.append((side, 0, len(side), AlertDirection.ABOVE, ticker, price))
+            if below:
+                side = _side_from_members(below)
+                parts.append((side, 0, len(side), AlertDirection.BELOW, ticker, price))
+        return TriggeredBatch(parts)
+
+    def reconcile(self, db):
+        """
+        Repairs drift against the database (the source of truth): adds missing alerts,
+        drops inactive/deleted ones and fixes changed targets. Returns counts.
+
+        Writers race with it, so it is fenced: alerts popped by evaluate but not yet
+        deactivated are never re-added, and every add or removal is re-checked against the
+        database after the book was read (an alert created or deleted since the snapshot
+        keeps its current state in the book).
+        """
+        client = self._client()
+        expected = {}  # key -> {member: target}
+        rows = (
+            db.query(PriceAlert.id, PriceAlert.user_uid, PriceAlert.ticker, PriceAlert.target_price, PriceAlert.direction)
+            .filter(PriceAlert.is_active == True)
+            .yield_per(50000)
+        )
+        for alert_id, user_uid, ticker, target, direction in rows:
+            key = _side_key(ticker, direction == AlertDirection.ABOVE)
+            expected.setdefault(key, {})[_member(alert_id, user_uid)] = float(target)
+        expected_tickers = {key.split("{", 1)[1].split("}", 1)[0] for key in expected}
+
+        known_tickers = set(self.tickers()) | expected_tickers
+        keys = [_side_key(t, is_above) for t in sorted(known_tickers) for is_above in (True, False)]
+        cutoff = time.time() - ALERT_INFLIGHT_SECONDS
+        pipe = client.pipeline(transaction=False)
+        for key in keys:
+            pipe.zrange(key, 0, -1, withscores=True)
+        for ticker in sorted(known_tickers):
+            pipe.zrangebyscore(_inflight_key(ticker), cutoff, "+inf")
+        results = pipe.execute()
+        current = dict(zip(keys, results[:len(keys)]))
+        inflight = {member.decode() for members in results[len(keys):] for member in members}
+
+        stale, fix = {}, {}  # key -> [member] / {member: target}
+        for key in keys:
+            want = expected.get(key, {})
+            have = {member.decode(): score for member, score in current[key]}
+            stale[key] = [m for m in have if m not in want]
+            fix[key] = {m: target for m, target in want.items() if have.get(m) != target and m not in inflight}
+
+        # Re-read every candidate after the book was read: only alerts still active (with
+        # their current target) are added, only ones no longer active are removed.
+        candidates = {int(m.split(":", 1)[0]) for changes in (stale, fix) for members in changes.values() for m in members}
+        db.commit()  # Ends the snapshot's read transaction so the re-check sees newer commits
+        active = _active_targets(db, candidates)
+
+        added = removed = 0
+        pipe = client.pipeline(transaction=False)
+        for key in keys:
+            drop = [m for m in stale[key] if m not in active or active[m][0] != key]
+            put = {m: active[m][1] for m in fix[key] if m in active and active[m][0] == key}
+            if drop:
+                pipe.zrem(key, *drop)
+            if put:
+                pipe.zadd(key, put)
+            removed += len(drop)
+            added += len(put)
+        for ticker in sorted(known_tickers):
+            pipe.zremrangebyscore(_inflight_key(ticker), "-inf", f"({cutoff}")
+        gone = known_tickers - expected_tickers
+        if gone:
+            pipe.srem(ALERT_TICKERS_KEY, *gone)
+        if expected_tickers:
+            pipe.sadd(ALERT_TICKERS_KEY, *expected_tickers)
+        pipe.set(ALERT_BOOK_READY_KEY, "1")
+        pipe.execute()
+        return {"alerts": sum(len(v) for v in expected.values()), "added": added, "removed": removed,
+                "tickers": len(expected_tickers)}
+
+def _active_targets(db, alert_ids):
+    """{member: (side key, target)} for the given alert ids that are active right now."""
+    active = {}
+    ids = sorted(alert_ids)
+    for i in range(0, len(ids), _IN_CHUNK):
+        rows = (
+            db.query(PriceAlert.id, PriceAlert.user_uid, PriceAlert.ticker, PriceAlert.target_price, PriceAlert.direction)
+            .filter(PriceAlert.id.in_(ids[i:i + _IN_CHUNK]), PriceAlert.is_active == True)
+        )
+        for alert_id, user_uid, ticker, target, direction in rows:
+            active[_member(alert_id, user_uid)] = (_side_key(ticker, direction == AlertDirection.ABOVE), float(target))
+    return active
+
+# Singleton instance
+REDIS_ALERT_BOOK = RedisAlertBook()
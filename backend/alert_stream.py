@@ -0,0 +1,227 @@
+"""
+Streaming price-alert service.
+
+Consumes a live trade feed (Polygon websocket in production, a recorded replay locally)
+and evaluates every trade against an in-memory AlertBook, so alerts fire within
+milliseconds of the crossing instead of on the next minute poll.
+
+State:
+- On start (and every ALERT_STREAM_RESYNC_SECONDS) the book is reloaded from the shared
+  Redis alert book (kept in line with the database by tasks.reconcile_alert_book), or from
+  the database until that book has been seeded.
+- Alert create/delete events arrive on Redis pub/sub (see alert_engine.publish_alert_event)
+  and are applied to the book incrementally.
+
+Run with SERVICE_ROLE=ALERT_STREAM (see entrypoint.sh), or locally:
+
+    python alert_stream.py --replay trades.jsonl --speed 0
+"""
+import argparse
+import json
+import queue
+import threading
+import time
+
+import redis
+import websocket
+
+from config import Config
+from models import get_db_session
+from redis_client import get_redis
+from alert_engine import AlertBook, ALERT_EVENTS_CHANNEL, REDIS_ALERT_BOOK, apply_alert_event, deliver_triggered_alerts
+
+
+class PolygonTradeFeed:
+    """Polygon stocks websocket (trade events). Reconnects with backoff and re-subscribes."""
+
+    def __init__(self, api_key, url=None):
+        self.api_key = api_key
+        self.url = url or Config.POLYGON_WS_URL
+        self._tickers = set()
+        self._ws = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, tickers):
+        new = set(tickers) - self._tickers
+        if not new:
+            return
+        self._tickers |= new
+        self._send({"action": "subscribe", "params": ",".join(f"T.{t}" for t in sorted(new))})
+
+    def _send(self, message):
+        with self._lock:
+            if self._ws is not None:
+                try:
+                    self._ws.send(json.dumps(message))
+                except websocket.WebSocketException as e:
+                    print(f"Feed send failed: {e}")
+
+    def _connect(self):
+        ws = websocket.create_connection(self.url, timeout=30)
+        ws.send(json.dumps({"action": "auth", "params": self.api_key}))
+        with self._lock:
+            self._ws = ws
+        if self._tickers:
+            self._send({"action": "subscribe", "params": ",".join(f"T.{t}" for t in sorted(self._tickers))})
+
+    def __iter__(self):
+        """Yields (ticker, price) for every trade."""
+        backoff = 1
+        while True:
+            try:
+                self._connect()
+                backoff = 1
+                while True:
+                    raw = self._ws.recv()
+                    if not raw:
+                        continue
+                    for event in json.loads(raw):
+                        if event.get("ev") == "T":
+                            yield event["sym"], event["p"]
+                        elif event.get("ev") == "status" and event.get("status") == "auth_failed":
+                            raise RuntimeError(f"Polygon websocket auth failed: {event.get('message')}")
+            except (websocket.WebSocketException, OSError) as e:
+                print(f"Feed disconnected ({e}); reconnecting in {backoff}s")
+                with self._lock:
+                    self._ws = None
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+
+
+class ReplayFeed:
+    """
+    Local stand-in for the websocket: replays recorded Polygon trade events (JSON lines,
+    `{"ev": "T", "sym": ..., "p": ..., "t": epoch_ms}`). speed=1 keeps the recorded pacing,
+    speed=0 replays as fast as possible.
+    """
+
+    def __init__(self, path, speed=0.0):
+        self.path = path
+        self.speed = speed
+
+    def subscribe(self, tickers):
+        pass  # Replays every recorded ticker
+
+    def __iter__(self):
+        previous_t = None
+        with open(self.path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                if event.get("ev", "T") != "T":
+                    continue
+                if self.speed and previous_t is not None and event.get("t"):
+                    time.sleep(max(0, event["t"] - previous_t) / 1000 / self.speed)
+                previous_t = event.get("t", previous_t)
+                yield event["sym"], event["p"]
+
+
+class AlertStreamService:
+    """Evaluates each trade against the AlertBook; deliveries run on a separate thread."""
+
+    def __init__(self, feed):
+        self.feed = feed
+        self.book = AlertBook()
+        self._lock = threading.Lock()  # Guards self.book (feed, pub/sub and resync threads)
+        self._deliveries = queue.Queue()
+        self._last_resync = 0.0
+        self._events_during_load = None
+        self.stats = {"trades": 0, "triggered": 0, "events": 0}
+
+    def start(self):
+        # Subscribe to events before loading so nothing created during the load is missed.
+        threading.Thread(target=self._listen_events, name="alert-events", daemon=True).start()
+        self.resync()
+        threading.Thread(target=self._deliver_loop, name="alert-delivery", daemon=True).start()
+
+    def resync(self):
+        """Rebuilds the book from the Redis alert book, or the database (restart recovery and drift repair)."""
+        with self._lock:
+            self._events_during_load = []
+        book = self._load_book()
+        with self._lock:
+            # Events that raced the load are re-applied; add/remove are idempotent.
+            for message in self._events_during_load:
+                apply_alert_event(book, message)
+            self._events_during_load = None
+            self.book = book
+            self._last_resync = time.monotonic()
+        self.feed.subscribe(book.tickers())
+        print(f"Alert book loaded: {len(book)} active alerts on {len(book.tickers())} tickers")
+
+    @staticmethod
+    def _load_book():
+        if REDIS_ALERT_BOOK.ready():
+            try:
+                return REDIS_ALERT_BOOK.to_alert_book()
+            except redis.exceptions.RedisError as e:
+                print(f"Redis alert book unavailable ({e}); loading from the database")
+        with get_db_session() as db:
+            return AlertBook.load(db)
+
+    def _listen_events(self):
+        while True:
+            client = get_redis()
+            if client is None:
+                return
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(ALERT_EVENTS_CHANNEL)
+                for message in pubsub.listen():
+                    with self._lock:
+                        apply_alert_event(self.book, message["data"])
+                        if self._events_during_load is not None:
+                            self._events_during_load.append(message["data"])
+                        tickers = self.book.tickers()
+                    self.stats["events"] += 1
+                    self.feed.subscribe(tickers)
+            except redis.exceptions.RedisError as e:
+                print(f"Alert event subscription lost ({e}); retrying")
+                time.sleep(5)
+
+    def on_trade(self, ticker, price):
+        with self._lock:
+            triggered = self.book.evaluate({ticker: price}, pop=True)
+        self.stats["trades"] += 1
+        if len(triggered):
+            self.stats["triggered"] += len(triggered)
+            self._deliveries.put(triggered)
+
+    def _deliver_loop(self):
+        while True:
+            triggered = self._deliveries.get()
+            try:
+                with get_db_session() as db:
+                    deliver_triggered_alerts(db, triggered)
+            except Exception as e:
+                print(f"Alert delivery failed: {e}")
+            finally:
+                self._deliveries.task_done()
+
+    def run(self):
+        self.start()
+        for ticker, price in self.feed:
+            self.on_trade(ticker, price)
+            if time.monotonic() - self._last_resync > Config.ALERT_STREAM_RESYNC_SECONDS:
+                threading.Thread(target=self.resync, name="alert-resync", daemon=True).start()
+                self._last_resync = time.monotonic()
+
+    def drain(self, timeout=10):
+        """Waits for queued deliveries (used after a finite replay)."""
+        deadline = time.monotonic() + timeout
+        while self._deliveries.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Streaming price-alert service")
+    parser.add_argument("--replay", help="Replay recorded trade events (JSON lines) instead of the Polygon websocket")
+    parser.add_argument("--speed", type=float, default=0.0, help="Replay speed multiplier (0 = as fast as possible)")
+    args = parser.parse_args()
+
+    feed = ReplayFeed(args.replay, args.speed) if args.replay else PolygonTradeFeed(Config.POLYGON_API_KEY)
+    service = AlertStreamService(feed)
+    service.run()
+    service.drain()
+    print(f"Alert stream finished: {service.stats}")
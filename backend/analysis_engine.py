@@ -1,23 +1,73 @@
+import hashlib
+import json
+
 import pandas as pd
 import numpy as np
 
+from cache import last_market_close_date
+from config import Config
+from factor_engine import FactorEngine
+from fundamentals_source import iter_fundamentals
+
+_EXCHANGES = ["NYSE", "NASDAQ", "NYSE American", "OTC"]
+_NUMERIC = ['MarketCap', 'Volume', 'PE_Ratio', 'ROIC', 'InsiderOwnership']
+
 class MicroCapAnalyzer:
-    def __init__(self):
+    def __init__(self, lean=None, n_stocks=2000, top_n=10, source=None):
+        # Memory-lean mode for full-market screens (float32/categorical columns, one fused
+        # filter mask, argpartition top-N). Results match the default mode up to float32 rounding.
+        self.lean = Config.ANALYZER_LEAN_MODE if lean is None else lean
+        self.N_STOCKS = n_stocks
+        self.TOP_N = top_n
+        # Fundamentals source ("csv:...", "parquet:...", "sql:..."); streamed chunk by chunk.
+        # Unset: the simulated universe below.
+        self.source = Config.ANALYZER_FUNDAMENTALS_SOURCE if source is None else source
         # Configuration Parameters
         self.MIN_MARKET_CAP = 50 # $50M
         self.MIN_LIQUIDITY = 100000 # $100k daily volume
         self.MIN_ROIC = 0.10 # 10% Return on Invested Capital
+        # Composite weights (Quality, Value, Alignment)
+        self.WEIGHT_QUALITY = 0.40
+        self.WEIGHT_VALUE = 0.40
+        self.WEIGHT_ALIGNMENT = 0.20
+
+    def params(self):
+        """Filter and weight parameters; part of the stored run key."""
+        return {
+            "min_market_cap": self.MIN_MARKET_CAP,
+            "min_liquidity": self.MIN_LIQUIDITY,
+            "min_roic": self.MIN_ROIC,
+            "weight_quality": self.WEIGHT_QUALITY,
+            "weight_value": self.WEIGHT_VALUE,
+            "weight_alignment": self.WEIGHT_ALIGNMENT,
+        }
+
+    def data_version(self):
+        """
+        Version of the input data. Fundamentals and prices refresh once per session, so
+        this is the last completed session date; a licensed feed's snapshot id goes here.
+        """
+        return last_market_close_date().isoformat()
+
+    def run_key(self):
+        """Identifies a run: same input data + same parameters = same result."""
+        raw = json.dumps({"data": self.data_version(), "params": self.params()}, sort_keys=True)
+        return hashlib.sha1(raw.encode()).hexdigest()[:16]
 
     def fetch_and_preprocess(self):
         """
         CRITICAL STEP: Integrate your licensed financial data provider (e.g., Polygon.io, FMP) here.
         This must pull fundamentals and pricing data from your database or API.
         """
+        if self.source:
+            return pd.concat(self._iter_clean_chunks(), ignore_index=True)
         print("Fetching data (Simulation Placeholder)...")
         
         # SIMULATION: Replace this structure with your actual data source.
         np.random.seed(42)
-        N_STOCKS = 2000
+        N_STOCKS = self.N_STOCKS
+        if self.lean:
+            return self._simulate_lean(N_STOCKS)
         data = {
             'Ticker': [f'TICK{i}' for i in range(N_STOCKS)],
             'MarketCap': np.random.uniform(20, 3000, N_STOCKS),
@@ -26,23 +76,79 @@ class MicroCapAnalyzer:
             'ROIC': np.random.uniform(-0.1, 0.4, N_STOCKS),
             'InsiderOwnership': np.random.uniform(0.01, 0.9, N_STOCKS),
         }
+        data['Exchange'] = np.array(_EXCHANGES, dtype=object)[np.random.randint(0, len(_EXCHANGES), N_STOCKS)]
         df = pd.DataFrame(data)
         
         # Data Cleaning
         df = df.replace([np.inf, -np.inf], np.nan).dropna()
         return df
 
+    def _simulate_lean(self, n):
+        """Same draws as the default simulation, cast column by column so no float64 frame exists."""
+        market_cap = np.random.uniform(20, 3000, n).astype(np.float32)
+        volume = np.random.randint(10000, 1000000, n).astype(np.int32)
+        pe_ratio = np.random.uniform(1, 60, n).astype(np.float32)
+        roic = np.random.uniform(-0.1, 0.4, n).astype(np.float32)
+        insider = np.random.uniform(0.01, 0.9, n).astype(np.float32)
+        exchange = pd.Categorical.from_codes(np.random.randint(0, len(_EXCHANGES), n).astype(np.int8), _EXCHANGES)
+        df = pd.DataFrame({
+            'Ticker': [f'TICK{i}' for i in range(n)],
+            'MarketCap': market_cap,
+            'Volume': volume,
+            'PE_Ratio': pe_ratio,
+            'ROIC': roic,
+            'InsiderOwnership': insider,
+            'Exchange': exchange,
+        }, copy=False)
+        # Data Cleaning (one fused finite mask instead of replace + dropna)
+        finite = np.ones(n, dtype=bool)
+        for column in ('MarketCap', 'PE_Ratio', 'ROIC', 'InsiderOwnership'):
+            finite &= np.isfinite(df[column].to_numpy())
+        return df if finite.all() else df[finite]
+
+    def _iter_clean_chunks(self):
+        """Cleaned chunks from the configured source (only the columns the screen uses)."""
+        for chunk in iter_fundamentals(self.source, ['Ticker'] + _NUMERIC, Config.ANALYZER_CHUNK_ROWS):
+            numeric = chunk[_NUMERIC].apply(pd.to_numeric, errors='coerce')
+            if self.lean:
+                numeric = numeric.astype(np.float32)
+            chunk = pd.concat([chunk[['Ticker']], numeric], axis=1)
+            finite = np.isfinite(numeric.to_numpy(dtype=np.float64)).all(axis=1)
+            yield chunk[finite]
+
+    def fetch_filtered(self):
+        """
+        Clean + strict filters. With a configured source this streams: each chunk is
+        cleaned and filtered on arrival and only surviving rows are kept, so peak memory
+        follows the filtered set instead of the raw universe.
+        """
+        if not self.source:
+            return self.apply_strict_filters(self.fetch_and_preprocess())
+        survivors = [self.apply_strict_filters(chunk) for chunk in self._iter_clean_chunks()]
+        if not survivors:
+            return pd.DataFrame(columns=['Ticker'] + _NUMERIC)
+        return pd.concat(survivors, ignore_index=True)
+
     def apply_strict_filters(self, df):
         """Filters the universe based on non-negotiable criteria."""
+        if self.lean:
+            # One fused mask on the raw arrays; the only copy is the final row selection.
+            mask = df['MarketCap'].to_numpy() >= self.MIN_MARKET_CAP
+            mask &= df['Volume'].to_numpy() >= self.MIN_LIQUIDITY
+            mask &= df['ROIC'].to_numpy() >= self.MIN_ROIC
+            mask &= df['PE_Ratio'].to_numpy() > 0
+            return df[mask]
         df = df[(df['MarketCap'] >= self.MIN_MARKET_CAP) & (df['Volume'] >= self.MIN_LIQUIDITY)]
         df = df[df['ROIC'] >= self.MIN_ROIC]
         df = df[df['PE_Ratio'] > 0] # Focus on profitable companies
         return df.copy()
 
-    def multi_factor_ranking(self, df):
+    def multi_factor_ranking(self, df, top_n=None):
         """Ranks the filtered stocks using a normalized, multi-factor model."""
         if df.empty:
             return df
+        if self.lean:
+            return self._rank_lean(df, top_n)
 
         # Normalize using Percentile Ranking (Robust against outliers)
         df['Rank_Value'] = df['PE_Ratio'].rank(pct=True, ascending=True)
@@ -51,17 +157,58 @@ class MicroCapAnalyzer:
 
         # Composite Score (Weighted: e.g., 40% Q, 40% V, 20% A)
         df['CompositeScore'] = (
-            (df['Rank_Quality'] * 0.40) + (df['Rank_Value'] * 0.40) + (df['Rank_Alignment'] * 0.20)
+            (df['Rank_Quality'] * self.WEIGHT_QUALITY)
+            + (df['Rank_Value'] * self.WEIGHT_VALUE)
+            + (df['Rank_Alignment'] * self.WEIGHT_ALIGNMENT)
         )
-        return df.sort_values(by='CompositeScore', ascending=False)
+        df = df.sort_values(by='CompositeScore', ascending=False)
+        return df if top_n is None else df.head(top_n)
+
+    def _rank_lean(self, df, top_n):
+        """float32 scores; only the top_n rows are materialized (argpartition, then a small sort)."""
+        rank_value = _pct_rank(df['PE_Ratio'], ascending=True)
+        rank_quality = _pct_rank(df['ROIC'], ascending=False)
+        rank_alignment = _pct_rank(df['InsiderOwnership'], ascending=False)
+        score = rank_quality * np.float32(self.WEIGHT_QUALITY)
+        score += rank_value * np.float32(self.WEIGHT_VALUE)
+        score += rank_alignment * np.float32(self.WEIGHT_ALIGNMENT)
+
+        if top_n is not None and top_n < len(score):
+            top = np.argpartition(-score, top_n - 1)[:top_n]
+        else:
+            top = np.arange(len(score))
+        top = top[np.argsort(-score[top], kind="stable")]
+
+        ranked = df.iloc[top].copy()
+        ranked['Rank_Value'] = rank_value[top]
+        ranked['Rank_Quality'] = rank_quality[top]
+        ranked['Rank_Alignment'] = rank_alignment[top]
+        ranked['CompositeScore'] = score[top]
+        return ranked
+
+    def rank_universe(self, top_n=None):
+        """Fetch -> filter -> rank; the best `top_n` passing stocks (all if None), best first."""
+        return self.multi_factor_ranking(self.fetch_filtered(), top_n=top_n)
+
+    def default_scenario(self):
+        """This analyzer's weights as a FactorEngine scenario."""
+        return {"quality": self.WEIGHT_QUALITY, "value": self.WEIGHT_VALUE, "alignment": self.WEIGHT_ALIGNMENT}
+
+    def rank_scenarios(self, scenarios, top_n=None):
+        """
+        Fetch -> filter once, then score every weight scenario together
+        ({name: {factor: weight}}). Returns {name: top-N DataFrame}.
+        """
+        return FactorEngine().top_n(self.fetch_filtered(), scenarios, n=top_n or self.TOP_N)
 
     def run_analysis(self):
         """Executes the full pipeline."""
-        df = self.fetch_and_preprocess()
-        filtered_df = self.apply_strict_filters(df)
-        ranked_df = self.multi_factor_ranking(filtered_df)
-        
         # The Curation Queue: Top candidates for human review in the Admin Portal
-        candidates = ranked_df.head(10)
+        candidates = self.rank_universe(top_n=self.TOP_N)
         # In production: The Flask endpoint calls this and returns the candidates.
         return candidates
+
+
+def _pct_rank(series, ascending=True):
+    """Percentile rank (pandas rank(pct=True), average ties) as float32."""
+    return series.rank(pct=True, ascending=ascending).to_numpy(dtype=np.float32)
@@ -1,9 +1,15 @@
-from data_providers import DP
-try:
-    import talib
-except ImportError:
-    print("WARNING: TA-Lib not installed. Technical analysis disabled.")
-    talib = None
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturesTimeout, as_completed
+
+import numpy as np
+
+from cache import stale_reads
+from config import Config
+from data_providers import DP, ProviderError
+from metrics import HUB_SECTION_DURATION
+from provider_transport import deadline_scope
+from single_flight import SINGLE_FLIGHT, flight_key
+from technicals_engine import TE, build_close_panel
 
 class AnalysisFeatures:
     """
@@ -33,82 +39,72 @@ class AnalysisFeatures:
 
     # --- Feature: Automated Technical Analysis (Restored from your snippet) ---
     def analyze_technicals(self, ticker):
-        if talib is None:
-            return {"error": "Technical Analysis engine offline."}
+        """
+        SMA-50/200, RSI-14, cross and trend signals. Served from the last universe batch run
+        (tasks.compute_universe_technicals) when available; otherwise computed for this ticker
+        alone by the same engine (TA-Lib if installed, NumPy otherwise).
+        """
+        precomputed = TE.lookup(ticker)
+        if precomputed is not None:
+            return precomputed
 
-        df = DP.get_daily_ohlcv(ticker, days_back=200)
+        try:
+            df = DP.get_daily_ohlcv(ticker, days_back=200)
+        except ProviderError as e:
+            return {"error": f"Market data unavailable ({e}).", "throttled": e.throttled, "retries": e.retries}
         if df.empty or len(df) < 50:
             return {"error": "Insufficient historical data."}
 
-        # Calculate Indicators
-        sma_50 = talib.SMA(df['Close'], timeperiod=50)
-        sma_200 = talib.SMA(df['Close'], timeperiod=200)
-        rsi = talib.RSI(df['Close'], timeperiod=14)
-
-        # Analyze Signals
-        signals = []
-        current_price = df['Close'].iloc[-1]
-        current_rsi = rsi.iloc[-1]
-        trend = "Neutral"  # Default trend
-        
-        # Pattern Recognition: Golden Cross / Death Cross
-        if len(df) >= 200:
-            if sma_50.iloc[-1] > sma_200.iloc[-1] and sma_50.iloc[-2] <= sma_200.iloc[-2]:
-                signals.append({
-                    "signal": "Golden Cross",
-                    "sentiment": "Bullish",
-                    "description": "Strong bullish signal: 50-day SMA crossed above 200-day SMA.",
-                })
-            elif sma_50.iloc[-1] < sma_200.iloc[-1] and sma_50.iloc[-2] >= sma_200.iloc[-2]:
-                signals.append({
-                    "signal": "Death Cross",
-                    "sentiment": "Bearish",
-                    "description": "Strong bearish signal: 50-day SMA crossed below 200-day SMA.",
-                })
-            
-            # Trend Strength
-            if current_price > sma_50.iloc[-1] and sma_50.iloc[-1] > sma_200.iloc[-1]:
-                trend = "Strong Uptrend"
-            elif current_price < sma_50.iloc[-1] and sma_50.iloc[-1] < sma_200.iloc[-1]:
-                trend = "Strong Downtrend"
-            elif current_price > sma_50.iloc[-1] and current_price > sma_200.iloc[-1]:
-                trend = "Uptrend"
-            elif current_price < sma_50.iloc[-1] and current_price < sma_200.iloc[-1]:
-                trend = "Downtrend"
-
-        # Momentum Signals (RSI)
-        if current_rsi > 70:
-            signals.append({
-                "signal": "Overbought",
-                "sentiment": "Bearish",
-                "description": "RSI_14 is over 70, indicating a potential pullback.",
-            })
-        elif current_rsi < 30:
-            signals.append({
-                "signal": "Oversold",
-                "sentiment": "Bullish",
-                "description": "RSI_14 is under 30, indicating a potential bounce.",
-            })
+        result = TE.compute(df['Close'].to_numpy()[:, None], [ticker])
+        payload = result.payload(ticker)
+        if df.attrs.get('stale'):
+            payload["stale"] = True
+        return payload
 
+    def analyze_technicals_many(self, tickers):
+        """
+        {ticker: analyze_technicals result} for a watchlist: stored payloads come from one
+        HMGET, the rest from one batched OHLCV sync and a single panel pass.
+        """
+        results = TE.lookup_many(tickers)
+        missing = [t for t in tickers if t not in results]
+        if not missing:
+            return results
 
-        return {
-            "trend": trend,
-            "indicators": {
-                "RSI_14": current_rsi,
-                "SMA_50": sma_50.iloc[-1],
-                "SMA_200": sma_200.iloc[-1] if len(df) >= 200 else None,
-            },
-            "signals": signals,
-            "error": None
-        }
+        frames = DP.get_daily_ohlcv_many(missing, days_back=200)
+        closes = {t: frames[t]['Close'].to_numpy() for t in missing if t in frames}
+        if closes:
+            panel, names = build_close_panel(closes, n_bars=max(len(c) for c in closes.values()))
+            computed = TE.compute(panel, names)
+            for t in names:
+                payload = computed.payload(t)
+                if frames[t].attrs.get('stale'):
+                    payload["stale"] = True
+                results[t] = payload
+        for t in missing:
+            results.setdefault(t, {"error": "Market data unavailable."})
+        return results
 
     # --- Feature: Institutional Ownership Analysis (Restored from your snippet) ---
     def analyze_ownership(self, ticker):
-        data = DP.get_institutional_ownership(ticker)
+        try:
+            data = DP.get_institutional_ownership(ticker)
+        except ProviderError as e:
+            return {"top_holders": [], "concentration": 0, "error": f"Ownership data unavailable ({e}).",
+                    "throttled": e.throttled, "retries": e.retries}
+        return self._ownership_summary(data)
+
+    def analyze_ownership_many(self, tickers):
+        """{ticker: analyze_ownership result} with the holder lists looked up together."""
+        holdings = DP.get_institutional_ownership_many(tickers)
+        return {t: self._ownership_summary(holdings.get(t)) for t in tickers}
+
+    def _ownership_summary(self, data):
         if not data:
             return {"top_holders": [], "concentration": 0}
 
-        data.sort(key=lambda x: x.get('marketValue', 0), reverse=True)
+        # Cached provider data is shared between requests; never sort it in place.
+        data = sorted(data, key=lambda x: x.get('marketValue', 0), reverse=True)
         
         top_holders = []
         total_value = sum(item.get('marketValue', 0) for item in data)
@@ -167,23 +163,202 @@ class AnalysisFeatures:
 
         return {"score": round(final_score, 1), "classification": classification}
 
+    # --- Performance: Batch Conviction Scoring ---
+    CONVICTION_CLASSES = np.array(["Low Conviction", "Monitor", "Strong Opportunity", "High Conviction"])
+
+    def conviction_inputs(self, hubs, analyst_inputs=None):
+        """
+        Columnar inputs for calculate_conviction_scores from hub dicts (same lookups as
+        calculate_conviction_score). `analyst_inputs` is a list aligned with `hubs`.
+        """
+        def field(hub, section, key):
+            value = hub.get(section, {})
+            return value.get(key) if isinstance(value, dict) else None
+
+        analyst_inputs = analyst_inputs or [{}] * len(hubs)
+        risk = [field(h, 'redFlags', 'compositeRiskScore') for h in hubs]
+        return {
+            "risk_score": np.array([np.nan if r is None else r for r in risk], dtype=np.float64),
+            "insider_sentiment": np.array([field(h, 'insiderActivity', 'sentiment') for h in hubs], dtype=object),
+            "trend": np.array([field(h, 'technicals', 'trend') for h in hubs], dtype=object),
+            "thesis_strength": np.array([a.get('thesis_strength', 3) for a in analyst_inputs], dtype=np.float64),
+        }
+
+    def calculate_conviction_scores(self, inputs):
+        """
+        Vectorized calculate_conviction_score over columnar inputs (see conviction_inputs):
+        risk_score (NaN = missing), insider_sentiment, trend, thesis_strength.
+        Returns (scores float64, classifications object array), identical to the scalar version.
+        """
+        risk = np.asarray(inputs["risk_score"], dtype=np.float64)
+        insider = np.asarray(inputs["insider_sentiment"], dtype=object)
+        trend = np.asarray(inputs["trend"], dtype=object)
+        thesis = np.asarray(inputs["thesis_strength"], dtype=np.float64)
+
+        with np.errstate(invalid="ignore"):
+            score = np.full(len(risk), 5.0)
+            score -= np.select([risk > 75, risk > 50], [3.0, 1.5], 0.0)
+            score += np.select([insider == 'Bullish', insider == 'Bearish'], [2.5, -1.5], 0.0)
+            score += np.select([trend == 'Strong Uptrend', trend == 'Strong Downtrend'], [2.0, -2.0], 0.0)
+            score += np.select([thesis == 5, thesis == 4, thesis <= 2], [3.0, 1.5, -2.0], 0.0)
+
+        final_score = np.clip(score, 0.0, 10.0)
+        tier = (final_score >= 5.0).astype(int) + (final_score >= 7.0) + (final_score >= 8.5)
+        return np.round(final_score, 1), self.CONVICTION_CLASSES[tier].astype(object)
+
 # Singleton instance
 AF = AnalysisFeatures()
 
-def fetch_analysis_hub_data(ticker):
+# --- Performance: Concurrent Analysis Hub ---
+# Each section does its own blocking provider round trip, so they run side by side on a
+# shared pool. The hub waits at most HUB_SECTION_TIMEOUT for the slowest one. A section the
+# hub gave up on cannot be interrupted, so its work is bounded instead: provider calls and
+# single-flight waits end at the hub deadline, and sections still queued then never start.
+_HUB_EXECUTOR = ThreadPoolExecutor(max_workers=Config.HUB_MAX_WORKERS, thread_name_prefix="hub")
+
+HUB_SECTIONS = {
+    "redFlags": AF.analyze_red_flags,
+    "insiderActivity": AF.analyze_insider_activity,
+    "liquidity": AF.analyze_liquidity,
+    "technicals": AF.analyze_technicals,
+    "ownership": AF.analyze_ownership,
+}
+
+# Sections with a batched form, used when several hubs are built together
+HUB_BATCH_SECTIONS = {
+    "technicals": AF.analyze_technicals_many,
+    "ownership": AF.analyze_ownership_many,
+}
+
+def _timed_section(name, func, ticker, deadline):
     """
-    Gathers all single-stock analysis data points into one dictionary.
-    This can be imported by tasks.py and app.py.
+    Runs one hub section and returns (result, elapsed_ms). Its provider calls end
+    HUB_FALLBACK_MARGIN before the hub deadline so cached data can still be served; a
+    section built from any stale cache value is marked "stale". Batch sections get a
+    list of tickers and mark only the tickers whose cache keys were stale.
+    """
+    started = time.perf_counter()
+    if started >= deadline:
+        # Queued behind a busy pool past the deadline: nobody is waiting for it any more
+        return {"error": "Timed out before it started.", "stale": True}, 0.0
+    provider_deadline = time.monotonic() + (deadline - started) - Config.HUB_FALLBACK_MARGIN
+    mode = "batch" if isinstance(ticker, list) else "single"
+    with HUB_SECTION_DURATION.time(section=name, mode=mode), deadline_scope(provider_deadline), stale_reads() as stale:
+        result = func(ticker)
+    if stale and isinstance(result, dict):
+        if isinstance(ticker, list):
+            stale_tickers = {key.split(":", 1)[0] for _, key in stale}
+            result = {t: {**r, "stale": True} if t in stale_tickers else r for t, r in result.items()}
+        else:
+            result = {**result, "stale": True}
+    return result, (time.perf_counter() - started) * 1000
+
+def _section_result(name, future, ticker, deadline, timeout, started):
     """
-    # In a real app, you'd add error handling for each module
+    (result, elapsed_ms) of a section future, or an error / stale marker. `deadline` is
+    hub-wide (started + timeout, shared by every section of the hub or batch), so this
+    waits only for whatever is left of it.
+    """
+    try:
+        return future.result(timeout=max(0.0, deadline - time.perf_counter()))
+    except FuturesTimeout:
+        future.cancel()  # Drops it if still queued; a running section ends at its own deadline checks
+        result = {"error": f"Timed out after {timeout:.1f}s.", "stale": True}
+    except Exception as e:
+        print(f"Hub section '{name}' failed for {ticker}: {e}")
+        result = {"error": f"Section unavailable: {e}"}
+    return result, (time.perf_counter() - started) * 1000
+
+def _hub_payload(ticker, sections, timings):
     return {
         "ticker": ticker,
-        "redFlags": AF.analyze_red_flags(ticker),
-        "insiderActivity": AF.analyze_insider_activity(ticker),
-        "liquidity": AF.analyze_liquidity(ticker),
+        "redFlags": sections["redFlags"],
+        "insiderActivity": sections["insiderActivity"],
+        "liquidity": sections["liquidity"],
         "sentiment": {"score": 0.1, "sentiment": "Neutral", "articleCount": 5}, # Placeholder
         "fundamentalsChart": [], # Placeholder
-        "technicals": AF.analyze_technicals(ticker),
-        "ownership": AF.analyze_ownership(ticker)
+        "technicals": sections["technicals"],
+        "ownership": sections["ownership"],
+        "sectionTimings": {name: round(ms, 1) for name, ms in timings.items()},
     }
 
+def fetch_analysis_hub_data(ticker, timeout=None):
+    """
+    Gathers all single-stock analysis data points into one dictionary.
+    This can be imported by tasks.py and app.py.
+
+    Sections run concurrently under one deadline for the whole hub (`timeout`, default
+    HUB_SECTION_TIMEOUT). A section that raises comes back as {"error": ...}; one that
+    misses the deadline comes back as {"error": ..., "stale": True} so the rest of the
+    hub is not held up. Per-section wall time (ms) is in "sectionTimings".
+
+    Concurrent builds of the same ticker (e.g. right after a pick is published) share one
+    build, across web instances too; each caller gets its own top-level copy.
+    """
+    timeout = Config.HUB_SECTION_TIMEOUT if timeout is None else timeout
+    return dict(SINGLE_FLIGHT.do(flight_key("hub", ticker, timeout), lambda: _build_hub_data(ticker, timeout)))
+
+def _build_hub_data(ticker, timeout):
+    started = time.perf_counter()
+    deadline = started + timeout
+
+    futures = {
+        name: _HUB_EXECUTOR.submit(_timed_section, name, func, ticker, deadline)
+        for name, func in HUB_SECTIONS.items()
+    }
+
+    sections, timings = {}, {}
+    for name, future in futures.items():
+        sections[name], timings[name] = _section_result(name, future, ticker, deadline, timeout, started)
+    return _hub_payload(ticker, sections, timings)
+
+def iter_analysis_hub_data(tickers, timeout=None):
+    """
+    Builds the hubs of several tickers together and yields (ticker, payload) as each one
+    completes. Sections with a batched form (HUB_BATCH_SECTIONS) run once for the whole
+    list; the rest run per ticker on the shared pool. Same error/stale markers as
+    fetch_analysis_hub_data, with one deadline (HUB_BATCH_TIMEOUT) for the whole batch.
+    """
+    timeout = Config.HUB_BATCH_TIMEOUT if timeout is None else timeout
+    tickers = list(dict.fromkeys(tickers))
+    started = time.perf_counter()
+    deadline = started + timeout
+
+    batches = {name: _HUB_EXECUTOR.submit(_timed_section, name, func, tickers, deadline) for name, func in HUB_BATCH_SECTIONS.items()}
+    owners = {future: (None, name) for name, future in batches.items()}
+    for ticker in tickers:
+        for name, func in HUB_SECTIONS.items():
+            if name not in HUB_BATCH_SECTIONS:
+                owners[_HUB_EXECUTOR.submit(_timed_section, name, func, ticker, deadline)] = (ticker, name)
+
+    sections = {ticker: {} for ticker in tickers}
+    timings = {ticker: {} for ticker in tickers}
+    pending = {ticker: len(HUB_SECTIONS) for ticker in tickers}
+
+    def finish(ticker, name, result, elapsed_ms):
+        sections[ticker][name], timings[ticker][name] = result, elapsed_ms
+        pending[ticker] -= 1
+        return pending[ticker] == 0
+
+    def complete(future):
+        """Records a finished future; returns the tickers it completed."""
+        ticker, name = owners.pop(future)
+        result, elapsed_ms = _section_result(name, future, ticker or "batch", deadline, timeout, started)
+        if ticker is not None:
+            return [ticker] if finish(ticker, name, result, elapsed_ms) else []
+        done = []
+        for t in tickers:
+            section = result.get(t, {"error": "Section unavailable."}) if "error" not in result else result
+            if finish(t, name, section, elapsed_ms):
+                done.append(t)
+        return done
+
+    try:
+        for future in as_completed(list(owners), timeout=timeout):
+            for ticker in complete(future):
+                yield ticker, _hub_payload(ticker, sections[ticker], timings[ticker])
+    except FuturesTimeout:
+        # Past the deadline: whatever is still running comes back as a stale marker
+        for future in list(owners):
+            for ticker in complete(future):
+                yield ticker, _hub_payload(ticker, sections[ticker], timings[ticker])
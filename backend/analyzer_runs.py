@@ -0,0 +1,140 @@
+import json
+import threading
+from datetime import datetime
+
+import redis
+
+from analysis_engine import MicroCapAnalyzer
+from config import Config
+from models import get_db_session, AnalyzerRun
+from redis_client import get_redis
+
+REFRESH_LOCK_KEY = "analyzer:refresh:lock"
+
+
+class AnalyzerRunStore:
+    """
+    Stored MicroCapAnalyzer results. Readers get the latest completed run; refreshes
+    recompute in the background and are deduplicated with a Redis lock (a process-local
+    lock when Redis is not configured).
+    """
+
+    def __init__(self):
+        self._local_lock = threading.Lock()
+        self._rows = (None, [])  # ((run_key, completed_at), parsed results) of the last run served
+
+    def rows(self, run):
+        """Parsed results of a completed run (memoized per process, runs are immutable)."""
+        version, rows = self._rows
+        if version != (run.run_key, run.completed_at):
+            rows = json.loads(run.results or "[]")
+            self._rows = ((run.run_key, run.completed_at), rows)
+        return rows
+
+    def latest_completed(self, db):
+        return (
+            db.query(AnalyzerRun)
+            .filter(AnalyzerRun.status == "complete")
+            .order_by(AnalyzerRun.completed_at.desc())
+            .first()
+        )
+
+    def run(self, analyzer=None, force=False):
+        """
+        Runs the analyzer and stores the result under its run key. Returns the run key.
+        A forced refresh of a completed run recomputes first and replaces its results only
+        on success, so readers keep getting the previous results meanwhile (and after a failure).
+        """
+        analyzer = analyzer or MicroCapAnalyzer()
+        run_key = analyzer.run_key()
+        with get_db_session() as db:
+            existing = db.get(AnalyzerRun, run_key)
+            if existing is not None and existing.status == "complete":
+                if not force:
+                    return run_key
+                self._recompute(db, analyzer, existing)
+                return run_key
+            run = db.merge(AnalyzerRun(
+                run_key=run_key,
+                data_version=analyzer.data_version(),
+                params=json.dumps(analyzer.params(), sort_keys=True),
+                status="running",
+                results=None,
+                error=None,
+                started_at=datetime.utcnow(),
+                completed_at=None,
+            ))
+            db.commit()
+            try:
+                ranked = analyzer.rank_universe(top_n=Config.ANALYZER_MAX_RESULTS)
+                run.results = ranked.to_json(orient="records")
+                run.row_count = len(ranked)
+                run.status = "complete"
+            except Exception as e:
+                run.status = "failed"
+                run.error = str(e)
+                print(f"Analyzer run {run_key} failed: {e}")
+            run.completed_at = datetime.utcnow()
+            self._prune(db)
+            db.commit()
+        return run_key
+
+    def _recompute(self, db, analyzer, run):
+        """Swaps fresh results into a completed run in one commit; keeps the old ones on failure."""
+        started_at = datetime.utcnow()
+        try:
+            ranked = analyzer.rank_universe(top_n=Config.ANALYZER_MAX_RESULTS)
+        except Exception as e:
+            print(f"Analyzer refresh of {run.run_key} failed; keeping the previous results: {e}")
+            return
+        run.results = ranked.to_json(orient="records")
+        run.row_count = len(ranked)
+        run.started_at = started_at
+        run.completed_at = datetime.utcnow()
+        self._prune(db)
+        db.commit()
+
+    def _prune(self, db):
+        keep = [k for (k,) in (
+            db.query(AnalyzerRun.run_key)
+            .filter(AnalyzerRun.status == "complete")
+            .order_by(AnalyzerRun.completed_at.desc())
+            .limit(Config.ANALYZER_RUN_RETENTION)
+        )]
+        db.query(AnalyzerRun).filter(AnalyzerRun.status != "running", ~AnalyzerRun.run_key.in_(keep)) \
+            .delete(synchronize_session=False)
+
+    # --- Refresh deduplication ---
+
+    def try_acquire_refresh(self):
+        """True if this caller owns the refresh; concurrent callers get False."""
+        client = get_redis()
+        if client is None:
+            return self._local_lock.acquire(blocking=False)
+        try:
+            return bool(client.set(REFRESH_LOCK_KEY, "1", nx=True, ex=Config.ANALYZER_REFRESH_LOCK_TTL))
+        except redis.exceptions.RedisError as e:
+            print(f"Analyzer refresh lock unavailable: {e}")
+            return self._local_lock.acquire(blocking=False)
+
+    def release_refresh(self):
+        client = get_redis()
+        if client is not None:
+            try:
+                client.delete(REFRESH_LOCK_KEY)
+            except redis.exceptions.RedisError:
+                pass
+        if self._local_lock.locked():
+            self._local_lock.release()
+
+    def refresh_pending(self):
+        client = get_redis()
+        if client is None:
+            return self._local_lock.locked()
+        try:
+            return bool(client.exists(REFRESH_LOCK_KEY))
+        except redis.exceptions.RedisError:
+            return self._local_lock.locked()
+
+# Singleton instance
+ANALYZER_RUNS = AnalyzerRunStore()
@@ -1,21 +1,43 @@
+import json
+import threading
+import time
+from datetime import datetime
+
 import sentry_sdk
-from flask import Flask, jsonify, request, abort
+from flask import Flask, Response, g, jsonify, request, abort, stream_with_context
+from sqlalchemy.exc import SQLAlchemyError
+from werkzeug.exceptions import HTTPException
 from functools import wraps
 
-from analysis_features import AF
-from data_providers import DP
-from models import get_db_session, SectorPerformance, PriceAlert, User, DeviceToken
+from analysis_features import AF, iter_analysis_hub_data
+from hub_snapshots import HUB_SNAPSHOTS
+from http_cache import (cached_json, compress_response, not_modified, not_modified_response,
+                        get_version, set_version, content_etag, HEATMAP_VERSION_KEY)
+from data_providers import DP, ProviderError
+from models import get_db_session, SectorPerformance, PriceAlert, AlertDirection, User, DeviceToken
+from alert_engine import publish_alert_event, REDIS_ALERT_BOOK
 from config import Config
+from metrics import REGISTRY, HTTP_REQUEST_DURATION
 
-# Import the analyzer for the admin route (Gap 3)
+# Stored analyzer runs for the admin route (Gap 3)
+from analyzer_runs import ANALYZER_RUNS
 from analysis_engine import MicroCapAnalyzer
+from factor_engine import FACTORS, DEFAULT_SCENARIOS, scenario_records
+from tasks import refresh_analyzer_run
+from redis_client import get_redis
 
 # --- Recommendation: Initialize Sentry ---
+UNTRACED_PATHS = {"/api/v1/health", "/api/v1/metrics"}  # Polled by load balancers and scrapers
+
+def _traces_sampler(context):
+    path = (context.get("wsgi_environ") or {}).get("PATH_INFO")
+    return 0.0 if path in UNTRACED_PATHS else Config.SENTRY_TRACES_SAMPLE_RATE
+
 if Config.SENTRY_DSN:
     sentry_sdk.init(
         dsn=Config.SENTRY_DSN,
         integrations=[sentry_sdk.integrations.flask.FlaskIntegration()],
-        traces_sample_rate=1.0,
+        traces_sampler=_traces_sampler,
         send_default_pii=True
     )
 # --- End Sentry Init ---
@@ -24,6 +46,22 @@ if Config.SENTRY_DSN:
 app = Flask(__name__)
 app.config.from_object(Config)
 
+# --- Metrics: request latency per route (registered first, so it runs after compression) ---
+@app.before_request
+def _start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def _record_request_duration(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_REQUEST_DURATION.observe(time.perf_counter() - started, route=route,
+                                      method=request.method, status=str(response.status_code))
+    return response
+
+app.after_request(compress_response)
+
 # --- Authentication Decorator (Stub) ---
 # You MUST implement this using your authentication provider (e.g., Firebase Admin SDK)
 # to validate the 'Authorization: Bearer <TOKEN>' header.
@@ -62,44 +100,145 @@ def require_auth(f):
 def health_check():
     return jsonify({"status": "healthy"}), 200
 
-# Internal helper to fetch the hub data
-def fetch_analysis_hub_data(ticker):
-    # (Implementation Required: Fetch Fundamentals)
-    
-    # NEW: Automated Technical Analysis
-    technicals = AF.analyze_technicals(ticker)
-    
-    # NEW: Institutional Ownership
-    ownership = AF.analyze_ownership(ticker)
-    
-    return {
-        "ticker": ticker,
-        "redFlags": AF.analyze_red_flags(ticker),
-        "insiderActivity": AF.analyze_insider_activity(ticker),
-        "liquidity": AF.analyze_liquidity(ticker),
-        "sentiment": {"score": 0.1, "sentiment": "Neutral", "articleCount": 5}, # Placeholder
-        "fundamentalsChart": [], # Placeholder
-        "technicals": technicals,
-        "ownership": ownership
-    }
+@app.route('/api/v1/metrics', methods=['GET'])
+def metrics():
+    """
+    Prometheus text exposition: deployment-wide totals (via Redis) plus this process's gauges.
+    Scrapers send METRICS_TOKEN; without one configured, only admins can read it.
+    """
+    if not Config.METRICS_TOKEN:
+        return _admin_metrics()
+    if request.headers.get('Authorization') != f"Bearer {Config.METRICS_TOKEN}":
+        abort(401, description="Invalid metrics token")
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@require_auth
+def _admin_metrics():
+    if not getattr(request, 'is_admin', False):
+        abort(403, description="Admin privileges required")
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
 @app.route('/api/v1/analysis/hub/<ticker>', methods=['GET'])
 @require_auth 
 def get_analysis_hub(ticker):
-    data = fetch_analysis_hub_data(ticker.upper())
-    return jsonify(data)
+    # Served from the nightly snapshot; built live only if it is missing or stale
+    data = HUB_SNAPSHOTS.get_hub_data(ticker.upper())
+    # Build metadata is left out of the ETag so an identical rebuild still answers 304
+    return cached_json(data, Config.HUB_CACHE_MAX_AGE, etag_exclude=("asOf", "source", "sectionTimings"))
+
+@app.route('/api/v1/analysis/hub/batch', methods=['POST'])
+@require_auth
+def get_analysis_hub_batch():
+    """
+    Hubs for a watchlist ({"tickers": [...]}) as NDJSON, one payload per line in
+    completion order: snapshots first, then live builds as each one finishes.
+    """
+    tickers = (request.json or {}).get('tickers')
+    if not isinstance(tickers, list) or not tickers or not all(isinstance(t, str) and t.strip() for t in tickers):
+        abort(400, description="tickers must be a non-empty list of symbols.")
+    tickers = list(dict.fromkeys(t.strip().upper() for t in tickers))
+    if len(tickers) > Config.HUB_BATCH_MAX_TICKERS:
+        abort(400, description=f"At most {Config.HUB_BATCH_MAX_TICKERS} tickers per request.")
+
+    def generate():
+        for _, data in HUB_SNAPSHOTS.iter_hub_data(tickers):
+            yield json.dumps(data, separators=(",", ":")) + "\n"
+
+    response = Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+    response.headers["Cache-Control"] = "private, no-store"
+    response.headers["X-Accel-Buffering"] = "no"  # Let nginx pass lines through as they are written
+    return response
 
 # --- Feature: Sector Heatmap Endpoint ---
 @app.route('/api/v1/market/heatmap', methods=['GET'])
 @require_auth
 def get_sector_heatmap():
+    # The ETag is derived from SectorPerformance.last_updated, stamped in Redis by the
+    # heatmap task, so a repeat poll is answered 304 without a database query.
+    stamp = get_version(HEATMAP_VERSION_KEY)
+    if stamp and not_modified(content_etag(stamp.encode())):
+        return not_modified_response(content_etag(stamp.encode()), Config.HEATMAP_CACHE_MAX_AGE)
+
     with get_db_session() as db:
         performance_data = db.query(SectorPerformance).all()
-    results = [{"sector": item.sector, "performance_pct": item.performance_pct} for item in performance_data]
-    return jsonify(results)
+    results = [
+        {
+            "sector": item.sector,
+            "performance_pct": item.performance_pct,
+            "equal_weight_pct": item.equal_weight_pct,
+            "constituents": item.constituents,
+        }
+        for item in performance_data
+    ]
+    last_updated = max((item.last_updated for item in performance_data), default=None)
+    if last_updated is None:
+        return cached_json(results, Config.HEATMAP_CACHE_MAX_AGE)
+    stamp = last_updated.isoformat()
+    set_version(HEATMAP_VERSION_KEY, stamp)
+    return cached_json(results, Config.HEATMAP_CACHE_MAX_AGE, etag=content_etag(stamp.encode()),
+                       last_modified=last_updated)
 
 # --- Feature: Price Alerts API ---
-# (Implementation for GET, POST, DELETE /api/v1/alerts remains as detailed in previous iterations)
+def _alert_json(alert):
+    return {
+        "id": alert.id,
+        "ticker": alert.ticker,
+        "target_price": alert.target_price,
+        "direction": alert.direction.value,
+        "is_active": alert.is_active,
+    }
+
+@app.route('/api/v1/alerts', methods=['GET'])
+@require_auth
+def list_alerts():
+    with get_db_session() as db:
+        alerts = db.query(PriceAlert).filter(PriceAlert.user_uid == request.user_uid).all()
+        return jsonify([_alert_json(alert) for alert in alerts])
+
+@app.route('/api/v1/alerts', methods=['POST'])
+@require_auth
+def create_alert():
+    data = request.json or {}
+    ticker = (data.get('ticker') or '').upper()
+    try:
+        target_price = float(data.get('target_price'))
+        direction = AlertDirection(data.get('direction'))
+    except (TypeError, ValueError):
+        abort(400, description="ticker, target_price and direction ('above' or 'below') are required.")
+    if not ticker:
+        abort(400, description="ticker, target_price and direction ('above' or 'below') are required.")
+
+    with get_db_session() as db:
+        try:
+            alert = PriceAlert(user_uid=request.user_uid, ticker=ticker, target_price=target_price, direction=direction)
+            db.add(alert)
+            db.commit()
+            # Keep the streaming alert service's in-memory book and the Redis book in sync
+            publish_alert_event("add", alert)
+            REDIS_ALERT_BOOK.add_alert(alert)
+            return jsonify(_alert_json(alert)), 201
+        except Exception as e:
+            db.rollback()
+            print(f"Error creating alert: {e}")
+            abort(500, description="Could not create alert.")
+
+@app.route('/api/v1/alerts/<int:alert_id>', methods=['DELETE'])
+@require_auth
+def delete_alert(alert_id):
+    with get_db_session() as db:
+        try:
+            alert = db.query(PriceAlert).filter(PriceAlert.id == alert_id, PriceAlert.user_uid == request.user_uid).first()
+            if not alert:
+                return jsonify({"status": "not_found", "message": "Alert not found."}), 404
+            db.delete(alert)
+            db.commit()
+            publish_alert_event("remove", alert)
+            REDIS_ALERT_BOOK.remove_alert(alert)
+            return jsonify({"status": "success", "message": "Alert deleted."}), 200
+        except Exception as e:
+            db.rollback()
+            print(f"Error deleting alert: {e}")
+            abort(500, description="Could not delete alert.")
 
 
 # --- Admin Curation API (Integrating Conviction Score) ---
@@ -112,7 +251,7 @@ def publish_curated_pick():
     data = request.json
     ticker = data.get('ticker')
     
-    analysis_hub_data = fetch_analysis_hub_data(ticker)
+    analysis_hub_data = HUB_SNAPSHOTS.get_hub_data(ticker)
     
     analyst_inputs = {
         'thesis_strength': data.get('thesis_strength', 3) # 1-5 scale
@@ -173,10 +312,18 @@ def delete_account():
             if not user:
                 return jsonify({"status": "not_found", "message": "User not found."}), 404
             
+            alerts = (
+                db.query(PriceAlert.id, PriceAlert.user_uid, PriceAlert.ticker, PriceAlert.target_price, PriceAlert.direction)
+                .filter(PriceAlert.user_uid == user_uid, PriceAlert.is_active == True)
+                .all()
+            )
+
             # Deleting the user will automatically delete their
             # PriceAlerts and DeviceTokens thanks to `ondelete="CASCADE"`
             db.delete(user)
             db.commit()
+            for alert in alerts:
+                REDIS_ALERT_BOOK.remove_alert(alert)
             
             # --- CRITICAL ---
             # You MUST also make API calls here to delete the user
@@ -196,32 +343,133 @@ def delete_account():
 
 
 # --- GAP 3 Fix: Admin Portal Candidates Route ---
+def _request_analyzer_refresh():
+    """Starts a background analyzer run unless one is already in flight."""
+    if not ANALYZER_RUNS.try_acquire_refresh():
+        return "already_running"
+    if get_redis() is None:
+        # No broker: run in-process (the local lock dedupes concurrent requests)
+        threading.Thread(target=refresh_analyzer_run, kwargs={"force": True, "lock_held": True}, daemon=True).start()
+    else:
+        refresh_analyzer_run.delay(force=True, lock_held=True)
+    return "started"
+
+def _latest_analyzer_rows():
+    """(run_key, completed_at, rows) of the latest stored run; ranks in the request if runs can't be stored."""
+    try:
+        with get_db_session() as db:
+            run = ANALYZER_RUNS.latest_completed(db)
+            if run is None:
+                # First load ever: nothing stored yet, so run once in the request
+                ANALYZER_RUNS.run()
+                run = ANALYZER_RUNS.latest_completed(db)
+            if run is None:
+                abort(500, description="Analysis engine failed.")
+            return run.run_key, run.completed_at, ANALYZER_RUNS.rows(run)
+    except SQLAlchemyError as e:
+        print(f"Analyzer runs unavailable; ranking in the request: {e}")
+        analyzer = MicroCapAnalyzer()
+        ranked = analyzer.rank_universe(top_n=Config.ANALYZER_MAX_RESULTS)
+        return analyzer.run_key(), datetime.utcnow(), json.loads(ranked.to_json(orient="records"))
+
 @app.route('/api/v1/admin/candidates', methods=['GET'])
 @require_auth
 def get_admin_candidates():
+    """
+    Latest completed analyzer run, paged with ?limit=&offset= (default 10 / 0).
+    ?refresh=1 starts a background recomputation; the current run is returned meanwhile.
+    Run metadata is in the X-Analyzer-Run, X-Analyzer-As-Of, X-Total-Count and
+    X-Refresh-Status headers.
+    """
     if not getattr(request, 'is_admin', False):
         abort(403, description="Admin privileges required")
-         
+
     try:
-        analyzer = MicroCapAnalyzer()
-        # This function fetches data, filters, and ranks
-        candidates_df = analyzer.run_analysis()
-        
-        # Add live price from data provider
-        tickers = candidates_df['Ticker'].tolist()
+        limit = min(max(int(request.args.get('limit', 10)), 1), 500)
+        offset = max(int(request.args.get('offset', 0)), 0)
+    except ValueError:
+        abort(400, description="limit and offset must be integers.")
+    refresh_status = None
+    if request.args.get('refresh', '').lower() in ('1', 'true'):
+        refresh_status = _request_analyzer_refresh()
+
+    try:
+        run_key, completed_at, rows = _latest_analyzer_rows()
+        total = len(rows)
+
+        # Add live price for the requested page only
+        candidates = [dict(row) for row in rows[offset:offset + limit]]
+        tickers = [c['Ticker'] for c in candidates]
         if tickers:
-            prices = DP.get_latest_trades_bulk(tickers)
-            candidates_df['Price'] = candidates_df['Ticker'].map(prices)
-        
-        # Convert DataFrame to JSON format expected by the admin portal
+            try:
+                prices = DP.get_latest_trades_bulk(tickers)
+            except ProviderError as e:
+                print(f"Live prices unavailable for /admin/candidates: {e}")
+                prices = {}
+            for candidate in candidates:
+                candidate['Price'] = prices.get(candidate['Ticker'])
+
+            # Conviction for the whole page in one vectorized pass (unpublished candidates use
+            # the default thesis strength). Hubs come from the nightly snapshots, which cover
+            # the stored run; at most HUB_ADMIN_LIVE_BUILDS missing ones (e.g. right after a
+            # forced refresh) are built live, and any others get None for both fields.
+            hubs = HUB_SNAPSHOTS.get_stored_hub_data(tickers)
+            missing = [t for t in tickers if t not in hubs][:Config.HUB_ADMIN_LIVE_BUILDS]
+            if missing:
+                hubs.update(iter_analysis_hub_data(missing))
+            scored = [c for c in candidates if c['Ticker'] in hubs]
+            scores, classes = AF.calculate_conviction_scores(AF.conviction_inputs([hubs[c['Ticker']] for c in scored]))
+            for candidate in candidates:
+                candidate['ConvictionScore'] = candidate['ConvictionClassification'] = None
+            for candidate, score, classification in zip(scored, scores, classes):
+                candidate['ConvictionScore'] = float(score)
+                candidate['ConvictionClassification'] = classification
+
         # 'records' format: [{"Ticker": "ACME", "MarketCap": 120.5, ...}]
-        candidates_json = candidates_df.to_dict(orient='records')
-        
-        return jsonify(candidates_json)
+        response = jsonify(candidates)
+        response.headers['X-Analyzer-Run'] = run_key
+        response.headers['X-Analyzer-As-Of'] = completed_at.isoformat() + "Z"
+        response.headers['X-Total-Count'] = str(total)
+        if refresh_status:
+            response.headers['X-Refresh-Status'] = refresh_status
+        elif ANALYZER_RUNS.refresh_pending():
+            response.headers['X-Refresh-Status'] = "running"
+        return response
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error in /admin/candidates: {e}")
         abort(500, description=f"Analysis engine failed: {e}")
 
+@app.route('/api/v1/admin/candidates/scenarios', methods=['POST'])
+@require_auth
+def get_candidate_scenarios():
+    """
+    Top-N candidates under several factor weightings from one analyzer pass.
+    Body: {"scenarios": {"name": {"quality": 0.4, "value": 0.4, "alignment": 0.2}, ...}, "limit": 10}
+    (scenarios default to factor_engine.DEFAULT_SCENARIOS).
+    """
+    if not getattr(request, 'is_admin', False):
+        abort(403, description="Admin privileges required")
+
+    data = request.json or {}
+    scenarios = data.get('scenarios') or DEFAULT_SCENARIOS
+    try:
+        limit = min(max(int(data.get('limit', 10)), 1), 500)
+    except (TypeError, ValueError):
+        abort(400, description="limit must be an integer.")
+    if not isinstance(scenarios, dict) or not all(isinstance(w, dict) for w in scenarios.values()):
+        abort(400, description="scenarios must map a name to {factor: weight}.")
+
+    try:
+        results = MicroCapAnalyzer().rank_scenarios(scenarios, top_n=limit)
+    except ValueError as e:
+        abort(400, description=str(e))
+    return jsonify({
+        "factors": {name: factor.description for name, factor in FACTORS.items()},
+        "scenarios": scenario_records(results),
+    })
+
 
 if __name__ == '__main__':
     # Development only.
@@ -0,0 +1,191 @@
+"""
+Offline backtester for the analyzer's screen + composite score.
+
+Works on a (dates x tickers x fields) float32 panel stored on local disk and
+memory-mapped by every worker, so no provider calls and no per-date run_analysis():
+
+- Within a date, filters, percentile ranks and scores are vectorized across tickers
+  (same rules as MicroCapAnalyzer.apply_strict_filters / multi_factor_ranking).
+- Rebalance dates are split into chunks and screened on a process pool.
+- The top-N basket at each rebalance is held for `horizon` bars; reports forward
+  returns vs the equal-weighted screened universe, hit rate and turnover.
+
+Panel layout (see write_panel): <dir>/meta.json + <dir>/panel.npy (float32). Missing values are NaN.
+
+    python backtest.py --panel /data/panels/microcap --top-n 10 --horizon 21
+"""
+import argparse
+import json
+import os
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from analysis_engine import MicroCapAnalyzer
+from factor_engine import FACTORS
+
+Panel = namedtuple("Panel", ["dates", "tickers", "fields", "data"])  # data: (dates, tickers, fields) memmap
+
+SCREEN_FIELDS = ("MarketCap", "Volume", "PE_Ratio", "ROIC")
+PRICE_FIELD = "Close"
+
+
+def write_panel(path, dates, tickers, fields, data):
+    """Writes a panel directory. `data` is (len(dates), len(tickers), len(fields))."""
+    os.makedirs(path, exist_ok=True)
+    data = np.asarray(data, dtype=np.float32)
+    assert data.shape == (len(dates), len(tickers), len(fields)), data.shape
+    out = np.lib.format.open_memmap(os.path.join(path, "panel.npy"), mode="w+", dtype=np.float32, shape=data.shape)
+    out[:] = data
+    out.flush()
+    with open(os.path.join(path, "meta.json"), "w") as f:
+        json.dump({"dates": [str(d) for d in dates], "tickers": list(tickers), "fields": list(fields)}, f)
+
+
+def open_panel(path):
+    """Memory-maps a panel read-only (pages are shared across worker processes)."""
+    with open(os.path.join(path, "meta.json")) as f:
+        meta = json.load(f)
+    data = np.load(os.path.join(path, "panel.npy"), mmap_mode="r")
+    return Panel(meta["dates"], meta["tickers"], meta["fields"], data)
+
+
+def _pct_rank(values, ascending):
+    """pandas rank(pct=True) semantics (average ties) on a 1-D array without NaNs."""
+    return pd.Series(values).rank(pct=True, ascending=ascending).to_numpy(dtype=np.float64)
+
+
+def screen_date(frame, field_index, params, weights, top_n, score_field=None):
+    """
+    One date: (tickers x fields) -> (top-N ticker indices best first, screened-universe indices).
+    Vectorized across tickers.
+    """
+    col = lambda name: frame[:, field_index[name]]
+    with np.errstate(invalid="ignore"):
+        mask = col("MarketCap") >= params["min_market_cap"]
+        mask &= col("Volume") >= params["min_liquidity"]
+        mask &= col("ROIC") >= params["min_roic"]
+        mask &= col("PE_Ratio") > 0
+        mask &= np.isfinite(col(PRICE_FIELD))
+    universe = np.flatnonzero(mask)
+    if not len(universe):
+        return universe, universe
+
+    if score_field is not None:
+        score = col(score_field)[universe].astype(np.float64)
+        score = np.where(np.isnan(score), -np.inf, score)
+    else:
+        score = np.zeros(len(universe))
+        for name, weight in weights.items():
+            factor = FACTORS[name]
+            values = col(factor.column)[universe]
+            score += weight * _pct_rank(values, factor.ascending)
+
+    n = min(top_n, len(universe))
+    top = np.argpartition(-score, n - 1)[:n]
+    top = top[np.argsort(-score[top], kind="stable")]
+    return universe[top], universe
+
+
+def _screen_chunk(args):
+    """Process-pool worker: opens the memmap once and screens a chunk of dates."""
+    path, date_indices, params, weights, top_n, score_field = args
+    panel = open_panel(path)
+    field_index = {f: j for j, f in enumerate(panel.fields)}
+    return [
+        (i, *screen_date(np.asarray(panel.data[i]), field_index, params, weights, top_n, score_field))
+        for i in date_indices
+    ]
+
+
+def run_backtest(path, top_n=10, horizon=21, weights=None, params=None, score_field=None,
+                 workers=None, chunk_size=16):
+    """
+    Screens every `horizon`-th date and holds the top-N basket for `horizon` bars.
+    Returns (summary dict, per-rebalance DataFrame).
+    """
+    analyzer = MicroCapAnalyzer()
+    params = params or analyzer.params()
+    weights = weights or analyzer.default_scenario()
+    panel = open_panel(path)
+    missing = [f for f in SCREEN_FIELDS + (PRICE_FIELD,) if f not in panel.fields]
+    missing += [FACTORS[name].column for name in weights if FACTORS[name].column not in panel.fields]
+    if score_field is not None and score_field not in panel.fields:
+        missing.append(score_field)
+    if missing:
+        raise ValueError(f"Panel is missing fields: {sorted(set(missing))}")
+
+    rebalances = list(range(0, len(panel.dates) - horizon, horizon))
+    chunks = [rebalances[i:i + chunk_size] for i in range(0, len(rebalances), chunk_size)]
+    jobs = [(path, chunk, params, weights, top_n, score_field) for chunk in chunks]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        screened = sorted((row for rows in pool.map(_screen_chunk, jobs) for row in rows), key=lambda row: row[0])
+
+    # Forward returns per rebalance: one vectorized division across all tickers.
+    close = panel.data[:, :, panel.fields.index(PRICE_FIELD)]
+    rows, previous = [], None
+    for i, basket, universe in screened:
+        with np.errstate(invalid="ignore", divide="ignore"):
+            forward = np.asarray(close[i + horizon], dtype=np.float64) / close[i] - 1
+        basket_returns = forward[basket]
+        basket_returns = basket_returns[np.isfinite(basket_returns)]
+        universe_returns = forward[universe]
+        universe_returns = universe_returns[np.isfinite(universe_returns)]
+        if not len(basket_returns) or not len(universe_returns):
+            continue
+        benchmark = universe_returns.mean()
+        held = set(basket.tolist())
+        rows.append({
+            "date": panel.dates[i],
+            "basket_size": len(basket),
+            "universe_size": len(universe),
+            "basket_return": basket_returns.mean(),
+            "universe_return": benchmark,
+            "excess_return": basket_returns.mean() - benchmark,
+            "hit_rate": (basket_returns > benchmark).mean(),
+            "turnover": np.nan if previous is None else 1 - len(held & previous) / max(len(held), 1),
+            "basket": " ".join(panel.tickers[j] for j in basket),  # Best first
+        })
+        previous = held
+
+    history = pd.DataFrame(rows)
+    if history.empty:
+        return {"rebalances": 0}, history
+    periods_per_year = 252 / horizon
+    excess = history["excess_return"]
+    summary = {
+        "rebalances": len(history),
+        "horizon_bars": horizon,
+        "top_n": top_n,
+        "mean_basket_return": history["basket_return"].mean(),
+        "mean_universe_return": history["universe_return"].mean(),
+        "mean_excess_return": excess.mean(),
+        "excess_t_stat": excess.mean() / (excess.std(ddof=1) / np.sqrt(len(excess))) if len(excess) > 1 else np.nan,
+        "annualized_excess": (1 + excess).prod() ** (periods_per_year / len(excess)) - 1,
+        "hit_rate": history["hit_rate"].mean(),
+        "mean_turnover": history["turnover"].mean(),
+    }
+    return summary, history
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--panel", required=True, help="Panel directory (meta.json + panel.npy)")
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--horizon", type=int, default=21, help="Holding period / rebalance step in bars")
+    parser.add_argument("--weights", type=json.loads, default=None,
+                        help='Factor weights, e.g. \'{"quality": 0.6, "value": 0.2, "alignment": 0.2}\'')
+    parser.add_argument("--score-field", default=None,
+                        help="Rank by a precomputed panel field (e.g. ConvictionScore) instead of the composite")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--history-csv", default=None, help="Write per-rebalance results here")
+    args = parser.parse_args()
+
+    summary, history = run_backtest(args.panel, args.top_n, args.horizon, args.weights,
+                                    score_field=args.score_field, workers=args.workers)
+    for key, value in summary.items():
+        print(f"{key:>22}: {value:.4f}" if isinstance(value, float) else f"{key:>22}: {value}")
+    if args.history_csv:
+        history.to_csv(args.history_csv, index=False)
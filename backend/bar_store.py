@@ -0,0 +1,121 @@
+import fcntl
+import os
+import re
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from config import Config
+
+# One fixed-width record per daily bar. Files are plain arrays of these records, so they
+# can be appended to with a single write and memory-mapped without parsing.
+BAR_DTYPE = np.dtype([
+    ("t", "<i8"),        # Bar open time, epoch milliseconds (Polygon's `t`)
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<f8"),
+])
+
+_EMPTY = np.empty(0, dtype=BAR_DTYPE)
+
+
+class BarStore:
+    """
+    Persistent per-ticker store of finalized daily bars on local disk.
+    Reads are memory-mapped; writes append new bars or atomically replace the file
+    (used when a split/dividend adjustment rewrites history).
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, ticker):
+        return os.path.join(self.root, re.sub(r"[^A-Za-z0-9._-]", "_", ticker) + ".bars")
+
+    @contextmanager
+    def _locked(self, ticker):
+        # Gunicorn threads and Celery workers on the same disk write through this lock.
+        with open(self._path(ticker) + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def read(self, ticker):
+        """Returns a read-only memory map of the ticker's bars (oldest first), or an empty array."""
+        path = self._path(ticker)
+        try:
+            n_records = os.path.getsize(path) // BAR_DTYPE.itemsize
+        except FileNotFoundError:
+            return _EMPTY
+        if n_records == 0:
+            return _EMPTY
+        return np.memmap(path, dtype=BAR_DTYPE, mode="r", shape=(n_records,))
+
+    def append(self, ticker, records):
+        """Appends bars newer than the last stored bar. Returns the number of bars written."""
+        with self._locked(ticker):
+            stored = self.read(ticker)
+            if len(stored):
+                records = records[records["t"] > stored["t"][-1]]
+            if len(records) == 0:
+                return 0
+            with open(self._path(ticker), "ab") as f:
+                f.write(np.ascontiguousarray(records, dtype=BAR_DTYPE).tobytes())
+            return len(records)
+
+    def replace(self, ticker, records):
+        """Atomically replaces the ticker's full history (readers keep their old mapping)."""
+        with self._locked(ticker):
+            path = self._path(ticker)
+            tmp_path = f"{path}.tmp.{os.getpid()}"
+            with open(tmp_path, "wb") as f:
+                f.write(np.ascontiguousarray(records, dtype=BAR_DTYPE).tobytes())
+            os.replace(tmp_path, path)
+
+    def invalidate(self, ticker):
+        with self._locked(ticker):
+            try:
+                os.remove(self._path(ticker))
+            except FileNotFoundError:
+                pass
+
+
+def records_from_polygon(results):
+    """Converts Polygon aggregate results (list of dicts) into BAR_DTYPE records."""
+    records = np.empty(len(results), dtype=BAR_DTYPE)
+    for field, key in (("t", "t"), ("open", "o"), ("high", "h"), ("low", "l"), ("close", "c"), ("volume", "v")):
+        records[field] = [item.get(key, np.nan) for item in results]
+    return records
+
+
+def bars_to_frame(records):
+    """
+    Wraps bar records in the OHLCV DataFrame shape used by AF.analyze_technicals.
+    Columns are views onto `records` (no copy when it is a memory map).
+    """
+    if len(records) == 0:
+        return pd.DataFrame()
+    index = pd.DatetimeIndex(pd.to_datetime(records["t"], unit="ms"), name="Date")
+    # The five price/volume fields are adjacent float64s, so the records can be viewed as
+    # an (n, 6) float matrix and the first column (the int64 timestamp) sliced off.
+    values = np.ascontiguousarray(records).view(np.float64).reshape(-1, len(BAR_DTYPE.names))[:, 1:]
+    return pd.DataFrame(values, index=index, columns=["Open", "High", "Low", "Close", "Volume"], copy=False)
+
+
+def _open_store():
+    if not Config.BAR_STORE_DIR:
+        return None
+    try:
+        return BarStore(Config.BAR_STORE_DIR)
+    except OSError as e:
+        print(f"Bar store disabled ({Config.BAR_STORE_DIR}): {e}")
+        return None
+
+# Singleton instance (None when no writable BAR_STORE_DIR is available)
+BARS = _open_store()
@@ -0,0 +1,97 @@
+"""
+Benchmark: price-alert evaluation at 1M active alerts.
+
+Compares the AlertBook (per-ticker sorted thresholds + binary search) against the
+previous per-alert Python loop. Runs offline; no database or API keys needed.
+
+    cd backend && python benchmarks/bench_alert_engine.py --alerts 1000000 --tickers 5000
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from alert_engine import AlertBook  # noqa: E402
+
+
+def make_alerts(n_alerts, n_tickers, seed=7):
+    """
+    A live alert book: ABOVE targets sit up to 30% over the last price and BELOW targets
+    up to 30% under it. Returns (alerts, next_tick_prices) where the tick moves every
+    ticker by a normal ~2%, so only alerts near the money trigger.
+    """
+    rng = np.random.default_rng(seed)
+    tickers = np.array([f"T{i:05d}" for i in range(n_tickers)], dtype=object)
+    base = rng.uniform(1, 100, n_tickers)
+    ticker_idx = rng.integers(0, n_tickers, n_alerts)
+    is_above = rng.random(n_alerts) < 0.5
+    offset = rng.uniform(0, 0.3, n_alerts)
+    targets = base[ticker_idx] * np.where(is_above, 1 + offset, 1 - offset)
+    alerts = {
+        "ids": np.arange(n_alerts, dtype=np.int64),
+        "user_uids": np.array([f"user{i}" for i in rng.integers(0, n_alerts // 10 + 1, n_alerts)], dtype=object),
+        "tickers": tickers[ticker_idx],
+        "targets": targets,
+        "is_above": is_above,
+    }
+    tick = base * (1 + rng.normal(0, 0.02, n_tickers))
+    return alerts, {t: float(p) for t, p in zip(tickers, tick)}
+
+
+def naive_loop(alerts, prices):
+    """The previous monitor_price_alerts evaluation: one Python comparison per alert."""
+    triggered = 0
+    for ticker, target, above in zip(alerts["tickers"], alerts["targets"], alerts["is_above"]):
+        price = prices.get(ticker)
+        if price is None:
+            continue
+        if (above and price >= target) or (not above and price <= target):
+            triggered += 1
+    return triggered
+
+
+def run(n_alerts, n_tickers, skip_naive=False):
+    alerts, prices = make_alerts(n_alerts, n_tickers)
+
+    started = time.perf_counter()
+    book = AlertBook.from_arrays(**alerts)
+    build_s = time.perf_counter() - started
+
+    # A single streamed trade for one ticker.
+    ticker, price = next(iter(prices.items()))
+    started = time.perf_counter()
+    book.evaluate({ticker: price})
+    single_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    triggered = book.evaluate(prices)
+    full_s = time.perf_counter() - started
+
+    result = {
+        "alerts": n_alerts,
+        "tickers": n_tickers,
+        "build_s": round(build_s, 4),
+        "evaluate_single_trade_s": round(single_s, 6),
+        "evaluate_full_market_s": round(full_s, 4),
+        "triggered": len(triggered),
+    }
+    if not skip_naive:
+        started = time.perf_counter()
+        naive_triggered = naive_loop(alerts, prices)
+        result["naive_loop_s"] = round(time.perf_counter() - started, 4)
+        assert naive_triggered == len(triggered), (naive_triggered, len(triggered))
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--alerts", type=int, default=1_000_000)
+    parser.add_argument("--tickers", type=int, default=5_000)
+    parser.add_argument("--skip-naive", action="store_true", help="Skip the per-alert loop baseline")
+    args = parser.parse_args()
+    for key, value in run(args.alerts, args.tickers, args.skip_naive).items():
+        print(f"{key:>24}: {value}")
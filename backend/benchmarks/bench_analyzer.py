@@ -0,0 +1,54 @@
+"""
+Benchmark: MicroCapAnalyzer screening at 2k, 50k and 500k securities.
+
+Each (rows, mode) case runs in a fresh subprocess so peak RSS is not polluted by earlier
+cases. Reports wall time of run_analysis() and the process's peak RSS, with the RSS of
+the same process just after imports as a baseline. Runs offline.
+
+    cd backend && python benchmarks/bench_analyzer.py --rows 2000 50000 500000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CASE = """
+import json, resource, sys, time
+sys.path.insert(0, {backend!r})
+from analysis_engine import MicroCapAnalyzer
+baseline_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+analyzer = MicroCapAnalyzer(lean={lean}, n_stocks={rows})
+started = time.perf_counter()
+candidates = analyzer.run_analysis()
+wall_s = time.perf_counter() - started
+peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"wall_s": wall_s, "peak_rss_mb": peak_kb / 1024, "baseline_rss_mb": baseline_kb / 1024,
+                  "top": candidates["Ticker"].tolist()}}))
+"""
+
+
+def run_case(rows, lean):
+    env = dict(os.environ, REDIS_URL="")
+    out = subprocess.run(
+        [sys.executable, "-c", _CASE.format(backend=BACKEND, lean=lean, rows=rows)],
+        capture_output=True, text=True, check=True, env=env,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[2_000, 50_000, 500_000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'mode':>8} {'wall_s':>8} {'peak_rss_mb':>12} {'over_baseline_mb':>17}")
+    for rows in args.rows:
+        results = {}
+        for lean in (False, True):
+            r = results[lean] = run_case(rows, lean)
+            print(f"{rows:>8} {'lean' if lean else 'default':>8} {r['wall_s']:>8.3f} "
+                  f"{r['peak_rss_mb']:>12.1f} {r['peak_rss_mb'] - r['baseline_rss_mb']:>17.1f}")
+        assert results[False]["top"] == results[True]["top"], "lean mode changed the top-N"
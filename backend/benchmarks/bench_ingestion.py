@@ -0,0 +1,88 @@
+"""
+Benchmark: materialized vs streaming fundamentals ingestion.
+
+Writes a CSV fundamentals file with the screener columns plus `--extra-columns` of
+other history/fundamental fields, then (each in a fresh subprocess) compares:
+
+- materialized: read the whole file into one DataFrame, then clean + filter
+- streaming:    MicroCapAnalyzer(source="csv:...").fetch_filtered() (chunked, screener
+                columns only, filtered per chunk)
+
+Reports wall time, peak RSS over the post-import RSS and surviving rows (Linux).
+
+    cd backend && python benchmarks/bench_ingestion.py --rows 1000000 --extra-columns 40
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_CASE = """
+import json, resource, sys, time
+sys.path.insert(0, {backend!r})
+import numpy as np, pandas as pd
+from analysis_engine import MicroCapAnalyzer
+analyzer = MicroCapAnalyzer(source="csv:" + {path!r})
+# Current (not peak) RSS as the baseline: import-time peaks would hide small workloads
+baseline_kb = int(next(l for l in open("/proc/self/status") if l.startswith("VmRSS")).split()[1])
+started = time.perf_counter()
+if {streaming}:
+    survivors = analyzer.fetch_filtered()
+else:
+    df = pd.read_csv({path!r})
+    df = df.replace([np.inf, -np.inf], np.nan).dropna(subset=['MarketCap', 'Volume', 'PE_Ratio', 'ROIC', 'InsiderOwnership'])
+    survivors = analyzer.apply_strict_filters(df)
+wall_s = time.perf_counter() - started
+peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"wall_s": wall_s, "over_baseline_mb": (peak_kb - baseline_kb) / 1024, "rows": len(survivors)}}))
+"""
+
+
+def write_fundamentals(path, rows, extra_columns, seed=5, chunk=250_000):
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, chunk):
+        n = min(chunk, rows - start)
+        df = pd.DataFrame({
+            "Ticker": [f"T{i}" for i in range(start, start + n)],
+            "MarketCap": rng.uniform(20, 3000, n),
+            "Volume": rng.integers(10000, 1000000, n),
+            "PE_Ratio": rng.uniform(-20, 60, n),
+            "ROIC": rng.uniform(-0.1, 0.4, n),
+            "InsiderOwnership": rng.uniform(0.01, 0.9, n),
+        })
+        for j in range(extra_columns):
+            df[f"Field{j}"] = rng.normal(size=n)
+        df.to_csv(path, mode="w" if start == 0 else "a", header=start == 0, index=False)
+
+
+def run_case(path, streaming):
+    out = subprocess.run(
+        [sys.executable, "-c", _CASE.format(backend=BACKEND, path=path, streaming=streaming)],
+        capture_output=True, text=True, check=True, env=dict(os.environ, REDIS_URL=""),
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--extra-columns", type=int, default=40)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "fundamentals.csv")
+        write_fundamentals(path, args.rows, args.extra_columns)
+        print(f"{'mode':>12} {'wall_s':>8} {'peak_rss_over_baseline_mb':>26} {'survivors':>10}")
+        results = {}
+        for streaming in (False, True):
+            r = results[streaming] = run_case(path, streaming)
+            print(f"{'streaming' if streaming else 'materialized':>12} {r['wall_s']:>8.2f} "
+                  f"{r['over_baseline_mb']:>26.1f} {r['rows']:>10}")
+        assert results[False]["rows"] == results[True]["rows"]
@@ -0,0 +1,291 @@
+"""
+Benchmark suite: the real request, alert and push paths against local upstream stand-ins.
+
+Starts fake_upstream.FakeUpstream (Polygon/Tiingo) and FakeAPNsClient, points the backend
+at them with a throwaway SQLite database and bar store, then runs:
+
+- hub:      GET /api/v1/analysis/hub/<ticker> through a threaded WSGI server, cold (fresh
+            tickers, one request each) and warm, at each --concurrency level
+- alerts:   tasks.monitor_price_alerts over --alert-counts active alerts (load, bulk
+            prices, evaluate, deactivate + push), with per-stage seconds from metrics.py
+- analyzer: MicroCapAnalyzer.run_analysis() at each --universe size (bench_analyzer.py)
+- push:     PNS.send_batch fan-out at each --push-counts size
+
+Results go to --out as JSON (one record per case, keyed by "case") so two runs can be
+diffed. Redis is off unless --redis-url is given.
+
+    cd backend && python benchmarks/bench_suite.py --out bench.json
+    cd backend && python benchmarks/bench_suite.py --scenarios hub alerts --latency-ms 40 --error-rate 0.02
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+BACKEND = os.path.dirname(BENCHMARKS)
+sys.path.insert(0, BACKEND)
+
+from fake_upstream import FakeAPNsClient, FakeUpstream, base_price  # noqa: E402
+
+SCENARIOS = ("hub", "alerts", "analyzer", "push")
+
+
+def configure_backend(upstream, workdir, redis_url):
+    """Environment for the backend modules; must run before any of them is imported."""
+    os.environ.update(
+        POLYGON_API_KEY="bench", TIINGO_API_KEY="bench",
+        POLYGON_BASE_URL=upstream.base_url, TIINGO_BASE_URL=upstream.base_url,
+        DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        BAR_STORE_DIR=os.path.join(workdir, "bars"),
+        REDIS_URL=redis_url,
+        ALERT_STREAM_ENABLED="false",
+    )
+
+
+def percentiles(samples):
+    values = np.asarray(samples, dtype=float) * 1000
+    if not len(values):
+        return {}
+    p50, p95, p99 = (float(p) for p in np.percentile(values, [50, 95, 99]))
+    return {"p50_ms": round(p50, 2), "p95_ms": round(p95, 2), "p99_ms": round(p99, 2),
+            "max_ms": round(float(values.max()), 2), "mean_ms": round(float(values.mean()), 2)}
+
+
+def timed_requests(base_url, paths, concurrency):
+    """GETs every path with `concurrency` keep-alive clients. Returns (latencies, statuses, wall_s)."""
+    import requests
+
+    local = threading.local()
+
+    def get(path):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+            session.headers["Authorization"] = "Bearer VALID_USER_TOKEN"
+        started = time.perf_counter()
+        response = session.get(base_url + path, timeout=60)
+        response.content
+        return time.perf_counter() - started, response.status_code
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(get, paths))
+    wall_s = time.perf_counter() - started
+    return [r[0] for r in results], [r[1] for r in results], wall_s
+
+
+def bench_hub(upstream, args):
+    from werkzeug.serving import make_server
+
+    from app import app
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)  # No access log line per request
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    cases = []
+    try:
+        for concurrency in args.concurrency:
+            tickers = [f"H{concurrency}X{i:03d}" for i in range(args.hub_tickers)]
+            upstream.reset_calls()
+            for phase, paths in (("cold", tickers), ("warm", tickers * args.hub_repeats)):
+                latencies, statuses, wall_s = timed_requests(
+                    base_url, [f"/api/v1/analysis/hub/{t}" for t in paths], concurrency)
+                cases.append({
+                    "case": f"hub/{phase}/c{concurrency}", "concurrency": concurrency, "requests": len(paths),
+                    "errors": sum(1 for s in statuses if s != 200), "wall_s": round(wall_s, 3),
+                    "requests_per_s": round(len(paths) / wall_s, 1), **percentiles(latencies),
+                    "upstream_calls": upstream.reset_calls(),
+                })
+    finally:
+        server.shutdown()
+    return cases
+
+
+def seed_alerts(n_alerts, n_tickers, prefix, seed=7):
+    """
+    Replaces every alert, user and device token with `n_alerts` active alerts over
+    `n_tickers` tickers: ABOVE targets up to 30% over the ticker's base price, BELOW up to
+    30% under, one user per 10 alerts and one device token per user.
+    """
+    from models import AlertDirection, DeviceToken, PriceAlert, User, engine
+
+    rng = np.random.default_rng(seed)
+    tickers = [f"{prefix}{i:05d}" for i in range(n_tickers)]
+    bases = np.array([base_price(t) for t in tickers])
+    ticker_idx = rng.integers(0, n_tickers, n_alerts)
+    is_above = rng.random(n_alerts) < 0.5
+    offset = rng.uniform(0, 0.3, n_alerts)
+    targets = bases[ticker_idx] * np.where(is_above, 1 + offset, 1 - offset)
+    n_users = n_alerts // 10 + 1
+    user_idx = rng.integers(0, n_users, n_alerts)
+
+    chunk = 50_000
+    with engine.begin() as conn:
+        for table in (PriceAlert.__table__, DeviceToken.__table__, User.__table__):
+            conn.execute(table.delete())
+        for start in range(0, n_users, chunk):
+            users = range(start, min(start + chunk, n_users))
+            conn.execute(User.__table__.insert(), [{"uid": f"u{u}", "is_subscribed": True} for u in users])
+            conn.execute(DeviceToken.__table__.insert(),
+                         [{"user_uid": f"u{u}", "token": f"{prefix}{u:060x}"} for u in users])
+        for start in range(0, n_alerts, chunk):
+            stop = min(start + chunk, n_alerts)
+            conn.execute(PriceAlert.__table__.insert(), [
+                {"user_uid": f"u{user_idx[i]}", "ticker": tickers[ticker_idx[i]], "target_price": float(targets[i]),
+                 "direction": AlertDirection.ABOVE if is_above[i] else AlertDirection.BELOW, "is_active": True}
+                for i in range(start, stop)
+            ])
+    return tickers
+
+
+def stage_seconds():
+    """Cumulative monitor_price_alerts seconds per stage, from the metrics registry."""
+    from metrics import ALERT_STAGE_DURATION, REGISTRY
+
+    REGISTRY.flush()
+    totals = REGISTRY.totals()
+    return {stage: totals.get(f'{ALERT_STAGE_DURATION.name}_sum{{stage="{stage}"}}', 0.0)
+            for stage in ("load", "prices", "evaluate", "deliver")}
+
+
+def bench_alerts(upstream, args):
+    from push_service import PNS
+    from redis_client import get_redis
+    from tasks import monitor_price_alerts, reconcile_alert_book
+
+    cases = []
+    for run, n_alerts in enumerate(args.alert_counts):
+        # Fresh tickers per run, so no snapshot price is served from the cache
+        started = time.perf_counter()
+        upstream.universe = seed_alerts(n_alerts, args.alert_tickers, prefix=f"A{run}T")
+        seed_s = time.perf_counter() - started
+        if get_redis() is not None:
+            reconcile_alert_book()
+
+        PNS.apns_client = apns = FakeAPNsClient(args.apns_latency_ms, invalid_rate=args.apns_invalid_rate)
+        upstream.reset_calls()
+        before = stage_seconds()
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):  # One "ALERT TRIGGERED" line per alert
+            result = monitor_price_alerts()
+        wall_s = time.perf_counter() - started
+        after = stage_seconds()
+        cases.append({
+            "case": f"alerts/{n_alerts}", "alerts": n_alerts, "tickers": args.alert_tickers,
+            "book": "redis" if get_redis() is not None else "database", "seed_s": round(seed_s, 3),
+            "wall_s": round(wall_s, 3), "alerts_per_s": round(n_alerts / wall_s, 1),
+            "stages_s": {stage: round(after[stage] - before[stage], 4) for stage in after},
+            "result": result, "push_batches": apns.batches, "upstream_calls": upstream.reset_calls(),
+        })
+    return cases
+
+
+def bench_analyzer(upstream, args):
+    from bench_analyzer import run_case
+
+    cases = []
+    for rows in args.universe:
+        for lean in (False, True):
+            r = run_case(rows, lean)
+            cases.append({
+                "case": f"analyzer/{rows}/{'lean' if lean else 'default'}", "rows": rows,
+                "wall_s": round(r["wall_s"], 3), "peak_rss_mb": round(r["peak_rss_mb"], 1),
+                "over_baseline_mb": round(r["peak_rss_mb"] - r["baseline_rss_mb"], 1),
+            })
+    return cases
+
+
+def bench_push(upstream, args):
+    from push_service import PNS
+
+    payload = PNS.build_payload("SMALL hit $4.20", "Your price alert for SMALL triggered.")
+    cases = []
+    for n in args.push_counts:
+        PNS.apns_client = apns = FakeAPNsClient(args.apns_latency_ms, invalid_rate=args.apns_invalid_rate)
+        messages = [(f"{i:064x}", payload) for i in range(n)]
+        started = time.perf_counter()
+        push = PNS.send_batch(messages)
+        wall_s = time.perf_counter() - started
+        cases.append({
+            "case": f"push/{n}", "notifications": n, "wall_s": round(wall_s, 3),
+            "notifications_per_s": round(n / wall_s, 1), "batches": apns.batches,
+            "invalid_tokens": len(push.invalid_tokens),
+            "failed": sum(1 for _, r in push.results if r != "Success"),
+        })
+    return cases
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--out", default="bench_results.json", help="JSON results file")
+    parser.add_argument("--redis-url", default="", help="Use this Redis (cache, alert book, metrics)")
+    upstream_args = parser.add_argument_group("fake upstream")
+    upstream_args.add_argument("--latency-ms", type=float, default=25.0)
+    upstream_args.add_argument("--jitter-ms", type=float, default=5.0)
+    upstream_args.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered 503")
+    upstream_args.add_argument("--throttle-rate", type=float, default=0.0, help="Share of requests answered 429")
+    upstream_args.add_argument("--apns-latency-ms", type=float, default=20.0, help="Round trip per push batch")
+    upstream_args.add_argument("--apns-invalid-rate", type=float, default=0.01)
+    sizes = parser.add_argument_group("scenario sizes")
+    sizes.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    sizes.add_argument("--hub-tickers", type=int, default=32, help="Distinct tickers per concurrency level")
+    sizes.add_argument("--hub-repeats", type=int, default=4, help="Warm requests per ticker")
+    sizes.add_argument("--alert-counts", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    sizes.add_argument("--alert-tickers", type=int, default=5_000)
+    sizes.add_argument("--universe", type=int, nargs="+", default=[2_000, 50_000, 500_000])
+    sizes.add_argument("--push-counts", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    args = parser.parse_args()
+
+    upstream = FakeUpstream(args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate).start()
+    workdir = tempfile.mkdtemp(prefix="smallcap-bench-")
+    configure_backend(upstream, workdir, args.redis_url)
+
+    from models import Base, engine
+
+    Base.metadata.create_all(engine)
+
+    report = {
+        "meta": {
+            "started_at": datetime.utcnow().isoformat() + "Z", "revision": git_revision(),
+            "python": platform.python_version(), "platform": platform.platform(),
+            "args": vars(args),
+        },
+        "cases": [],
+    }
+    runners = {"hub": bench_hub, "alerts": bench_alerts, "analyzer": bench_analyzer, "push": bench_push}
+    try:
+        for name in args.scenarios:
+            print(f"--- {name} ---")
+            for case in runners[name](upstream, args):
+                report["cases"].append(case)
+                headline = {k: v for k, v in case.items() if not isinstance(v, (dict, list)) and k != "case"}
+                print(f"{case['case']:>28}: {headline}")
+    finally:
+        upstream.stop()
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2, default=str)
+    print(f"Wrote {len(report['cases'])} cases to {args.out}")
@@ -0,0 +1,200 @@
+"""
+Local stand-ins for the upstream services, so benchmarks run without API keys.
+
+FakeUpstream is a threaded HTTP/1.1 (keep-alive) server answering the Polygon and Tiingo
+endpoints the backend calls:
+
+- /v2/aggs/ticker/<T>/range/1/day/<from>/<to>        daily bars (weekdays)
+- /v2/aggs/grouped/locale/us/market/stocks/<day>      every universe ticker's bar
+- /v2/snapshot/locale/us/markets/stocks/tickers       ?tickers=A,B or the whole universe
+- /tiingo/fundamentals/<T>/ownership                  13F holders
+
+Any ticker is accepted; prices are deterministic per ticker (see base_price / last_price).
+Each request waits `latency_ms` (+/- `jitter_ms`), and fails with a 503 or a 429 with
+probability `error_rate` / `throttle_rate`, which exercises the transport's retries.
+
+apns2 talks HTTP/2 over TLS to Apple, so APNs is stood in at the client instead:
+FakeAPNsClient replaces PNS.apns_client and answers send_notification_batch with one
+round trip per batch and a fixed share of permanently invalid tokens.
+"""
+import json
+import math
+import random
+import threading
+import time
+import zlib
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from zoneinfo import ZoneInfo
+
+ET = ZoneInfo("America/New_York")
+SNAPSHOT_PATH = "/v2/snapshot/locale/us/markets/stocks/tickers"
+
+
+def _hash(text):
+    return zlib.crc32(text.encode())
+
+
+def base_price(ticker):
+    """$1-$101, fixed per ticker. Daily bars oscillate around it."""
+    return 1.0 + (_hash(ticker) % 10_000) / 100
+
+
+def last_price(ticker, tick=0):
+    """Latest trade: base_price moved by a deterministic ~2% (normal) for this tick."""
+    rng = random.Random(_hash(ticker) ^ (tick * 7919))
+    return round(base_price(ticker) * (1 + rng.gauss(0, 0.02)), 4)
+
+
+def daily_bar(ticker, day):
+    h = _hash(ticker)
+    close = base_price(ticker) * (1 + 0.1 * math.sin(day.toordinal() / (7 + h % 13)))
+    midnight = datetime(day.year, day.month, day.day, tzinfo=ET)
+    return {"t": int(midnight.timestamp() * 1000), "o": close * 0.99, "h": close * 1.02,
+            "l": close * 0.98, "c": close, "v": 50_000 + h % 500_000, "vw": close}
+
+
+def _weekdays(start, end):
+    day = start
+    while day <= end:
+        if day.weekday() < 5:
+            yield day
+        day += timedelta(days=1)
+
+
+class FakeUpstream:
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, throttle_rate=0.0, seed=7):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.universe = []  # Tickers in grouped-daily and full-market snapshot responses
+        self.tick = 0       # Bump to move every last_price
+        self.calls = {}     # Endpoint kind -> requests served (errors included)
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def base_url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        upstream = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real providers
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                status, body = upstream.handle(self.path)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fake-upstream", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def reset_calls(self):
+        with self._lock:
+            calls, self.calls = self.calls, {}
+        return calls
+
+    def _draw(self):
+        with self._lock:
+            delay = max(0.0, self._rng.gauss(self.latency_ms, self.jitter_ms)) if self.jitter_ms else self.latency_ms
+            return delay / 1000, self._rng.random()
+
+    def handle(self, raw_path):
+        """(status, JSON body) for one request."""
+        url = urlparse(raw_path)
+        path, query = url.path, parse_qs(url.query)
+        kind = self._kind(path)
+        with self._lock:
+            self.calls[kind] = self.calls.get(kind, 0) + 1
+
+        delay, roll = self._draw()
+        if delay:
+            time.sleep(delay)
+        if roll < self.error_rate:
+            return 503, {"status": "ERROR", "error": "Injected upstream failure."}
+        if roll < self.error_rate + self.throttle_rate:
+            return 429, {"status": "ERROR", "error": "Injected rate limit."}
+
+        if kind == "aggs":
+            parts = path.split("/")
+            ticker, start, end = parts[4], date.fromisoformat(parts[8]), date.fromisoformat(parts[9])
+            return 200, {"results": [daily_bar(ticker, d) for d in _weekdays(start, min(end, date.today()))]}
+        if kind == "grouped":
+            day = date.fromisoformat(path.rsplit("/", 1)[1])
+            if day.weekday() >= 5 or day > date.today():
+                return 200, {"results": []}
+            return 200, {"results": [dict(daily_bar(t, day), T=t) for t in self.universe]}
+        if kind == "snapshot":
+            tickers = query["tickers"][0].split(",") if "tickers" in query else self.universe
+            return 200, {"tickers": [self._snapshot_item(t) for t in tickers]}
+        if kind == "ownership":
+            h = _hash(path.split("/")[3])
+            return 200, {"ownership": [
+                {"entityName": f"Fund {j}", "marketValue": 1_000 * (h % 97 + j + 1), "changeInShares": (h >> j) % 21 - 10}
+                for j in range(12)
+            ]}
+        return 404, {"status": "NOT_FOUND"}
+
+    @staticmethod
+    def _kind(path):
+        if path.startswith("/v2/aggs/grouped/"):
+            return "grouped"
+        if path.startswith("/v2/aggs/ticker/"):
+            return "aggs"
+        if path == SNAPSHOT_PATH:
+            return "snapshot"
+        if path.startswith("/tiingo/fundamentals/") and path.endswith("/ownership"):
+            return "ownership"
+        return "other"
+
+    def _snapshot_item(self, ticker):
+        price = last_price(ticker, self.tick)
+        day = daily_bar(ticker, date.today())
+        return {"ticker": ticker, "lastTrade": {"p": price}, "day": dict(day, c=price)}
+
+
+class FakeAPNsClient:
+    """
+    Stands in for apns2.client.APNsClient. A batch costs one round trip (`latency_ms`)
+    plus `per_push_us` per notification; `invalid_rate` of tokens (fixed per token) come
+    back Unregistered or BadDeviceToken, the rest Success.
+    """
+
+    def __init__(self, latency_ms=20.0, per_push_us=5.0, invalid_rate=0.01):
+        self.latency_ms = latency_ms
+        self.per_push_us = per_push_us
+        self.invalid_rate = invalid_rate
+        self.batches = 0
+        self.notifications = 0
+
+    def _result(self, token):
+        roll = (_hash(token) % 10_000) / 10_000
+        if roll >= self.invalid_rate:
+            return "Success"
+        return ("Unregistered", int(time.time())) if roll < self.invalid_rate / 2 else "BadDeviceToken"
+
+    def send_notification_batch(self, notifications, topic=None, **kwargs):
+        self.batches += 1
+        self.notifications += len(notifications)
+        time.sleep(self.latency_ms / 1000 + len(notifications) * self.per_push_us / 1e6)
+        return {n.token: self._result(n.token) for n in notifications}
@@ -0,0 +1,348 @@
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from zoneinfo import ZoneInfo
+
+import redis
+
+from config import Config
+from provider_transport import ProviderError
+from redis_client import get_redis
+from single_flight import SINGLE_FLIGHT, flight_key
+
+MARKET_TZ = ZoneInfo("America/New_York")
+
+
+def ttl_until_next_market_close(now=None):
+    """Seconds until the next 4:00 PM ET weekday close (daily bars only change then)."""
+    now = now or datetime.now(MARKET_TZ)
+    close = now.replace(hour=16, minute=0, second=0, microsecond=0)
+    if now >= close or now.weekday() >= 5:
+        close += timedelta(days=1)
+    while close.weekday() >= 5:
+        close += timedelta(days=1)
+    # Give the provider a few minutes after the bell to publish the final bar.
+    return max(60, int((close - now).total_seconds()) + 300)
+
+
+def last_market_close_date(now=None):
+    """Date of the most recent completed weekday session (today once it is past 4:00 PM ET)."""
+    now = now or datetime.now(MARKET_TZ)
+    day = now.date() if now.hour >= 16 else now.date() - timedelta(days=1)
+    while day.weekday() >= 5:
+        day -= timedelta(days=1)
+    return day
+
+
+class LRUCache:
+    """
+    In-process tier: bounded LRU with per-entry TTL. Thread safe. Entries outlive their
+    TTL by `stale_ttl` so get_stale() can still return them as a fallback.
+    """
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()  # key -> (fresh_until, expires_at, value)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "expired": 0}
+
+    def get(self, key):
+        """Returns (hit, value) for a fresh entry."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return False, None
+            fresh_until, expires_at, value = entry
+            now = time.monotonic()
+            if fresh_until <= now:
+                if expires_at <= now:
+                    del self._data[key]
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return False, None
+            self._data.move_to_end(key)
+            self.stats["hits"] += 1
+            return True, value
+
+    def get_stale(self, key):
+        """Returns (hit, value) for an entry past its TTL but still within its stale window."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[1] <= time.monotonic():
+                return False, None
+            return True, entry[2]
+
+    def set(self, key, value, ttl, stale_ttl=0):
+        with self._lock:
+            now = time.monotonic()
+            self._data[key] = (now + ttl, now + ttl + stale_ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def __len__(self):
+        return len(self._data)
+
+
+class RedisCache:
+    """
+    Shared tier in Redis. Our Redis runs with `noeviction` (it is also the Celery broker),
+    so this tier bounds itself: every key is indexed in a sorted set by last access and
+    the least recently used keys are dropped once the index exceeds max_keys.
+    """
+
+    PREFIX = "cache:v2:"  # Values are pickled (fresh_until, value) pairs
+    INDEX = "cache:__lru__"
+
+    def __init__(self, max_keys, max_value_bytes):
+        self.max_keys = max_keys
+        self.max_value_bytes = max_value_bytes
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "errors": 0, "skipped_large": 0}
+        self._lock = threading.Lock()
+        self._retry_at = 0.0
+
+    def _client(self):
+        if time.monotonic() < self._retry_at:
+            return None
+        return get_redis()
+
+    def _failed(self):
+        with self._lock:
+            self.stats["errors"] += 1
+        self._retry_at = time.monotonic() + 30
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def get_many(self, keys):
+        """
+        Returns {key: (value, fresh_seconds_left)} for the keys found. Entries past their
+        TTL but inside their stale window come back with fresh_seconds_left <= 0.
+        """
+        client = self._client()
+        if client is None or not keys:
+            return {}
+        try:
+            pipe = client.pipeline(transaction=False)
+            for key in keys:
+                pipe.get(self.PREFIX + key)
+            raw = pipe.execute()
+            found, now = {}, time.time()
+            for key, blob in zip(keys, raw):
+                if blob is not None:
+                    fresh_until, value = pickle.loads(blob)
+                    found[key] = (value, fresh_until - now)
+            if found:
+                client.zadd(self.INDEX, {self.PREFIX + key: now for key in found})
+            fresh = sum(1 for _, left in found.values() if left > 0)
+            self._count("hits", fresh)
+            self._count("misses", len(keys) - fresh)
+            return found
+        except redis.exceptions.RedisError:
+            self._failed()
+            return {}
+
+    def set_many(self, items, ttl, stale_ttl=0):
+        """Stores {key: value} with a shared TTL (kept `stale_ttl` longer), then trims the LRU index."""
+        client = self._client()
+        if client is None or not items:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            now = time.time()
+            for key, value in items.items():
+                blob = pickle.dumps((now + ttl, value), protocol=pickle.HIGHEST_PROTOCOL)
+                if len(blob) > self.max_value_bytes:
+                    self._count("skipped_large")
+                    continue
+                pipe.set(self.PREFIX + key, blob, ex=max(1, int(ttl + stale_ttl)))
+                pipe.zadd(self.INDEX, {self.PREFIX + key: now})
+            pipe.zcard(self.INDEX)
+            size = pipe.execute()[-1]
+            if size > self.max_keys:
+                victims = [member for member, _ in client.zpopmin(self.INDEX, size - self.max_keys)]
+                if victims:
+                    client.delete(*victims)
+                    self._count("evictions", len(victims))
+        except redis.exceptions.RedisError:
+            self._failed()
+
+
+# --- Stale reads: callers can tell when any value they got was a last known good fallback ---
+_stale = threading.local()
+
+@contextmanager
+def stale_reads():
+    """Yields a list that collects (namespace, key) for every stale value served to this thread."""
+    previous = getattr(_stale, "reads", None)
+    _stale.reads = reads = []
+    try:
+        yield reads
+    finally:
+        _stale.reads = previous
+        if previous is not None:
+            previous.extend(reads)
+
+def bind_stale_reads(fn):
+    """fn wrapped to record its stale reads into this thread's stale_reads(), for work handed to a pool."""
+    reads = getattr(_stale, "reads", None)
+    if reads is None:
+        return fn
+
+    def run(*args, **kwargs):
+        previous = getattr(_stale, "reads", None)
+        _stale.reads = reads
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _stale.reads = previous
+    return run
+
+_REFRESH_EXECUTOR = ThreadPoolExecutor(max_workers=Config.CACHE_REFRESH_WORKERS, thread_name_prefix="cache-refresh")
+
+
+class TieredCache:
+    """
+    Read-through cache in front of provider calls: in-process LRU first, then Redis
+    (shared by every web instance and worker), then the loader.
+
+    Stale-while-revalidate on failure: expired values are kept for `stale_ttl` more
+    seconds (CACHE_STALE_TTL by default). When the loader raises ProviderError (deadline
+    passed, circuit open, ...) or leaves a key out, the last known good value is returned
+    instead, recorded for stale_reads(), and a background refresh is queued.
+    """
+
+    def __init__(self, local_max_entries, redis_max_keys, redis_max_value_bytes):
+        self.local = LRUCache(local_max_entries)
+        self.shared = RedisCache(redis_max_keys, redis_max_value_bytes)
+        self._lock = threading.Lock()
+        self._refreshing = set()
+        self.swr_stats = {"stale_served": 0, "refreshes": 0, "refresh_errors": 0}
+
+    def get_many(self, namespace, keys, ttl, loader, cacheable=None, stale_ttl=None):
+        """
+        Returns {key: value} for `keys`. `loader(missing_keys)` must return a dict for
+        whatever it could fetch; keys it leaves out are not cached (and not returned,
+        unless a stale value is available). Values failing `cacheable` are returned uncached.
+        """
+        results, missing, stale = self._lookup(namespace, keys, ttl)
+        if missing:
+            results.update(self._load(namespace, missing, ttl, loader, cacheable, stale_ttl, stale))
+        return results
+
+    def get_or_load(self, namespace, key, ttl, loader, cacheable=None, stale_ttl=None):
+        """Single-key read-through. Values failing `cacheable` (e.g. empty results) are returned uncached."""
+        results, missing, stale = self._lookup(namespace, [key], ttl)
+        if not missing:
+            return results[key]
+        return self._load(namespace, [key], ttl, lambda _keys: {key: loader()}, cacheable, stale_ttl, stale)[key]
+
+    def _lookup(self, namespace, keys, ttl):
+        """(fresh hits, missing keys, {missing key: stale value}) from the local tier, then Redis."""
+        results, missing = {}, []
+        for key in keys:
+            hit, value = self.local.get(f"{namespace}:{key}")
+            if hit:
+                results[key] = value
+            else:
+                missing.append(key)
+        if not missing:
+            return results, missing, {}
+
+        shared = self.shared.get_many([f"{namespace}:{key}" for key in missing])
+        still_missing, stale = [], {}
+        for key in missing:
+            entry = shared.get(f"{namespace}:{key}")
+            if entry is not None and entry[1] > 0:
+                value, remaining = entry
+                self.local.set(f"{namespace}:{key}", value, min(ttl, remaining), Config.CACHE_STALE_TTL)
+                results[key] = value
+                continue
+            still_missing.append(key)
+            if entry is not None:
+                stale[key] = entry[0]
+            else:
+                hit, value = self.local.get_stale(f"{namespace}:{key}")
+                if hit:
+                    stale[key] = value
+        return results, still_missing, stale
+
+    def _load(self, namespace, keys, ttl, loader, cacheable=None, stale_ttl=None, stale=None):
+        """
+        Calls the loader and stores its values in both tiers. Concurrent identical misses
+        (in this process or on other instances) share one call, see single_flight.py.
+        Falls back to `stale` values for keys the loader could not provide.
+        """
+        stale_ttl = Config.CACHE_STALE_TTL if stale_ttl is None else stale_ttl
+        stale = stale if stale_ttl > 0 else {}
+
+        def load_and_store():
+            loaded = loader(keys) or {}
+            store = {key: value for key, value in loaded.items() if cacheable is None or cacheable(value)}
+            for key, value in store.items():
+                self.local.set(f"{namespace}:{key}", value, ttl, stale_ttl)
+            self.shared.set_many({f"{namespace}:{key}": value for key, value in store.items()}, ttl, stale_ttl)
+            return loaded
+
+        flight = flight_key("cache", namespace, *keys)
+        try:
+            loaded = SINGLE_FLIGHT.do(flight, load_and_store)
+        except ProviderError as e:
+            if not stale:
+                raise
+            print(f"Serving {len(stale)} stale '{namespace}' value(s): {e}")
+            loaded = {}
+
+        fallback = {key: value for key, value in stale.items() if key not in loaded}
+        if fallback:
+            with self._lock:
+                self.swr_stats["stale_served"] += len(fallback)
+            if getattr(_stale, "reads", None) is not None:
+                _stale.reads.extend((namespace, key) for key in fallback)
+            self._refresh(flight, load_and_store)
+            loaded = {**loaded, **fallback}
+        return loaded
+
+    def _refresh(self, flight, load_and_store):
+        """Queues one background reload per key set (coalesced with any foreground load)."""
+        with self._lock:
+            if flight in self._refreshing:
+                return
+            self._refreshing.add(flight)
+            self.swr_stats["refreshes"] += 1
+
+        def run():
+            try:
+                SINGLE_FLIGHT.do(flight, load_and_store)
+            except Exception as e:
+                with self._lock:
+                    self.swr_stats["refresh_errors"] += 1
+                print(f"Background cache refresh failed: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing.discard(flight)
+
+        _REFRESH_EXECUTOR.submit(run)
+
+    def set(self, namespace, key, value, ttl, stale_ttl=None):
+        """Writes one value to both tiers (for read-modify-write entries)."""
+        stale_ttl = Config.CACHE_STALE_TTL if stale_ttl is None else stale_ttl
+        self.local.set(f"{namespace}:{key}", value, ttl, stale_ttl)
+        self.shared.set_many({f"{namespace}:{key}": value}, ttl, stale_ttl)
+
+    def stats(self):
+        return {
+            "local": dict(self.local.stats, size=len(self.local)),
+            "redis": dict(self.shared.stats),
+            "stale": dict(self.swr_stats),
+        }
+
+
+CACHE = TieredCache(Config.CACHE_LOCAL_MAX_ENTRIES, Config.CACHE_REDIS_MAX_KEYS, Config.CACHE_REDIS_MAX_VALUE_BYTES)
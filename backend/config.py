@@ -16,6 +16,7 @@ class Config:
         
     # Redis Configuration (Provided by Render)
     REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+    REDIS_SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", "0.5"))  # Seconds
 
     # --- ADDITIONS ---
 
@@ -30,3 +31,104 @@ class Config:
     APNS_KEY_FILE_PATH = os.environ.get("APNS_KEY_FILE_PATH", "/app/AuthKey_APNS.p8") # Path within the container
     APNS_BUNDLE_ID = os.environ.get("APNS_BUNDLE_ID", "com.yourapp.microcap") # Your app's bundle ID
     APNS_IS_SANDBOX = os.environ.get("APNS_IS_SANDBOX", "false").lower() == "true"
+    APNS_MAX_IN_FLIGHT = int(os.environ.get("APNS_MAX_IN_FLIGHT", "500"))  # Concurrent HTTP/2 streams per batch
+
+    # --- Performance: Analysis Hub ---
+    # Each hub section (technicals, ownership, ...) runs concurrently; a section that
+    # misses the deadline is returned as a stale/error marker instead of blocking.
+    HUB_SECTION_TIMEOUT = float(os.environ.get("HUB_SECTION_TIMEOUT", "4.0"))  # Seconds for the whole hub
+    HUB_MAX_WORKERS = int(os.environ.get("HUB_MAX_WORKERS", "16"))
+    HUB_PRECOMPUTE_WORKERS = int(os.environ.get("HUB_PRECOMPUTE_WORKERS", "4"))  # Tickers built side by side
+    HUB_SNAPSHOT_RETENTION_DAYS = int(os.environ.get("HUB_SNAPSHOT_RETENTION_DAYS", "7"))
+    # Top rows of the latest stored analyzer run that get nightly snapshots (what /admin/candidates pages through)
+    HUB_SNAPSHOT_MAX_CANDIDATES = int(os.environ.get("HUB_SNAPSHOT_MAX_CANDIDATES", "1000"))
+    HUB_ADMIN_LIVE_BUILDS = int(os.environ.get("HUB_ADMIN_LIVE_BUILDS", "10"))  # Missing hubs built per /admin/candidates page
+    HUB_BATCH_MAX_TICKERS = int(os.environ.get("HUB_BATCH_MAX_TICKERS", "50"))  # Per /analysis/hub/batch request
+    HUB_BATCH_TIMEOUT = float(os.environ.get("HUB_BATCH_TIMEOUT", "10.0"))  # Seconds for a whole batch
+    # Provider calls under a section end this long before its deadline, leaving time to fall back to stale data
+    HUB_FALLBACK_MARGIN = float(os.environ.get("HUB_FALLBACK_MARGIN", "0.5"))
+
+    # --- Performance: Analyzer Runs ---
+    ANALYZER_LEAN_MODE = os.environ.get("ANALYZER_LEAN_MODE", "false").lower() == "true"  # Full-market screens
+    ANALYZER_MAX_RESULTS = int(os.environ.get("ANALYZER_MAX_RESULTS", "1000"))  # Ranked rows stored per run
+    # "csv:/path", "parquet:/path" or "sql:table"; unset uses the simulated universe
+    ANALYZER_FUNDAMENTALS_SOURCE = os.environ.get("ANALYZER_FUNDAMENTALS_SOURCE", "")
+    ANALYZER_CHUNK_ROWS = int(os.environ.get("ANALYZER_CHUNK_ROWS", "100000"))  # Rows per streamed chunk
+    ANALYZER_REFRESH_LOCK_TTL = int(os.environ.get("ANALYZER_REFRESH_LOCK_TTL", "900"))  # Seconds; dedupes refreshes
+    ANALYZER_RUN_RETENTION = int(os.environ.get("ANALYZER_RUN_RETENTION", "30"))  # Completed runs kept
+
+    # --- Performance: HTTP Caching ---
+    # ETag/304 and Cache-Control on read endpoints; bodies above the threshold are gzip'd
+    # (brotli when the optional `brotli` package is installed and the client accepts it).
+    HUB_CACHE_MAX_AGE = int(os.environ.get("HUB_CACHE_MAX_AGE", "60"))  # Seconds
+    HEATMAP_CACHE_MAX_AGE = int(os.environ.get("HEATMAP_CACHE_MAX_AGE", "300"))
+    COMPRESS_MIN_BYTES = int(os.environ.get("COMPRESS_MIN_BYTES", "1024"))
+
+    # --- Performance: Provider Transport ---
+    POLYGON_BASE_URL = os.environ.get("POLYGON_BASE_URL", "https://api.polygon.io")
+    TIINGO_BASE_URL = os.environ.get("TIINGO_BASE_URL", "https://api.tiingo.com")
+    # Token-bucket quotas per API key (requests/second and burst size). Shared through Redis
+    # so gunicorn threads and Celery workers draw from the same plan allowance.
+    POLYGON_RATE_LIMIT = float(os.environ.get("POLYGON_RATE_LIMIT", "50"))
+    POLYGON_RATE_BURST = int(os.environ.get("POLYGON_RATE_BURST", "100"))
+    TIINGO_RATE_LIMIT = float(os.environ.get("TIINGO_RATE_LIMIT", "10"))
+    TIINGO_RATE_BURST = int(os.environ.get("TIINGO_RATE_BURST", "20"))
+    PROVIDER_RATE_WAIT = float(os.environ.get("PROVIDER_RATE_WAIT", "2.0"))  # Max seconds to wait for a token
+    PROVIDER_MAX_RETRIES = int(os.environ.get("PROVIDER_MAX_RETRIES", "3"))
+    PROVIDER_BACKOFF_BASE = float(os.environ.get("PROVIDER_BACKOFF_BASE", "0.25"))  # Seconds
+    PROVIDER_BACKOFF_CAP = float(os.environ.get("PROVIDER_BACKOFF_CAP", "4.0"))  # Seconds
+    PROVIDER_POOL_SIZE = int(os.environ.get("PROVIDER_POOL_SIZE", "20"))  # Keep-alive connections per provider
+    PROVIDER_TIMEOUT = float(os.environ.get("PROVIDER_TIMEOUT", "10.0"))  # Per-attempt socket timeout (seconds)
+    PROVIDER_CALL_DEADLINE = float(os.environ.get("PROVIDER_CALL_DEADLINE", "8.0"))  # Whole call incl. retries (seconds)
+    CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", "5"))  # Consecutive failed calls
+    CIRCUIT_RESET_TIMEOUT = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", "30.0"))  # Seconds open before a probe
+
+    # --- Performance: Provider Cache (in-process LRU + Redis) ---
+    CACHE_LOCAL_MAX_ENTRIES = int(os.environ.get("CACHE_LOCAL_MAX_ENTRIES", "2048"))
+    CACHE_REDIS_MAX_KEYS = int(os.environ.get("CACHE_REDIS_MAX_KEYS", "50000"))
+    CACHE_REDIS_MAX_VALUE_BYTES = int(os.environ.get("CACHE_REDIS_MAX_VALUE_BYTES", str(512 * 1024)))
+    SNAPSHOT_CACHE_TTL = int(os.environ.get("SNAPSHOT_CACHE_TTL", "15"))  # Seconds
+    OWNERSHIP_CACHE_TTL = int(os.environ.get("OWNERSHIP_CACHE_TTL", str(3 * 24 * 3600)))  # 13F data is quarterly
+    SECTOR_MAP_CACHE_TTL = int(os.environ.get("SECTOR_MAP_CACHE_TTL", str(7 * 24 * 3600)))  # Sectors and share counts
+    # Expired entries are kept this much longer as last known good values, served (marked
+    # stale) when the provider fails or its circuit is open, while a refresh runs in the background.
+    CACHE_STALE_TTL = int(os.environ.get("CACHE_STALE_TTL", str(24 * 3600)))
+    CACHE_REFRESH_WORKERS = int(os.environ.get("CACHE_REFRESH_WORKERS", "2"))
+
+    # --- Performance: Request Coalescing (single_flight.py) ---
+    # Identical concurrent provider/hub calls share one upstream request, across web
+    # instances through a short Redis lock plus a briefly published result.
+    SINGLE_FLIGHT_LOCK_TTL = float(os.environ.get("SINGLE_FLIGHT_LOCK_TTL", "10.0"))  # Seconds; also the max wait
+    SINGLE_FLIGHT_RESULT_TTL = float(os.environ.get("SINGLE_FLIGHT_RESULT_TTL", "5.0"))  # Seconds
+    SINGLE_FLIGHT_POLL_INTERVAL = float(os.environ.get("SINGLE_FLIGHT_POLL_INTERVAL", "0.05"))  # Seconds
+
+    # --- Performance: Local Daily Bar Store ---
+    # Finalized daily bars are kept on local disk so get_daily_ohlcv only fetches the gap.
+    # Set to an empty string to disable (every call then fetches the full window).
+    # On Render only the worker has a persistent disk (render.yaml), so the nightly backfill,
+    # indicator states and universe technicals survive deploys there. The /tmp default used
+    # by web instances is a per-instance cache, empty after each deploy and filled gap by gap
+    # as requests read bars.
+    BAR_STORE_DIR = os.environ.get("BAR_STORE_DIR", "/tmp/microcap_bars")
+    BAR_STORE_HISTORY_DAYS = int(os.environ.get("BAR_STORE_HISTORY_DAYS", "400"))  # Calendar days fetched on first sync
+    BAR_ADJUSTMENT_TOLERANCE = float(os.environ.get("BAR_ADJUSTMENT_TOLERANCE", "1e-4"))  # Relative close drift => re-adjusted history
+    # Batch syncs fill gaps of up to this many sessions from cached grouped-daily bars
+    BAR_GROUPED_SYNC_MAX_GAP = int(os.environ.get("BAR_GROUPED_SYNC_MAX_GAP", "5"))
+
+    # --- Performance: Bulk Snapshots ---
+    SNAPSHOT_BATCH_SIZE = int(os.environ.get("SNAPSHOT_BATCH_SIZE", "250"))  # Tickers per ?tickers= request
+    SNAPSHOT_MAX_PARALLEL = int(os.environ.get("SNAPSHOT_MAX_PARALLEL", "4"))
+    # At or above this many tickers, one full-market snapshot call is cheaper than N batches.
+    SNAPSHOT_FULL_MARKET_THRESHOLD = int(os.environ.get("SNAPSHOT_FULL_MARKET_THRESHOLD", "1500"))
+
+    # --- Performance: Streaming Price Alerts (alert_stream.py) ---
+    # When the streaming service runs, the minute-polling Celery task stands down.
+    ALERT_STREAM_ENABLED = os.environ.get("ALERT_STREAM_ENABLED", "false").lower() == "true"
+    POLYGON_WS_URL = os.environ.get("POLYGON_WS_URL", "wss://socket.polygon.io/stocks")
+    ALERT_STREAM_RESYNC_SECONDS = int(os.environ.get("ALERT_STREAM_RESYNC_SECONDS", "900"))  # Full reload from the DB
+
+    # --- Performance: Metrics (metrics.py, /api/v1/metrics) ---
+    # Each process adds its counters to one Redis hash this often, so a scrape covers every worker.
+    METRICS_FLUSH_INTERVAL = float(os.environ.get("METRICS_FLUSH_INTERVAL", "10.0"))  # Seconds
+    METRICS_TOKEN = os.environ.get("METRICS_TOKEN")  # Scrapers send "Authorization: Bearer <token>"; unset = admins only
+    SENTRY_TRACES_SAMPLE_RATE = float(os.environ.get("SENTRY_TRACES_SAMPLE_RATE", "0.05"))  # Health/metrics never sampled
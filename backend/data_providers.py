@@ -1,7 +1,29 @@
-import requests
+import time
+
+import numpy as np
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
 from config import Config
+from metrics import REGISTRY, PROVIDER_EVENTS, CACHE_EVENTS, SINGLE_FLIGHT_EVENTS
 from datetime import datetime, timedelta
+from bar_store import BARS, BAR_DTYPE, records_from_polygon, bars_to_frame
+from cache import CACHE, MARKET_TZ, bind_stale_reads, last_market_close_date, ttl_until_next_market_close
+from provider_transport import ProviderTransport, ProviderError, bind_deadline
+from single_flight import SINGLE_FLIGHT
+
+class PriceMap(dict):
+    """{ticker: last trade price} that also records which requested tickers had no price."""
+
+    def __init__(self, prices, missing=()):
+        super().__init__(prices)
+        self.missing = list(missing)
+
+# Snapshot batches run in parallel on a small shared pool (bounded by SNAPSHOT_MAX_PARALLEL).
+_SNAPSHOT_EXECUTOR = ThreadPoolExecutor(max_workers=Config.SNAPSHOT_MAX_PARALLEL, thread_name_prefix="snapshot")
+
+def _in_caller_scope(fn):
+    """Pool work inherits the caller's provider deadline and stale-read tracking (both thread-local)."""
+    return bind_stale_reads(bind_deadline(fn))
 
 class DataProviders:
     """Centralized service for interacting with Polygon and Tiingo."""
@@ -11,67 +33,454 @@ class DataProviders:
         self.tiingo_key = Config.TIINGO_API_KEY
         self.tiingo_headers = {'Authorization': f'Token {self.tiingo_key}', 'Content-Type': 'application/json'}
 
+        # Shared keep-alive pools + per-key rate limits (see provider_transport.py)
+        self.polygon = ProviderTransport(
+            "polygon", Config.POLYGON_BASE_URL, self.polygon_key,
+            Config.POLYGON_RATE_LIMIT, Config.POLYGON_RATE_BURST,
+        )
+        self.tiingo = ProviderTransport(
+            "tiingo", Config.TIINGO_BASE_URL, self.tiingo_key,
+            Config.TIINGO_RATE_LIMIT, Config.TIINGO_RATE_BURST, headers=self.tiingo_headers,
+        )
+
+    def transport_stats(self):
+        """Request, retry, throttle, error and circuit breaker counters for each provider."""
+        return {
+            t.name: dict(t.stats, circuit=t.breaker.state, **{f"circuit_{k}": v for k, v in t.breaker.stats.items()})
+            for t in (self.polygon, self.tiingo)
+        }
+
+    def cache_stats(self):
+        """Hit/miss/eviction counters for the in-process and Redis cache tiers."""
+        return CACHE.stats()
+
+    def coalesce_stats(self):
+        """Calls led vs callers that shared another caller's result (in-process and remote)."""
+        return dict(SINGLE_FLIGHT.stats)
+
     # --- Polygon: Market Data, OHLCV, News ---
     
     def get_daily_ohlcv(self, ticker, days_back=200):
-        """Fetches daily OHLCV for technical analysis (TA-Lib)."""
+        """
+        Fetches daily OHLCV for technical analysis (TA-Lib).
+        Cached until the next market close; treat the returned frame as read-only.
+        Raises ProviderError (or ProviderThrottled) if Polygon cannot be reached after retries.
+        """
         if not self.polygon_key: return pd.DataFrame()
-        
-        to_date = datetime.now()
-        from_date = to_date - timedelta(days=days_back + 100) 
+        return CACHE.get_or_load(
+            "ohlcv", f"{ticker}:{days_back}", ttl_until_next_market_close(),
+            lambda: self._fetch_daily_ohlcv(ticker, days_back), cacheable=_cacheable_frame,
+        )
 
-        url = f"https://api.polygon.io/v2/aggs/ticker/{ticker}/range/1/day/{from_date.strftime('%Y-%m-%d')}/{to_date.strftime('%Y-%m-%d')}?adjusted=true&sort=asc&limit=500&apiKey={self.polygon_key}"
-        
-        try:
-            response = requests.get(url)
-            response.raise_for_status()
-            results = response.json().get('results', [])
-            if not results: return pd.DataFrame()
+    def _fetch_daily_ohlcv(self, ticker, days_back):
+        if BARS is None:
+            to_date = datetime.now()
+            return bars_to_frame(self._fetch_daily_bars(ticker, to_date - timedelta(days=days_back + 100), to_date))
 
-            df = pd.DataFrame(results)
-            df = df.rename(columns={'c': 'Close', 'o': 'Open', 'h': 'High', 'l': 'Low', 'v': 'Volume', 't': 'Timestamp'})
-            df['Date'] = pd.to_datetime(df['Timestamp'], unit='ms')
-            df = df.set_index('Date')
-            return df[['Open', 'High', 'Low', 'Close', 'Volume']]
+        return self._ohlcv_frame(*self.sync_daily_bars(ticker), days_back)
 
-        except requests.exceptions.RequestException:
-            return pd.DataFrame()
+    @staticmethod
+    def _ohlcv_frame(stored, provisional, stale, days_back):
+        from_ms = int((datetime.now() - timedelta(days=days_back + 100)).timestamp() * 1000)
+        if len(provisional):
+            bars = np.concatenate([stored[stored['t'] >= from_ms], provisional])
+        else:
+            # Slice of the memory map; the frame's columns are views onto the file.
+            bars = stored[np.searchsorted(stored['t'], from_ms):]
+        df = bars_to_frame(bars)
+        if stale:
+            df.attrs['stale'] = True
+        return df
 
-    def get_latest_trades_bulk(self, tickers):
-        """Fetches the latest trade price for a list of tickers (Polygon Snapshots)."""
+    def get_daily_ohlcv_many(self, tickers, days_back=200):
+        """
+        {ticker: OHLCV frame} like get_daily_ohlcv, for a watchlist: cache hits are read in
+        one pass and the misses are synced together (see sync_daily_bars_many). Tickers
+        with no data (or whose fetch failed) are left out.
+        """
         if not self.polygon_key or not tickers: return {}
-        
-        url = f"https://api.polygon.io/v2/snapshot/locale/us/markets/stocks/tickers?tickers={','.join(tickers)}&apiKey={self.polygon_key}"
+        keys = {f"{t}:{days_back}": t for t in dict.fromkeys(tickers)}
+        frames = CACHE.get_many(
+            "ohlcv", list(keys), ttl_until_next_market_close(),
+            lambda missing: self._fetch_daily_ohlcv_many([keys[k] for k in missing], days_back),
+            cacheable=_cacheable_frame,
+        )
+        return {keys[k]: df for k, df in frames.items()}
+
+    def _fetch_daily_ohlcv_many(self, tickers, days_back):
+        if BARS is None:
+            def fetch(ticker):
+                try:
+                    return ticker, self._fetch_daily_ohlcv(ticker, days_back)
+                except ProviderError as e:
+                    print(f"OHLCV unavailable for {ticker}: {e}")
+                    return ticker, pd.DataFrame()
+            frames = dict(_SNAPSHOT_EXECUTOR.map(_in_caller_scope(fetch), tickers))
+        else:
+            frames = {
+                ticker: self._ohlcv_frame(*synced, days_back)
+                for ticker, synced in self.sync_daily_bars_many(tickers).items()
+                if not isinstance(synced, ProviderError)
+            }
+        return {f"{t}:{days_back}": df for t, df in frames.items() if not df.empty}
+
+    def _fetch_daily_bars(self, ticker, from_date, to_date):
+        """Raw Polygon daily aggregates for [from_date, to_date] as bar records."""
+        path = f"/v2/aggs/ticker/{ticker}/range/1/day/{from_date.strftime('%Y-%m-%d')}/{to_date.strftime('%Y-%m-%d')}"
+        params = {'adjusted': 'true', 'sort': 'asc', 'limit': 50000, 'apiKey': self.polygon_key}
+        return records_from_polygon(self.polygon.get_json(path, params).get('results', []))
+
+    def sync_daily_bars(self, ticker):
+        """
+        Brings the local bar store up to date for `ticker`, fetching only the gap since the
+        last stored bar. Returns (stored_bars, provisional_bars, stale):
+
+        - stored_bars: memory-mapped finalized bars (every session up to the last close,
+          so today's bar is stored once it is past 4:00 PM ET).
+        - provisional_bars: today's in-progress bar, returned but never persisted.
+        - stale: True when Polygon failed and only previously stored bars are returned.
+
+        The last stored bar is re-fetched as an overlap; if its close no longer matches,
+        Polygon has re-adjusted history (split/dividend) and the full history is replaced.
+        """
+        now = datetime.now(MARKET_TZ)
+        cutoff_ms = _final_cutoff_ms(now)
+        stored = BARS.read(ticker)
+
+        if len(stored):
+            last = stored[-1]
+            from_date = datetime.fromtimestamp(last['t'] / 1000, MARKET_TZ)
+        else:
+            from_date = now - timedelta(days=Config.BAR_STORE_HISTORY_DAYS)
+
         try:
-            response = requests.get(url)
-            response.raise_for_status()
-            data = response.json().get('tickers', [])
-            
-            price_map = {}
-            for item in data:
-                if 'lastTrade' in item and item['lastTrade'] and 'p' in item['lastTrade']:
-                     price_map[item['ticker']] = item['lastTrade']['p']
-            return price_map
+            fetched = self._fetch_daily_bars(ticker, from_date, now)
+        except ProviderError as e:
+            if not len(stored):
+                raise
+            print(f"Serving stored bars for {ticker}; gap fetch failed: {e}")
+            return stored, stored[:0], True
+
+        final, provisional = fetched[fetched['t'] < cutoff_ms], fetched[fetched['t'] >= cutoff_ms]
+
+        if len(stored):
+            overlap = final[final['t'] == last['t']]
+            drift = abs(overlap['close'][0] - last['close']) / max(abs(last['close']), 1e-9) if len(overlap) else 0.0
+            if drift > Config.BAR_ADJUSTMENT_TOLERANCE:
+                print(f"Adjusted history detected for {ticker} (close drift {drift:.4%}); re-fetching.")
+                history_from = now - timedelta(days=Config.BAR_STORE_HISTORY_DAYS)
+                fetched = self._fetch_daily_bars(ticker, history_from, now)
+                BARS.replace(ticker, fetched[fetched['t'] < cutoff_ms])
+                return BARS.read(ticker), fetched[fetched['t'] >= cutoff_ms], False
+
+        if len(final):
+            if len(stored):
+                BARS.append(ticker, final)
+            else:
+                BARS.replace(ticker, final)
+            stored = BARS.read(ticker)
+        return stored, provisional, False
+
+    def sync_daily_bars_many(self, tickers):
+        """
+        sync_daily_bars for many tickers with shared round trips. A ticker whose store is at
+        most BAR_GROUPED_SYNC_MAX_GAP sessions behind is filled from grouped daily bars (one
+        cached call per session for the whole market, which also serves the adjustment
+        check), and today's in-progress bars come from one snapshot request. Empty stores,
+        longer gaps and adjusted histories go through sync_daily_bars concurrently. Both
+        paths store every session up to last_market_close_date() and nothing after it.
+        Returns {ticker: (stored, provisional, stale) or the ProviderError raised}.
+        """
+        now = datetime.now(MARKET_TZ)
+        last_close = last_market_close_date(now)
+        sessions = {}
+
+        def session(day):
+            if day not in sessions:
+                sessions[day] = self.get_grouped_daily(day).drop_duplicates('ticker').set_index('ticker')
+            return sessions[day]
+
+        results, fallback = {}, []
+        for ticker in dict.fromkeys(tickers):
+            stored = BARS.read(ticker)
+            if not len(stored):
+                fallback.append(ticker)
+                continue
+            last = stored[-1]
+            last_day = datetime.fromtimestamp(last['t'] / 1000, MARKET_TZ).date()
+            days = [d for d in (last_day + timedelta(days=i) for i in range(1, (last_close - last_day).days + 1))
+                    if d.weekday() < 5]
+            try:
+                overlap = session(last_day) if len(days) <= Config.BAR_GROUPED_SYNC_MAX_GAP else None
+                if overlap is None or ticker not in overlap.index:
+                    fallback.append(ticker)
+                    continue
+                drift = abs(overlap.at[ticker, 'close'] - last['close']) / max(abs(last['close']), 1e-9)
+                if drift > Config.BAR_ADJUSTMENT_TOLERANCE:
+                    fallback.append(ticker)  # sync_daily_bars re-fetches the adjusted history
+                    continue
+                new = [(d, session(d).loc[ticker]) for d in days if ticker in session(d).index]
+            except ProviderError:
+                fallback.append(ticker)
+                continue
+            if new:
+                BARS.append(ticker, _grouped_records(new))
+                stored = BARS.read(ticker)
+            results[ticker] = stored
+
+        if results and now.weekday() < 5 and now.date() > last_close:
+            try:
+                items = self._fetch_snapshot_items(list(results))
+                provisional = {item['ticker']: item['day'] for item in items if (item.get('day') or {}).get('c')}
+                stale = False
+            except ProviderError as e:
+                print(f"Intraday bars unavailable; serving stored bars only: {e}")
+                provisional, stale = {}, True
+            today = now.date()
+            for ticker, stored in results.items():
+                bar = provisional.get(ticker)
+                results[ticker] = (stored, _grouped_records([(today, bar)]) if bar else stored[:0], stale)
+        else:
+            results = {ticker: (stored, stored[:0], False) for ticker, stored in results.items()}
 
-        except requests.exceptions.RequestException:
+        def sync(ticker):
+            try:
+                return ticker, self.sync_daily_bars(ticker)
+            except ProviderError as e:
+                return ticker, e
+        results.update(_SNAPSHOT_EXECUTOR.map(_in_caller_scope(sync), fallback))
+        return results
+
+    def backfill_daily_bars(self, tickers):
+        """
+        Bulk-syncs the bar store for a universe (see sync_daily_bars_many: one grouped-daily
+        call per missing session covers every ticker that is only a few sessions behind).
+        Returns {ticker: bars_stored or error string}.
+        """
+        if BARS is None or not self.polygon_key:
             return {}
+        return {
+            ticker: str(synced) if isinstance(synced, ProviderError) else len(synced[0])
+            for ticker, synced in self.sync_daily_bars_many(tickers).items()
+        }
+
+    def get_latest_trades_bulk(self, tickers):
+        """
+        Fetches the latest trade price for a list of tickers (Polygon Snapshots).
+        Prices are cached per ticker for SNAPSHOT_CACHE_TTL seconds; only misses hit Polygon,
+        split into SNAPSHOT_BATCH_SIZE batches fetched in parallel (or one full-market call
+        above SNAPSHOT_FULL_MARKET_THRESHOLD). Returns a PriceMap; `.missing` lists tickers
+        with no price. Raises ProviderError (or ProviderThrottled) if every batch failed.
+        """
+        if not self.polygon_key or not tickers: return PriceMap({}, missing=list(tickers or []))
+        tickers = list(dict.fromkeys(tickers))
+        # No stale fallback: alerts must never fire on an old price
+        prices = CACHE.get_many("snapshot", tickers, Config.SNAPSHOT_CACHE_TTL, self._fetch_latest_trades, stale_ttl=0)
+        return PriceMap(prices, missing=[t for t in tickers if t not in prices])
+
+    def _fetch_latest_trades(self, tickers):
+        if len(tickers) >= Config.SNAPSHOT_FULL_MARKET_THRESHOLD:
+            wanted = set(tickers)
+            return {t: p for t, p in self._price_map(self.get_market_snapshot()).items() if t in wanted}
+
+        size = Config.SNAPSHOT_BATCH_SIZE
+        batches = [tickers[i:i + size] for i in range(0, len(tickers), size)]
+        if len(batches) == 1:
+            return self._fetch_snapshot_batch(batches[0])
+
+        price_map, errors = {}, []
+        futures = [_SNAPSHOT_EXECUTOR.submit(_in_caller_scope(self._fetch_snapshot_batch), batch) for batch in batches]
+        for future in futures:
+            try:
+                price_map.update(future.result())
+            except ProviderError as e:
+                errors.append(e)
+        if errors:
+            if len(errors) == len(batches):
+                raise errors[0]
+            print(f"Snapshot: {len(errors)}/{len(batches)} batches failed; those tickers are reported missing.")
+        return price_map
+
+    def _fetch_snapshot_batch(self, tickers):
+        return self._price_map(self._fetch_snapshot_items(tickers))
+
+    def _fetch_snapshot_items(self, tickers):
+        """Raw snapshot items for up to SNAPSHOT_BATCH_SIZE tickers in one request."""
+        params = {'tickers': ','.join(tickers), 'apiKey': self.polygon_key}
+        return self.polygon.get_json("/v2/snapshot/locale/us/markets/stocks/tickers", params).get('tickers', [])
+
+    def get_market_snapshot(self):
+        """Full-market snapshot (every US stock ticker) in a single call. Returns the raw items."""
+        if not self.polygon_key: return []
+        params = {'apiKey': self.polygon_key}
+        return SINGLE_FLIGHT.do(
+            "polygon:market_snapshot",
+            lambda: self.polygon.get_json("/v2/snapshot/locale/us/markets/stocks/tickers", params).get('tickers', []),
+        )
+
+    @staticmethod
+    def _price_map(items):
+        price_map = {}
+        for item in items:
+            if 'lastTrade' in item and item['lastTrade'] and 'p' in item['lastTrade']:
+                 price_map[item['ticker']] = item['lastTrade']['p']
+        return price_map
             
+    def get_grouped_daily(self, day):
+        """
+        Every US stock's daily bar for `day` in one call (Polygon grouped daily) as a frame
+        of ticker/open/high/low/close/volume. Empty on market holidays. Cached until the next close.
+        """
+        if not self.polygon_key: return pd.DataFrame(columns=['ticker', 'open', 'high', 'low', 'close', 'volume'])
+        return CACHE.get_or_load(
+            "grouped_ohlc", day.isoformat(), ttl_until_next_market_close(),
+            lambda: self._fetch_grouped_daily(day), cacheable=lambda df: not df.empty,
+        )
+
+    def _fetch_grouped_daily(self, day):
+        path = f"/v2/aggs/grouped/locale/us/market/stocks/{day.isoformat()}"
+        results = self.polygon.get_json(path, {'adjusted': 'true', 'apiKey': self.polygon_key}).get('results') or []
+        return pd.DataFrame({
+            'ticker': [r['T'] for r in results],
+            'open': np.array([r.get('o', np.nan) for r in results], dtype=np.float64),
+            'high': np.array([r.get('h', np.nan) for r in results], dtype=np.float64),
+            'low': np.array([r.get('l', np.nan) for r in results], dtype=np.float64),
+            'close': np.array([r.get('c', np.nan) for r in results], dtype=np.float64),
+            'volume': np.array([r.get('v', 0.0) for r in results], dtype=np.float64),
+        })
+
+    def get_shares_outstanding(self, tickers):
+        """
+        {ticker: shares outstanding} (Polygon ticker details). Kept as a few cached maps
+        sharded by the ticker's first letter, so a full-market universe neither floods the
+        per-key cache nor grows one value past CACHE_REDIS_MAX_VALUE_BYTES. Only tickers
+        missing or older than SECTOR_MAP_CACHE_TTL are fetched (in parallel). Unknown counts are 0.
+        """
+        if not self.polygon_key or not tickers: return {}
+        now = time.time()
+        tickers = list(dict.fromkeys(tickers))
+        shards = sorted({_shares_shard(t) for t in tickers})
+        known = CACHE.get_many("shares", shards, Config.SECTOR_MAP_CACHE_TTL, lambda _missing: {})
+        expired = now - Config.SECTOR_MAP_CACHE_TTL
+        cached = {t: known.get(_shares_shard(t), {}).get(t) for t in tickers}
+        missing = [t for t, entry in cached.items() if entry is None or entry[1] < expired]
+        if missing:
+            updated = {}
+            for t, shares in self._fetch_shares_outstanding(missing).items():
+                shard = _shares_shard(t)
+                updated.setdefault(shard, dict(known.get(shard, {})))[t] = cached[t] = (shares, now)
+            for shard, entries in updated.items():
+                CACHE.set("shares", shard, entries, Config.SECTOR_MAP_CACHE_TTL)
+        return {t: entry[0] for t, entry in cached.items() if entry is not None}
+
+    def _fetch_shares_outstanding(self, tickers):
+        def fetch(ticker):
+            try:
+                details = self.polygon.get_json(f"/v3/reference/tickers/{ticker}", {'apiKey': self.polygon_key})
+            except ProviderError as e:
+                print(f"Shares outstanding unavailable for {ticker}: {e}")
+                return ticker, None  # Not cached; retried on the next run
+            results = details.get('results') or {}
+            shares = results.get('weighted_shares_outstanding') or results.get('share_class_shares_outstanding')
+            return ticker, float(shares or 0.0)
+        return {t: shares for t, shares in _SNAPSHOT_EXECUTOR.map(_in_caller_scope(fetch), tickers) if shares is not None}
+
     # (get_latest_quote_nbbo, get_news_feed implementations remain)
 
     # --- Tiingo: Fundamentals, Insider Trading, 13F ---
             
     # (get_fundamentals, get_insider_transactions implementations remain)
+
+    def get_sector_map(self):
+        """{ticker: sector} for active listings from Tiingo's fundamentals meta (one call), cached."""
+        if not self.tiingo_key: return {}
+        return CACHE.get_or_load("sectors", "map", Config.SECTOR_MAP_CACHE_TTL, self._fetch_sector_map, cacheable=bool)
+
+    def _fetch_sector_map(self):
+        meta = self.tiingo.get_json("/tiingo/fundamentals/meta")
+        return {
+            m['ticker'].upper(): m['sector']
+            for m in meta
+            if m.get('ticker') and m.get('sector') and m.get('isActive', True)
+        }
         
+    def get_institutional_ownership_many(self, tickers):
+        """
+        {ticker: holders} like get_institutional_ownership: cached lists are read in one
+        pass and the misses fetched concurrently. Tickers that failed are left out.
+        """
+        if not self.tiingo_key or not tickers: return {}
+        return CACHE.get_many("ownership", list(dict.fromkeys(tickers)), Config.OWNERSHIP_CACHE_TTL,
+                              self._fetch_institutional_ownership_many)
+
+    def _fetch_institutional_ownership_many(self, tickers):
+        def fetch(ticker):
+            try:
+                return ticker, self._fetch_institutional_ownership(ticker)
+            except ProviderError as e:
+                print(f"Ownership unavailable for {ticker}: {e}")
+                return ticker, None
+        return {t: data for t, data in _SNAPSHOT_EXECUTOR.map(_in_caller_scope(fetch), tickers) if data}
+
     def get_institutional_ownership(self, ticker):
-        """Fetches the latest institutional holders (13F Filings)."""
+        """
+        Fetches the latest institutional holders (13F Filings).
+        Cached for OWNERSHIP_CACHE_TTL (days); treat the returned list as read-only.
+        Raises ProviderError (or ProviderThrottled) if Tiingo cannot be reached after retries.
+        """
         if not self.tiingo_key: return []
-        
-        url = f"https://api.tiingo.com/tiingo/fundamentals/{ticker}/ownership"
-        try:
-            response = requests.get(url, headers=self.tiingo_headers)
-            response.raise_for_status()
-            return response.json().get('ownership', [])
-        except requests.exceptions.RequestException:
-            return []
+        return CACHE.get_or_load(
+            "ownership", ticker, Config.OWNERSHIP_CACHE_TTL,
+            lambda: self._fetch_institutional_ownership(ticker), cacheable=bool,
+        )
+
+    def _fetch_institutional_ownership(self, ticker):
+        return self.tiingo.get_json(f"/tiingo/fundamentals/{ticker}/ownership").get('ownership', [])
+
+def _final_cutoff_ms(now):
+    """
+    Bars dated up to the last completed session (last_market_close_date) are final and
+    stored; anything at or after this instant (midnight ET of the next day) is provisional.
+    """
+    day = last_market_close_date(now) + timedelta(days=1)
+    return int(datetime(day.year, day.month, day.day, tzinfo=MARKET_TZ).timestamp() * 1000)
+
+def _shares_shard(ticker):
+    return f"map:{ticker[:1]}"
+
+def _cacheable_frame(df):
+    # A frame built from stored bars after a failed fetch is served, never cached until the close
+    return not df.empty and not df.attrs.get('stale')
+
+def _grouped_records(bars):
+    """BAR_DTYPE records from (session date, grouped-daily row or snapshot `day` dict) pairs."""
+    records = np.empty(len(bars), dtype=BAR_DTYPE)
+    records['t'] = [int(datetime(d.year, d.month, d.day, tzinfo=MARKET_TZ).timestamp() * 1000) for d, _ in bars]
+    for field, key in (("open", "o"), ("high", "h"), ("low", "l"), ("close", "c"), ("volume", "v")):
+        records[field] = [bar[field] if field in bar else bar.get(key, np.nan) for _, bar in bars]
+    return records
 
 DP = DataProviders()
+
+
+# --- Metrics: the existing stats dicts, folded into /api/v1/metrics as counters ---
+def _stats_samples():
+    samples = []
+    for provider, stats in DP.transport_stats().items():
+        samples += [(PROVIDER_EVENTS.series(provider=provider, event=event), value)
+                    for event, value in stats.items() if event != "circuit"]
+    for tier, stats in DP.cache_stats().items():
+        samples += [(CACHE_EVENTS.series(tier=tier, event=event), value)
+                    for event, value in stats.items() if event != "size"]
+    samples += [(SINGLE_FLIGHT_EVENTS.series(event=event), value) for event, value in DP.coalesce_stats().items()]
+    return samples
+
+REGISTRY.register_source(_stats_samples)
+REGISTRY.register_gauge(
+    "provider_circuit_open", "1 while this process's circuit breaker for the provider is open or probing.",
+    lambda: [({"provider": t.name}, int(t.breaker.state != "closed")) for t in (DP.polygon, DP.tiingo)],
+)
+REGISTRY.register_gauge(
+    "provider_quota_tokens_available", "Requests left in the provider's rate-limit bucket (shared through Redis).",
+    lambda: [({"provider": t.name}, round(t.bucket.available(), 2)) for t in (DP.polygon, DP.tiingo)],
+)
@@ -15,6 +15,10 @@ case "$SERVICE_ROLE" in
     # Assumes Celery app is defined in tasks.py as celery_app
     exec celery -A tasks:celery_app worker --loglevel=INFO
     ;;
+  "ALERT_STREAM")
+    echo "Starting Streaming Price Alert Service..."
+    exec python alert_stream.py
+    ;;
   "SCHEDULER")
     echo "Starting Celery Beat Scheduler..."
     exec celery -A tasks:celery_app beat --loglevel=INFO
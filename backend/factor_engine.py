@@ -0,0 +1,89 @@
+import json
+import math
+from collections import namedtuple
+from numbers import Real
+
+import numpy as np
+
+Factor = namedtuple("Factor", ["name", "column", "ascending", "description"])
+
+# Registry of rankable factors: name -> Factor. Add factors with register_factor().
+FACTORS = {}
+
+
+def register_factor(name, column, ascending=True, description=""):
+    """
+    Declares a factor as a percentile rank of one screener column. `ascending` follows
+    pandas.rank: True ranks the smallest value lowest.
+    """
+    FACTORS[name] = Factor(name, column, ascending, description)
+    return FACTORS[name]
+
+
+# Same ranks as MicroCapAnalyzer.multi_factor_ranking (Rank_Value / Rank_Quality / Rank_Alignment)
+register_factor("value", "PE_Ratio", ascending=True, description="P/E ratio percentile")
+register_factor("quality", "ROIC", ascending=False, description="Return on invested capital percentile")
+register_factor("alignment", "InsiderOwnership", ascending=False, description="Insider ownership percentile")
+
+DEFAULT_SCENARIOS = {
+    "balanced": {"quality": 0.40, "value": 0.40, "alignment": 0.20},  # MicroCapAnalyzer default
+    "quality_tilt": {"quality": 0.60, "value": 0.20, "alignment": 0.20},
+    "value_tilt": {"quality": 0.20, "value": 0.60, "alignment": 0.20},
+    "insider_tilt": {"quality": 0.30, "value": 0.30, "alignment": 0.40},
+}
+
+
+class FactorEngine:
+    """
+    Scores any number of weight scenarios in one pass: percentile ranks are computed once
+    into a (tickers x factors) float32 matrix R, scenarios form a (factors x scenarios)
+    weight matrix W, and every composite score comes from a single R @ W.
+    """
+
+    def __init__(self, factors=None):
+        self.factors = [FACTORS[name] for name in (factors or FACTORS)]
+
+    def rank_matrix(self, df):
+        """(len(df) x len(factors)) percentile ranks (average ties, like pandas rank(pct=True))."""
+        ranks = np.empty((len(df), len(self.factors)), dtype=np.float32)
+        for j, factor in enumerate(self.factors):
+            ranks[:, j] = df[factor.column].rank(pct=True, ascending=factor.ascending).to_numpy(dtype=np.float32)
+        return ranks
+
+    def weight_matrix(self, scenarios):
+        """(factors x scenarios) weights. Raises ValueError for unknown factors or non-numeric weights."""
+        index = {factor.name: j for j, factor in enumerate(self.factors)}
+        weights = np.zeros((len(self.factors), len(scenarios)), dtype=np.float32)
+        for k, (scenario, factor_weights) in enumerate(scenarios.items()):
+            for name, weight in factor_weights.items():
+                if name not in index:
+                    raise ValueError(f"Unknown factor '{name}' in scenario '{scenario}'.")
+                if isinstance(weight, bool) or not isinstance(weight, Real) or not math.isfinite(weight):
+                    raise ValueError(f"Weight of '{name}' in scenario '{scenario}' must be a finite number.")
+                weights[index[name], k] = float(weight)
+        return weights
+
+    def score(self, df, scenarios):
+        """(len(df) x len(scenarios)) composite scores."""
+        return self.rank_matrix(df) @ self.weight_matrix(scenarios)
+
+    def top_n(self, df, scenarios, n=10):
+        """{scenario: top-n rows of df with a CompositeScore column, best first}."""
+        if df.empty:
+            return {scenario: df for scenario in scenarios}
+        scores = self.score(df, scenarios)
+        n = min(n, len(df))
+        results = {}
+        for k, scenario in enumerate(scenarios):
+            column = scores[:, k]
+            top = np.argpartition(-column, n - 1)[:n]
+            top = top[np.argsort(-column[top], kind="stable")]
+            ranked = df.iloc[top].copy()
+            ranked["CompositeScore"] = column[top]
+            results[scenario] = ranked
+        return results
+
+
+def scenario_records(results):
+    """JSON-ready {scenario: [record, ...]} from FactorEngine.top_n output."""
+    return {scenario: json.loads(ranked.to_json(orient="records")) for scenario, ranked in results.items()}
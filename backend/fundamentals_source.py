@@ -0,0 +1,64 @@
+"""
+Chunked readers for the analyzer's fundamentals universe.
+
+A source is configured as "<kind>:<location>" (ANALYZER_FUNDAMENTALS_SOURCE):
+
+- csv:/data/fundamentals.csv        one CSV file
+- parquet:/data/fundamentals/       a Parquet file or a directory of them (needs pyarrow)
+- sql:fundamentals                  a table in DATABASE_URL, read with a server-side cursor
+
+Every reader yields DataFrames of at most `chunk_rows` rows holding only `columns`, so
+peak memory is one chunk plus whatever the caller keeps.
+"""
+import glob
+import os
+import re
+
+import pandas as pd
+from sqlalchemy import text
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+def parse_source(source):
+    kind, _, location = source.partition(":")
+    if kind not in ("csv", "parquet", "sql") or not location:
+        raise ValueError(f"Unsupported fundamentals source '{source}' (expected csv:, parquet: or sql:).")
+    return kind, location
+
+
+def iter_fundamentals(source, columns, chunk_rows=100_000):
+    """Yields DataFrame chunks of `columns` from the configured source."""
+    kind, location = parse_source(source)
+    if kind == "csv":
+        yield from pd.read_csv(location, usecols=columns, chunksize=chunk_rows)
+    elif kind == "parquet":
+        yield from _iter_parquet(location, columns, chunk_rows)
+    else:
+        yield from _iter_sql(location, columns, chunk_rows)
+
+
+def _iter_parquet(location, columns, chunk_rows):
+    if pq is None:
+        raise RuntimeError("Parquet fundamentals sources need the optional 'pyarrow' package.")
+    paths = sorted(glob.glob(os.path.join(location, "*.parquet"))) if os.path.isdir(location) else [location]
+    for path in paths:
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows, columns=columns):
+            yield batch.to_pandas()
+
+
+def _iter_sql(table, columns, chunk_rows):
+    if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_.]*", table):
+        raise ValueError(f"Invalid fundamentals table name '{table}'.")
+    from models import engine  # Only SQL sources need a database connection
+
+    query = text(f"SELECT {', '.join(_quote(c) for c in columns)} FROM {table}")
+    with engine.connect().execution_options(stream_results=True) as conn:
+        yield from pd.read_sql_query(query, conn, chunksize=chunk_rows)
+
+
+def _quote(column):
+    return '"' + column.replace('"', '""') + '"'
@@ -0,0 +1,114 @@
+import gzip
+import hashlib
+import json
+
+import redis
+from flask import request, Response
+
+from config import Config
+from redis_client import get_redis
+
+try:
+    import brotli
+except ImportError:
+    brotli = None  # gzip only
+
+_COMPRESSIBLE = ("application/json", "text/")
+
+
+def _dumps(data):
+    return json.dumps(data, separators=(",", ":"), sort_keys=True).encode()
+
+
+def content_etag(body):
+    """Content-hash ETag value for a response body (bytes)."""
+    return hashlib.sha1(body).hexdigest()
+
+
+def not_modified(etag):
+    """True if the client already holds `etag` (If-None-Match)."""
+    return etag is not None and request.if_none_match.contains_weak(etag)
+
+
+def _finish(response, etag, max_age, last_modified=None):
+    # Weak ETags: the same JSON is sent gzip'd, brotli'd or plain (see compress_response).
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Every cached route requires a bearer token, so only the client may cache: many CDNs
+    # ignore Vary: Authorization and would hand the body to unauthenticated callers.
+    response.headers["Cache-Control"] = f"private, max-age={max_age}, stale-while-revalidate={max_age}"
+    response.vary.add("Authorization")  # A client switching accounts revalidates
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+def not_modified_response(etag, max_age, last_modified=None):
+    return _finish(Response(status=304), etag, max_age, last_modified)
+
+
+def cached_json(data, max_age, etag=None, last_modified=None, etag_exclude=()):
+    """
+    JSON response with an ETag, Cache-Control and optional Last-Modified. Answers 304 with
+    no body when If-None-Match / If-Modified-Since match. Unless `etag` is given it is a
+    hash of the content, ignoring top-level `etag_exclude` keys (build metadata such as
+    timings) so a rebuild with identical data still matches.
+    """
+    body = _dumps(data)
+    if etag is None:
+        etag = content_etag(_dumps({k: v for k, v in data.items() if k not in etag_exclude}) if etag_exclude else body)
+    if not_modified(etag):
+        return not_modified_response(etag, max_age, last_modified)
+    response = _finish(Response(body, mimetype="application/json"), etag, max_age, last_modified)
+    return response.make_conditional(request)
+
+
+def compress_response(response):
+    """after_request hook: gzip/brotli JSON and text bodies above COMPRESS_MIN_BYTES."""
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or "Content-Encoding" in response.headers
+        or not (response.mimetype or "").startswith(_COMPRESSIBLE)
+    ):
+        return response
+    body = response.get_data()
+    if len(body) < Config.COMPRESS_MIN_BYTES:
+        return response
+
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        response.set_data(brotli.compress(body, quality=5))
+        response.headers["Content-Encoding"] = "br"
+    elif accepted["gzip"]:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers["Content-Encoding"] = "gzip"
+    else:
+        return response
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+# --- Version stamps: answer a 304 without touching the database ---
+HEATMAP_VERSION_KEY = "heatmap:last_updated"  # ISO SectorPerformance.last_updated, set by the heatmap task
+
+def get_version(key):
+    client = get_redis()
+    if client is None:
+        return None
+    try:
+        raw = client.get(key)
+    except redis.exceptions.RedisError:
+        return None
+    return raw.decode() if raw else None
+
+def set_version(key, value):
+    """Best effort; readers fall back to the database when the stamp is missing."""
+    client = get_redis()
+    if client is None or value is None:
+        return
+    try:
+        client.set(key, value)
+    except redis.exceptions.RedisError as e:
+        print(f"Could not set version stamp {key}: {e}")
@@ -0,0 +1,122 @@
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from analysis_features import fetch_analysis_hub_data, iter_analysis_hub_data
+from cache import last_market_close_date
+from config import Config
+from models import get_db_session, HubSnapshot
+
+
+def is_complete_payload(payload):
+    """
+    A payload with a timed-out, stale or failed ({"error": ...}) section is not worth
+    serving for a whole session; that ticker is built live on read instead.
+    """
+    sections = ("redFlags", "insiderActivity", "liquidity", "technicals", "ownership")
+    return not any(
+        isinstance(payload.get(s), dict) and (payload[s].get("stale") or payload[s].get("error"))
+        for s in sections
+    )
+
+
+class HubSnapshotStore:
+    """
+    Analysis hub payloads precomputed after the close (tasks.precompute_hub_snapshots),
+    one row per (ticker, session). Reads serve the newest snapshot while it still covers
+    the last completed session and fall back to a live build otherwise.
+    """
+
+    def latest(self, db, ticker):
+        return (
+            db.query(HubSnapshot)
+            .filter(HubSnapshot.ticker == ticker)
+            .order_by(HubSnapshot.as_of.desc())
+            .first()
+        )
+
+    def save(self, db, ticker, as_of, payload, computed_at=None):
+        """Upserts one snapshot version. Caller commits."""
+        db.merge(HubSnapshot(
+            ticker=ticker,
+            as_of=as_of,
+            payload=json.dumps(payload),
+            computed_at=computed_at or datetime.utcnow(),
+        ))
+
+    def prune(self, db, keep_days=None):
+        """Deletes versions older than the retention window. Caller commits."""
+        keep_days = Config.HUB_SNAPSHOT_RETENTION_DAYS if keep_days is None else keep_days
+        cutoff = last_market_close_date() - timedelta(days=keep_days)
+        return db.query(HubSnapshot).filter(HubSnapshot.as_of < cutoff).delete(synchronize_session=False)
+
+    def get_hub_data(self, ticker):
+        """
+        The hub payload for `ticker` with "asOf" (UTC ISO timestamp of when it was built)
+        and "source" ("snapshot" or "live"). Live builds happen only when the snapshot is
+        missing, older than the last completed session or unreadable (database error).
+        """
+        try:
+            with get_db_session() as db:
+                snapshot = self.latest(db, ticker)
+                if snapshot is not None and snapshot.as_of >= last_market_close_date():
+                    data = json.loads(snapshot.payload)
+                    data["asOf"] = snapshot.computed_at.isoformat() + "Z"
+                    data["source"] = "snapshot"
+                    return data
+        except SQLAlchemyError as e:
+            print(f"Hub snapshot unavailable for {ticker}; building live: {e}")
+
+        data = fetch_analysis_hub_data(ticker)
+        data["asOf"] = datetime.utcnow().isoformat() + "Z"
+        data["source"] = "live"
+        return data
+
+    def get_many_hub_data(self, tickers):
+        """{ticker: hub payload} like get_hub_data (see iter_hub_data)."""
+        return dict(self.iter_hub_data(tickers))
+
+    def iter_hub_data(self, tickers):
+        """
+        Yields (ticker, hub payload) like get_hub_data: every fresh snapshot is loaded in one
+        query and yielded first, then the missing tickers are built together (shared bulk
+        provider calls) and yielded as each one completes.
+        """
+        tickers = list(dict.fromkeys(tickers))
+        snapshots = self.get_stored_hub_data(tickers)
+        yield from snapshots.items()
+
+        missing = [t for t in tickers if t not in snapshots]
+        if missing:
+            for ticker, data in iter_analysis_hub_data(missing):
+                data["asOf"] = datetime.utcnow().isoformat() + "Z"
+                data["source"] = "live"
+                yield ticker, data
+
+    def get_stored_hub_data(self, tickers):
+        """
+        {ticker: hub payload} from fresh snapshots only (one query); tickers without one are
+        left out, and all of them on a database error.
+        """
+        snapshots = {}
+        try:
+            with get_db_session() as db:
+                rows = (
+                    db.query(HubSnapshot)
+                    .filter(HubSnapshot.ticker.in_(tickers), HubSnapshot.as_of >= last_market_close_date())
+                    .order_by(HubSnapshot.as_of.desc())
+                )
+                for snapshot in rows:
+                    if snapshot.ticker not in snapshots:
+                        data = json.loads(snapshot.payload)
+                        data["asOf"] = snapshot.computed_at.isoformat() + "Z"
+                        data["source"] = "snapshot"
+                        snapshots[snapshot.ticker] = data
+        except SQLAlchemyError as e:
+            print(f"Hub snapshots unavailable; building live: {e}")
+            return {}
+        return snapshots
+
+# Singleton instance
+HUB_SNAPSHOTS = HubSnapshotStore()
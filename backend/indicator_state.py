@@ -0,0 +1,184 @@
+import json
+from collections import deque
+
+import numpy as np
+import redis
+
+from redis_client import get_redis
+from technicals_engine import TechnicalsResult
+
+STATE_KEY = "technicals:state"  # Redis hash: ticker -> serialized IndicatorState
+RSI_PERIOD = 14
+
+
+class IndicatorState:
+    """
+    Rolling indicator state for one ticker. Each finalized bar updates SMA-50/200 (running
+    window sums), RSI-14 (Wilder-smoothed average gain/loss) and the previous SMA-50/200
+    pair used for cross detection in O(1). Values match technicals_engine / TA-Lib.
+    """
+
+    def __init__(self, ticker):
+        self.ticker = ticker
+        self.last_t = None          # Epoch ms of the last applied bar
+        self.window = deque(maxlen=200)
+        self.sum_50 = 0.0
+        self.sum_200 = 0.0
+        self.n_bars = 0
+        self.rsi_seen = 0           # Price changes seen so far (RSI seeds after RSI_PERIOD)
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+        self.prev_sma_50 = np.nan
+        self.prev_sma_200 = np.nan
+
+    # --- Current values ---
+
+    @property
+    def sma_50(self):
+        return self.sum_50 / 50 if len(self.window) >= 50 else np.nan
+
+    @property
+    def sma_200(self):
+        return self.sum_200 / 200 if len(self.window) >= 200 else np.nan
+
+    @property
+    def rsi(self):
+        return _rsi(self.avg_gain, self.avg_loss) if self.rsi_seen >= RSI_PERIOD else np.nan
+
+    # --- O(1) updates ---
+
+    def _advance(self, close):
+        """Returns the post-bar (sum_50, sum_200, rsi_seen, avg_gain, avg_loss) without mutating."""
+        window = self.window
+        sum_50 = self.sum_50 + close - (window[-50] if len(window) >= 50 else 0.0)
+        sum_200 = self.sum_200 + close - (window[0] if len(window) >= 200 else 0.0)
+        rsi_seen, avg_gain, avg_loss = self.rsi_seen, self.avg_gain, self.avg_loss
+        if window:
+            change = close - window[-1]
+            gain, loss = max(change, 0.0), max(-change, 0.0)
+            rsi_seen += 1
+            if rsi_seen <= RSI_PERIOD:
+                avg_gain += gain / RSI_PERIOD
+                avg_loss += loss / RSI_PERIOD
+            else:
+                avg_gain = (avg_gain * (RSI_PERIOD - 1) + gain) / RSI_PERIOD
+                avg_loss = (avg_loss * (RSI_PERIOD - 1) + loss) / RSI_PERIOD
+        return sum_50, sum_200, rsi_seen, avg_gain, avg_loss
+
+    def update(self, t, close):
+        """Applies one finalized bar. Bars at or before last_t are ignored."""
+        if self.last_t is not None and t <= self.last_t:
+            return False
+        close = float(close)
+        self.prev_sma_50, self.prev_sma_200 = self.sma_50, self.sma_200
+        self.sum_50, self.sum_200, self.rsi_seen, self.avg_gain, self.avg_loss = self._advance(close)
+        self.window.append(close)
+        self.n_bars += 1
+        self.last_t = int(t)
+        return True
+
+    def preview(self, close):
+        """Technicals payload if an in-progress (intraday) bar closed at `close`; state is unchanged."""
+        sum_50, sum_200, rsi_seen, avg_gain, avg_loss = self._advance(float(close))
+        size = min(len(self.window) + 1, 200)
+        return self._payload(
+            price=float(close),
+            sma_50=sum_50 / 50 if size >= 50 else np.nan,
+            sma_200=sum_200 / 200 if size >= 200 else np.nan,
+            prev_sma_50=self.sma_50,
+            prev_sma_200=self.sma_200,
+            rsi=_rsi(avg_gain, avg_loss) if rsi_seen >= RSI_PERIOD else np.nan,
+            n_bars=self.n_bars + 1,
+        )
+
+    def payload(self):
+        """Technicals payload as of the last applied bar (same shape as AF.analyze_technicals)."""
+        return self._payload(
+            price=self.window[-1] if self.window else np.nan,
+            sma_50=self.sma_50,
+            sma_200=self.sma_200,
+            prev_sma_50=self.prev_sma_50,
+            prev_sma_200=self.prev_sma_200,
+            rsi=self.rsi,
+            n_bars=self.n_bars,
+        )
+
+    def _payload(self, price, sma_50, sma_200, prev_sma_50, prev_sma_200, rsi, n_bars):
+        result = TechnicalsResult(
+            tickers=[self.ticker], n_bars=np.array([n_bars]), price=np.array([price]),
+            sma_50=np.array([sma_50]), sma_200=np.array([sma_200]),
+            prev_sma_50=np.array([prev_sma_50]), prev_sma_200=np.array([prev_sma_200]), rsi=np.array([rsi]),
+        )
+        return result.payload(self.ticker)
+
+    @classmethod
+    def from_bars(cls, ticker, timestamps, closes):
+        """Seeds state by replaying a bar history (oldest first)."""
+        state = cls(ticker)
+        for t, close in zip(timestamps, closes):
+            state.update(t, close)
+        return state
+
+    # --- Persistence ---
+
+    def to_json(self):
+        return json.dumps({
+            "ticker": self.ticker, "last_t": self.last_t, "window": list(self.window),
+            "n_bars": self.n_bars, "rsi_seen": self.rsi_seen, "avg_gain": self.avg_gain, "avg_loss": self.avg_loss,
+            "prev_sma_50": _encode(self.prev_sma_50), "prev_sma_200": _encode(self.prev_sma_200),
+        })
+
+    @classmethod
+    def from_json(cls, raw):
+        data = json.loads(raw)
+        state = cls(data["ticker"])
+        state.last_t = data["last_t"]
+        state.window.extend(data["window"])
+        # Window sums are re-derived on load so float drift never accumulates across runs.
+        state.sum_50 = float(sum(list(state.window)[-50:]))
+        state.sum_200 = float(sum(state.window))
+        state.n_bars = data["n_bars"]
+        state.rsi_seen = data["rsi_seen"]
+        state.avg_gain = data["avg_gain"]
+        state.avg_loss = data["avg_loss"]
+        state.prev_sma_50 = _decode(data["prev_sma_50"])
+        state.prev_sma_200 = _decode(data["prev_sma_200"])
+        return state
+
+
+def _rsi(avg_gain, avg_loss):
+    total = avg_gain + avg_loss
+    return 100 * avg_gain / total if total > 0 else 0.0
+
+def _encode(value):
+    return None if np.isnan(value) else value
+
+def _decode(value):
+    return np.nan if value is None else value
+
+
+class IndicatorStateStore:
+    """Indicator states persisted in one Redis hash, shared by every worker."""
+
+    def load_many(self, tickers):
+        client = get_redis()
+        if client is None or not tickers:
+            return {}
+        try:
+            raw = client.hmget(STATE_KEY, tickers)
+        except redis.exceptions.RedisError as e:
+            print(f"Could not load indicator states: {e}")
+            return {}
+        return {t: IndicatorState.from_json(r) for t, r in zip(tickers, raw) if r}
+
+    def save_many(self, states):
+        client = get_redis()
+        if client is None or not states:
+            return
+        try:
+            client.hset(STATE_KEY, mapping={s.ticker: s.to_json() for s in states})
+        except redis.exceptions.RedisError as e:
+            print(f"Could not save indicator states: {e}")
+
+# Singleton instance
+STATES = IndicatorStateStore()
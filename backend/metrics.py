@@ -0,0 +1,267 @@
+"""
+Prometheus-format metrics (text exposition 0.0.4) without a client library.
+
+Counters and histograms are additive, so every process (gunicorn workers, Celery
+workers, alert_stream.py) keeps local deltas and a background thread adds them to one
+Redis hash every METRICS_FLUSH_INTERVAL seconds. /api/v1/metrics renders the hash, so
+a scrape sees the whole deployment. Without Redis each process reports its own totals.
+
+Existing per-process stats dicts (provider transport, cache, single-flight) are folded
+in as counters by register_source() instead of being incremented twice.
+"""
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import redis
+
+from config import Config
+from redis_client import get_redis
+
+METRICS_KEY = "metrics:totals"
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _series(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}   # name -> metric, in registration order
+        self.sources = []   # callables returning [(series, cumulative value), ...]
+        self.gauges = []    # (name, help, callable returning [(labels dict, value), ...])
+        self._lock = threading.Lock()
+        self._pending = {}  # series -> delta not yet flushed
+        self._totals = {}   # series -> value (used when Redis is not configured)
+        self._source_last = {}
+        self._flusher_pid = None
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def register_source(self, fn):
+        self.sources.append(fn)
+
+    def register_gauge(self, name, help, fn):
+        """Computed at scrape time in the scraped process (state, not totals)."""
+        self.gauges.append((name, help, fn))
+
+    def add(self, series, amount):
+        with self._lock:
+            self._pending[series] = self._pending.get(series, 0.0) + amount
+        if self._flusher_pid != os.getpid():
+            self._start_flusher()
+
+    def _start_flusher(self):
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()  # Forked children start their own
+
+        def loop():
+            while True:
+                time.sleep(Config.METRICS_FLUSH_INTERVAL)
+                self.flush()
+
+        threading.Thread(target=loop, name="metrics-flush", daemon=True).start()
+
+    def _collect_sources(self):
+        for source in self.sources:
+            try:
+                samples = source()
+            except Exception as e:
+                print(f"Metrics source failed: {e}")
+                continue
+            for series, value in samples:
+                delta = value - self._source_last.get(series, 0.0)
+                self._source_last[series] = value
+                if delta:
+                    self._pending[series] = self._pending.get(series, 0.0) + delta
+
+    def flush(self):
+        """Adds pending deltas to the shared totals. Returns the number of series written."""
+        with self._lock:
+            self._collect_sources()
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return 0
+        client = get_redis()
+        if client is None:
+            with self._lock:
+                for series, delta in pending.items():
+                    self._totals[series] = self._totals.get(series, 0.0) + delta
+            return len(pending)
+        try:
+            pipe = client.pipeline(transaction=False)
+            for series, delta in pending.items():
+                pipe.hincrbyfloat(METRICS_KEY, series, delta)
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            print(f"Metrics flush failed; retrying next interval: {e}")
+            with self._lock:
+                for series, delta in pending.items():
+                    self._pending[series] = self._pending.get(series, 0.0) + delta
+            return 0
+        return len(pending)
+
+    def totals(self):
+        client = get_redis()
+        if client is None:
+            with self._lock:
+                return dict(self._totals)
+        try:
+            return {k.decode(): float(v) for k, v in client.hgetall(METRICS_KEY).items()}
+        except redis.exceptions.RedisError as e:
+            print(f"Metrics read failed: {e}")
+            return {}
+
+    def render(self):
+        """Flushes this process, then renders the shared totals plus scrape-time gauges."""
+        self.flush()
+        totals = self.totals()
+        by_name = {}
+        for series, value in totals.items():
+            by_name.setdefault(series.split("{", 1)[0], []).append((series, value))
+
+        lines = []
+        for metric in self.metrics.values():
+            samples = []
+            for suffix in metric.suffixes:
+                samples.extend(sorted(by_name.get(metric.name + suffix, []), key=_sample_order))
+            if not samples:
+                continue
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(f"{series} {_format(value)}" for series, value in samples)
+
+        for name, help, fn in self.gauges:
+            try:
+                samples = fn()
+            except Exception as e:
+                print(f"Metrics gauge {name} failed: {e}")
+                continue
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} gauge")
+            lines.extend(f"{_series(name, sorted(labels.items()))} {_format(value)}" for labels, value in samples)
+        return "\n".join(lines) + "\n"
+
+
+def _format(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def _sample_order(sample):
+    # Buckets must be listed in increasing `le` order within each label set
+    series = sample[0]
+    if 'le="' not in series:
+        return (series, 0.0)
+    head, le = series.rsplit('le="', 1)
+    le = le.split('"', 1)[0]
+    return (head, float("inf") if le == "+Inf" else float(le))
+
+
+class Counter:
+    type = "counter"
+    suffixes = ("",)
+
+    def __init__(self, name, help, labelnames=(), registry=None):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.registry = registry or REGISTRY
+        self.registry.register(self)
+
+    def series(self, **labels):
+        return _series(self.name, [(k, labels[k]) for k in self.labelnames])
+
+    def inc(self, amount=1.0, **labels):
+        self.registry.add(self.series(**labels), amount)
+
+
+class Histogram:
+    type = "histogram"
+    suffixes = ("_bucket", "_sum", "_count")
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, registry=None):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.registry = registry or REGISTRY
+        self.registry.register(self)
+
+    def observe(self, value, **labels):
+        base = [(k, labels[k]) for k in self.labelnames]
+        add = self.registry.add
+        # Cumulative buckets: every bound >= value counts the observation
+        for bound in self.buckets[bisect_left(self.buckets, value):]:
+            add(_series(self.name + "_bucket", base + [("le", repr(bound))]), 1)
+        add(_series(self.name + "_bucket", base + [("le", "+Inf")]), 1)
+        add(_series(self.name + "_sum", base), value)
+        add(_series(self.name + "_count", base), 1)
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+
+REGISTRY = Registry()
+
+# --- HTTP ---
+HTTP_REQUEST_DURATION = Histogram(
+    "http_request_duration_seconds", "Flask request latency by route (until the response is returned).",
+    ("route", "method", "status"),
+)
+
+# --- Analysis hub ---
+HUB_SECTION_DURATION = Histogram(
+    "hub_section_duration_seconds", "Wall time of each analysis hub section (mode: single ticker or watchlist batch).",
+    ("section", "mode"),
+)
+
+# --- Providers, cache and request coalescing (folded in from their stats dicts, see data_providers.py) ---
+PROVIDER_EVENTS = Counter(
+    "provider_events_total", "Provider transport counters: requests, retries, throttled, errors, "
+    "deadline_exceeded, circuit_opened, circuit_rejected.", ("provider", "event"),
+)
+CACHE_EVENTS = Counter(
+    "cache_events_total", "Provider cache counters per tier (hits, misses, evictions, ...) and stale fallbacks.",
+    ("tier", "event"),
+)
+SINGLE_FLIGHT_EVENTS = Counter(
+    "single_flight_events_total", "Coalescing: calls led vs callers served by another caller's result.", ("event",),
+)
+
+# --- Provider HTTP ---
+PROVIDER_REQUEST_DURATION = Histogram(
+    "provider_request_duration_seconds", "Upstream HTTP attempt latency.", ("provider",),
+)
+PROVIDER_RESPONSES = Counter(
+    "provider_responses_total", "Upstream HTTP responses by status code ('error' = no response).",
+    ("provider", "status"),
+)
+
+# --- Price alerts and push delivery ---
+ALERT_STAGE_DURATION = Histogram(
+    "alert_monitor_stage_duration_seconds", "monitor_price_alerts time per stage (load, prices, evaluate, deliver).",
+    ("stage",),
+)
+ALERTS_TRIGGERED = Counter("alerts_triggered_total", "Price alerts triggered.")
+PUSH_DELIVERY_DURATION = Histogram(
+    "push_delivery_duration_seconds", "Time to deliver one batch of push notifications.",
+)
+PUSH_NOTIFICATIONS = Counter("push_notifications_total", "Push notifications sent in delivery batches.")
+
+# --- Celery ---
+TASK_DURATION = Histogram(
+    "celery_task_duration_seconds", "Celery task run time by task and final state.", ("task", "state"),
+    buckets=DEFAULT_BUCKETS + (30.0, 60.0, 300.0, 900.0),
+)
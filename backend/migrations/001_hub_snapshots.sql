@@ -0,0 +1,11 @@
+-- Precomputed analysis hub payloads (hub_snapshots.HubSnapshotStore, models.HubSnapshot).
+-- Apply with: psql "$DATABASE_URL" -f migrations/001_hub_snapshots.sql
+CREATE TABLE IF NOT EXISTS hub_snapshots (
+	ticker VARCHAR NOT NULL,
+	as_of DATE NOT NULL,
+	payload TEXT NOT NULL,
+	computed_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+	PRIMARY KEY (ticker, as_of)
+);
+CREATE INDEX IF NOT EXISTS ix_hub_snapshots_as_of ON hub_snapshots (as_of);
+CREATE INDEX IF NOT EXISTS ix_hub_snapshots_ticker ON hub_snapshots (ticker);
@@ -0,0 +1,16 @@
+-- Stored analyzer rankings (analyzer_runs.AnalyzerRunStore, models.AnalyzerRun).
+-- Apply with: psql "$DATABASE_URL" -f migrations/002_analyzer_runs.sql
+CREATE TABLE IF NOT EXISTS analyzer_runs (
+	run_key VARCHAR NOT NULL,
+	data_version VARCHAR NOT NULL,
+	params TEXT NOT NULL,
+	status VARCHAR NOT NULL,
+	results TEXT,
+	row_count INTEGER,
+	error TEXT,
+	started_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+	completed_at TIMESTAMP WITHOUT TIME ZONE,
+	PRIMARY KEY (run_key)
+);
+CREATE INDEX IF NOT EXISTS ix_analyzer_runs_completed_at ON analyzer_runs (completed_at);
+CREATE INDEX IF NOT EXISTS ix_analyzer_runs_status ON analyzer_runs (status);
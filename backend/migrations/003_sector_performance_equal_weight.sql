@@ -0,0 +1,4 @@
+-- Equal-weighted sector returns and constituent counts (sector_heatmap, models.SectorPerformance).
+-- Apply with: psql "$DATABASE_URL" -f migrations/003_sector_performance_equal_weight.sql
+ALTER TABLE sector_performance ADD COLUMN IF NOT EXISTS equal_weight_pct DOUBLE PRECISION;
+ALTER TABLE sector_performance ADD COLUMN IF NOT EXISTS constituents INTEGER;
@@ -2,7 +2,7 @@ from contextlib import contextmanager
 from datetime import datetime
 import enum
 
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime, Text, Float, ForeignKey, Enum
+from sqlalchemy import create_engine, Column, Integer, String, Boolean, Date, DateTime, Text, Float, ForeignKey, Enum
 from sqlalchemy.orm import declarative_base, sessionmaker, relationship
 
 from config import Config
@@ -60,9 +60,34 @@ class PriceAlert(Base):
 class SectorPerformance(Base):
     __tablename__ = 'sector_performance'
     sector = Column(String, primary_key=True, index=True)
-    performance_pct = Column(Float, nullable=False)
+    performance_pct = Column(Float, nullable=False)  # Market-cap weighted
+    equal_weight_pct = Column(Float, nullable=True)
+    constituents = Column(Integer, nullable=True)
     last_updated = Column(DateTime, nullable=False)
 
+# Performance: Precomputed Analysis Hub Snapshots
+class HubSnapshot(Base):
+    """Analysis hub payload for one ticker, versioned by the market session it covers."""
+    __tablename__ = 'hub_snapshots'
+    ticker = Column(String, primary_key=True, index=True)
+    as_of = Column(Date, primary_key=True, index=True)  # Session date (ET) the data is current through
+    payload = Column(Text, nullable=False)  # JSON from fetch_analysis_hub_data
+    computed_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+
+# Performance: Versioned Analyzer Runs
+class AnalyzerRun(Base):
+    """One MicroCapAnalyzer ranking, keyed by input data version + filter/weight parameters."""
+    __tablename__ = 'analyzer_runs'
+    run_key = Column(String, primary_key=True)  # MicroCapAnalyzer.run_key()
+    data_version = Column(String, nullable=False)
+    params = Column(Text, nullable=False)  # JSON
+    status = Column(String, nullable=False, default="running", index=True)  # running / complete / failed
+    results = Column(Text, nullable=True)  # JSON records, best first
+    row_count = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+    started_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    completed_at = Column(DateTime, nullable=True, index=True)
+
 # --- NEW TABLE (Gap 1) ---
 class DeviceToken(Base):
     """Stores user device tokens for APNs"""
@@ -0,0 +1,365 @@
+import hashlib
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import redis
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import Config
+from metrics import PROVIDER_REQUEST_DURATION, PROVIDER_RESPONSES
+from redis_client import get_redis
+
+
+class ProviderError(Exception):
+    """Raised when a provider call fails after retries (instead of returning an empty result)."""
+
+    def __init__(self, provider, message, status_code=None, retries=0, throttled=False):
+        super().__init__(f"{provider}: {message}")
+        self.provider = provider
+        self.status_code = status_code
+        self.retries = retries
+        self.throttled = throttled
+
+
+class ProviderThrottled(ProviderError):
+    """Raised when the plan quota is exhausted (local rate limiter or upstream 429)."""
+
+    def __init__(self, provider, message, status_code=None, retries=0):
+        super().__init__(provider, message, status_code=status_code, retries=retries, throttled=True)
+
+
+class ProviderUnavailable(ProviderError):
+    """Raised without a request while the provider's circuit breaker is open."""
+
+
+class ProviderDeadlineExceeded(ProviderError):
+    """Raised when a call (including retries and rate-limit waits) runs past its deadline."""
+
+
+# --- Per-thread deadlines: callers with a latency budget (the hub) cap every call under them ---
+_scope = threading.local()
+
+@contextmanager
+def deadline_scope(deadline):
+    """Provider calls made by this thread inside the block end by `deadline` (time.monotonic())."""
+    previous = getattr(_scope, "deadline", None)
+    _scope.deadline = deadline if previous is None else min(previous, deadline)
+    try:
+        yield
+    finally:
+        _scope.deadline = previous
+
+def current_deadline():
+    """This thread's deadline_scope deadline (time.monotonic()), or None outside one."""
+    return getattr(_scope, "deadline", None)
+
+def bind_deadline(fn):
+    """fn wrapped to run under this thread's deadline_scope, for work handed to a pool."""
+    deadline = getattr(_scope, "deadline", None)
+    if deadline is None:
+        return fn
+
+    def run(*args, **kwargs):
+        with deadline_scope(deadline):
+            return fn(*args, **kwargs)
+    return run
+
+
+class CircuitBreaker:
+    """
+    Per-provider breaker (per process). After CIRCUIT_FAILURE_THRESHOLD consecutive failed
+    calls it opens and calls fail fast for CIRCUIT_RESET_TIMEOUT seconds; then a single
+    probe call is let through, which closes it on success or re-opens it on failure.
+    Calls that say nothing about the provider's health (see release()) change neither.
+    """
+
+    def __init__(self, name, failure_threshold, reset_timeout):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self.stats = {"opened": 0, "rejected": 0}
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() >= self._opened_at + self.reset_timeout else "open"
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if time.monotonic() >= self._opened_at + self.reset_timeout and not self._probing:
+                self._probing = True
+                return True
+            self.stats["rejected"] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures, self._opened_at, self._probing = 0, None, False
+
+    def release(self):
+        """The call ended without reaching a verdict (no request sent, or the caller's own budget ran out)."""
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.failure_threshold:
+                if self._opened_at is None:
+                    self.stats["opened"] += 1
+                    print(f"{self.name}: circuit open after {self._failures} consecutive failures.")
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+
+class TokenBucket:
+    """
+    Token-bucket rate limiter for one API key.
+    The bucket lives in Redis so every gunicorn thread and Celery worker shares the same
+    allowance; if Redis is unreachable it degrades to a per-process bucket.
+    """
+
+    # KEYS[1] = bucket hash; ARGV = rate/sec, capacity, now (ms), tokens requested.
+    # Returns 0 when the token was granted, otherwise the wait (ms) until one is available.
+    _LUA = """
+    local rate = tonumber(ARGV[1])
+    local capacity = tonumber(ARGV[2])
+    local now = tonumber(ARGV[3])
+    local requested = tonumber(ARGV[4])
+    local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local tokens = tonumber(state[1]) or capacity
+    local ts = tonumber(state[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate / 1000)
+    local wait = 0
+    if tokens >= requested then
+        tokens = tokens - requested
+    else
+        wait = math.ceil((requested - tokens) * 1000 / rate)
+    end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('PEXPIRE', KEYS[1], math.ceil(capacity * 1000 / rate) + 1000)
+    return wait
+    """
+
+    def __init__(self, name, api_key, rate, capacity):
+        key_id = hashlib.sha1((api_key or "").encode()).hexdigest()[:12]
+        self.key = f"ratelimit:{name}:{key_id}"
+        self.rate = rate
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._tokens = float(capacity)
+        self._ts = time.monotonic()
+        self._script = None
+        self._redis_retry_at = 0.0
+
+    def _try_redis(self):
+        client = get_redis()
+        if client is None or time.monotonic() < self._redis_retry_at:
+            return None
+        if self._script is None:
+            self._script = client.register_script(self._LUA)
+        try:
+            wait_ms = self._script(keys=[self.key], args=[self.rate, self.capacity, int(time.time() * 1000), 1])
+            return int(wait_ms) / 1000
+        except redis.exceptions.RedisError:
+            # Don't pay a connect timeout on every request while Redis is down.
+            self._redis_retry_at = time.monotonic() + 30
+            return None
+
+    def _try_local(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._ts) * self.rate)
+            self._ts = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def available(self):
+        """Tokens left in the bucket right now (shared bucket if Redis is up), for monitoring."""
+        client = get_redis()
+        if client is not None and time.monotonic() >= self._redis_retry_at:
+            try:
+                tokens, ts = client.hmget(self.key, "tokens", "ts")
+            except redis.exceptions.RedisError:
+                tokens = ts = None
+            else:
+                if tokens is None:
+                    return float(self.capacity)
+                elapsed_ms = max(0, time.time() * 1000 - float(ts))
+                return min(self.capacity, float(tokens) + elapsed_ms * self.rate / 1000)
+        with self._lock:
+            return min(self.capacity, self._tokens + (time.monotonic() - self._ts) * self.rate)
+
+    def acquire(self, max_wait):
+        """Blocks until a token is available. Returns False if that would take longer than max_wait."""
+        deadline = time.monotonic() + max_wait
+        while True:
+            wait = self._try_redis()
+            if wait is None:
+                wait = self._try_local()
+            if wait <= 0:
+                return True
+            if time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class ProviderTransport:
+    """
+    Keep-alive HTTP transport for one data provider: pooled connections, a shared
+    token-bucket rate limiter, jittered exponential backoff on 429/5xx, a deadline on
+    every call and a circuit breaker that fails fast during an outage.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, name, base_url, api_key, rate, burst, headers=None):
+        self.name = name
+        self.base_url = base_url.rstrip("/")
+        self.headers = headers or {}
+        self.bucket = TokenBucket(name, api_key, rate, burst)
+        self.breaker = CircuitBreaker(name, Config.CIRCUIT_FAILURE_THRESHOLD, Config.CIRCUIT_RESET_TIMEOUT)
+        self.stats = {"requests": 0, "retries": 0, "throttled": 0, "errors": 0, "deadline_exceeded": 0}
+        self._stats_lock = threading.Lock()
+        self._session = None
+        self._session_pid = None
+
+    @property
+    def session(self):
+        # Celery's prefork pool forks after import; never share sockets with the parent.
+        if self._session is None or self._session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=Config.PROVIDER_POOL_SIZE, max_retries=0)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers.update(self.headers)
+            self._session, self._session_pid = session, os.getpid()
+        return self._session
+
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+    def _backoff(self, attempt, response=None):
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(Config.PROVIDER_BACKOFF_CAP, float(retry_after))
+        # "Full jitter" keeps retrying workers from synchronizing into new bursts.
+        return random.uniform(0, min(Config.PROVIDER_BACKOFF_CAP, Config.PROVIDER_BACKOFF_BASE * 2 ** attempt))
+
+    def get_json(self, path, params=None, deadline=None):
+        """
+        GETs base_url + path and returns the decoded JSON body, or raises ProviderError.
+        The call (retries, backoff and rate-limit waits included) ends by `deadline`
+        (time.monotonic()); the default is PROVIDER_CALL_DEADLINE seconds from now, capped
+        by any enclosing deadline_scope. Only network errors, 5xx responses and running
+        out of PROVIDER_CALL_DEADLINE itself count against the circuit breaker.
+        """
+        own_deadline = time.monotonic() + Config.PROVIDER_CALL_DEADLINE
+        caller_deadline = min((d for d in (deadline, getattr(_scope, "deadline", None)) if d is not None),
+                              default=float("inf"))
+        deadline = min(own_deadline, caller_deadline)
+        if not self.breaker.allow():
+            raise ProviderUnavailable(self.name, "Circuit open; failing fast.")
+        try:
+            result = self._get_json(f"{self.base_url}{path}", params, deadline)
+        except ProviderThrottled as e:
+            if e.status_code is None:
+                self.breaker.release()  # Local token bucket: no request reached the provider
+            else:
+                self.breaker.record_success()  # The provider is answering; quota is the token bucket's job
+            raise
+        except ProviderDeadlineExceeded:
+            if caller_deadline < own_deadline:
+                self.breaker.release()  # The caller's budget (e.g. a hub deadline) ran out, not ours
+            else:
+                self.breaker.record_failure()
+            raise
+        except ProviderError as e:
+            if e.status_code is None or e.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise
+        self.breaker.record_success()
+        return result
+
+    def _deadline_exceeded(self, retries):
+        self._count(deadline_exceeded=1, errors=1)
+        return ProviderDeadlineExceeded(self.name, f"Deadline exceeded after {retries} retries.", retries=retries)
+
+    def _sleep_before_retry(self, seconds, deadline, retries):
+        if time.monotonic() + seconds >= deadline:
+            raise self._deadline_exceeded(retries)
+        time.sleep(seconds)
+
+    def _get_json(self, url, params, deadline):
+        retries = 0
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise self._deadline_exceeded(retries)
+            if not self.bucket.acquire(min(Config.PROVIDER_RATE_WAIT, remaining)):
+                self._count(throttled=1)
+                raise ProviderThrottled(self.name, "Local rate limit exhausted.", retries=retries)
+
+            self._count(requests=1)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise self._deadline_exceeded(retries)
+            started = time.perf_counter()
+            try:
+                response = self.session.get(url, params=params, timeout=min(Config.PROVIDER_TIMEOUT, remaining))
+            except requests.exceptions.RequestException as e:
+                PROVIDER_REQUEST_DURATION.observe(time.perf_counter() - started, provider=self.name)
+                PROVIDER_RESPONSES.inc(provider=self.name, status="error")
+                if time.monotonic() >= deadline:
+                    raise self._deadline_exceeded(retries) from e
+                if retries >= Config.PROVIDER_MAX_RETRIES:
+                    self._count(errors=1)
+                    raise ProviderError(self.name, f"Request failed: {type(e).__name__}", retries=retries) from e
+                self._sleep_before_retry(self._backoff(retries), deadline, retries)
+                retries += 1
+                self._count(retries=1)
+                continue
+            PROVIDER_REQUEST_DURATION.observe(time.perf_counter() - started, provider=self.name)
+            PROVIDER_RESPONSES.inc(provider=self.name, status=str(response.status_code))
+
+            if response.status_code in self.RETRY_STATUSES:
+                if response.status_code == 429:
+                    self._count(throttled=1)
+                if retries >= Config.PROVIDER_MAX_RETRIES:
+                    self._count(errors=1)
+                    error_cls = ProviderThrottled if response.status_code == 429 else ProviderError
+                    raise error_cls(self.name, f"HTTP {response.status_code} after {retries} retries.",
+                                    status_code=response.status_code, retries=retries)
+                self._sleep_before_retry(self._backoff(retries, response), deadline, retries)
+                retries += 1
+                self._count(retries=1)
+                continue
+
+            if response.status_code >= 400:
+                self._count(errors=1)
+                raise ProviderError(self.name, f"HTTP {response.status_code}.",
+                                    status_code=response.status_code, retries=retries)
+
+            try:
+                return response.json()
+            except ValueError as e:
+                self._count(errors=1)
+                raise ProviderError(self.name, "Invalid JSON response.",
+                                    status_code=response.status_code, retries=retries) from e
@@ -20,13 +20,23 @@ for _name in ("Iterable", "Mapping", "MutableMapping", "MutableSet", "MutableSeq
         setattr(collections, _name, getattr(collections.abc, _name))
 
 import os
-from apns2.client import APNsClient
+import threading
+from collections import namedtuple
+from apns2.client import APNsClient, Notification
 from apns2.payload import Payload
 from config import Config
+from models import DeviceToken
+
+# APNs reasons meaning the token will never work again; the DeviceToken row should be deleted.
+INVALID_TOKEN_REASONS = {"BadDeviceToken", "Unregistered", "DeviceTokenNotForTopic"}
+
+PushBatchResult = namedtuple("PushBatchResult", ["results", "invalid_tokens"])
 
 class PushNotificationService:
     def __init__(self):
         self.apns_client = None
+        # The HTTP/2 connection is not thread safe; one batch at a time multiplexes over it.
+        self._send_lock = threading.Lock()
         if Config.APNS_KEY_ID and Config.APNS_TEAM_ID and os.path.exists(Config.APNS_KEY_FILE_PATH):
             try:
                 self.apns_client = APNsClient(
@@ -47,19 +57,15 @@ class PushNotificationService:
             return
 
         try:
-            payload = Payload(
-                alert={"title": alert_title, "body": alert_body},
-                sound="default",
-                badge=1,
-                mutable_content=True
-            )
+            payload = self.build_payload(alert_title, alert_body)
             
             # Send the notification
-            self.apns_client.send_notification(
-                device_token, 
-                payload, 
-                topic=Config.APNS_BUNDLE_ID
-            )
+            with self._send_lock:
+                self.apns_client.send_notification(
+                    device_token, 
+                    payload, 
+                    topic=Config.APNS_BUNDLE_ID
+                )
             print(f"Successfully sent push to {device_token}")
 
         except Exception as e:
@@ -67,5 +73,67 @@ class PushNotificationService:
             # Handle potential errors, e.g., 'BadDeviceToken'
             # If 'BadDeviceToken', you should remove the token from the database.
 
+    @staticmethod
+    def build_payload(alert_title, alert_body):
+        return Payload(
+            alert={"title": alert_title, "body": alert_body},
+            sound="default",
+            badge=1,
+            mutable_content=True
+        )
+
+    def send_batch(self, messages, max_in_flight=None):
+        """
+        Sends many pushes concurrently over the single HTTP/2 connection (one stream per
+        push, at most `max_in_flight` open at once).
+
+        `messages` is a list of (device_token, payload) pairs, where payload is an apns2
+        Payload (see build_payload). Returns PushBatchResult(results, invalid_tokens):
+        `results` is a list of (device_token, "Success" or APNs reason) in input order, and
+        `invalid_tokens` holds tokens APNs rejected permanently (see prune_invalid_tokens).
+        """
+        max_in_flight = max_in_flight or Config.APNS_MAX_IN_FLIGHT
+        results = [None] * len(messages)
+        if not self.apns_client:
+            print(f"Simulating Push batch (APNs not configured): {len(messages)} notifications")
+            return PushBatchResult([(token, "Success") for token, _ in messages], set())
+
+        # apns2 reports one result per token, so a token with several pushes (a user with
+        # multiple triggered alerts) is spread across rounds.
+        rounds, seen = [], {}
+        for i, (token, _) in enumerate(messages):
+            n = seen.get(token, 0)
+            seen[token] = n + 1
+            if n == len(rounds):
+                rounds.append([])
+            rounds[n].append(i)
+
+        for indices in rounds:
+            for start in range(0, len(indices), max_in_flight):
+                chunk = indices[start:start + max_in_flight]
+                notifications = [Notification(token=messages[i][0], payload=messages[i][1]) for i in chunk]
+                try:
+                    with self._send_lock:
+                        batch = self.apns_client.send_notification_batch(notifications, topic=Config.APNS_BUNDLE_ID)
+                except Exception as e:
+                    print(f"Push batch of {len(chunk)} failed: {e}")
+                    batch = {}
+                for i in chunk:
+                    token = messages[i][0]
+                    result = batch.get(token, "ConnectionFailed")
+                    # 410 responses come back as (reason, timestamp)
+                    results[i] = (token, result[0] if isinstance(result, tuple) else result)
+
+        invalid_tokens = {token for token, result in results if result in INVALID_TOKEN_REASONS}
+        failed = sum(1 for _, result in results if result != "Success")
+        print(f"Push batch: {len(results) - failed} sent, {failed} failed, {len(invalid_tokens)} invalid tokens")
+        return PushBatchResult(results, invalid_tokens)
+
+def prune_invalid_tokens(db, tokens):
+    """Deletes DeviceToken rows for tokens APNs rejected, in one statement. Caller commits."""
+    if not tokens:
+        return 0
+    return db.query(DeviceToken).filter(DeviceToken.token.in_(list(tokens))).delete(synchronize_session=False)
+
 # Singleton instance
 PNS = PushNotificationService()
@@ -0,0 +1,19 @@
+import redis
+from config import Config
+
+_client = None
+
+def get_redis():
+    """
+    Returns the shared Redis client (lazily created from REDIS_URL).
+    redis-py pools connections per process and is safe to share across threads.
+    Returns None when REDIS_URL is not configured; callers fall back to local state.
+    """
+    global _client
+    if _client is None and Config.REDIS_URL:
+        _client = redis.Redis.from_url(
+            Config.REDIS_URL,
+            socket_timeout=Config.REDIS_SOCKET_TIMEOUT,
+            socket_connect_timeout=Config.REDIS_SOCKET_TIMEOUT,
+        )
+    return _client
@@ -0,0 +1,115 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.dialects import postgresql, sqlite
+
+from cache import last_market_close_date
+from data_providers import DP
+from models import SectorPerformance
+
+_MAX_HOLIDAY_LOOKBACK = 5  # Weekdays to step back over market holidays
+
+
+def sector_returns(frame):
+    """
+    One vectorized groupby over `frame` (ticker, sector, prev_close, close, shares).
+    Returns a frame indexed by sector with cap_weighted_pct, equal_weighted_pct and
+    constituents. Cap weights are prev_close * shares; a sector with no share data
+    falls back to its equal-weighted return.
+    """
+    valid = (frame['prev_close'] > 0) & np.isfinite(frame['close']) & (frame['close'] > 0)
+    frame = frame[valid]
+    ret = frame['close'].to_numpy() / frame['prev_close'].to_numpy() - 1
+    cap = frame['prev_close'].to_numpy() * np.nan_to_num(frame['shares'].to_numpy(dtype=np.float64))
+    grouped = pd.DataFrame({
+        'sector': frame['sector'].to_numpy(), 'ret': ret, 'cap': cap, 'cap_ret': cap * ret,
+    }).groupby('sector', sort=True).agg(
+        cap_ret=('cap_ret', 'sum'), cap=('cap', 'sum'), equal_weighted=('ret', 'mean'), constituents=('ret', 'size'),
+    )
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cap_weighted = np.where(grouped['cap'] > 0, grouped['cap_ret'] / grouped['cap'], grouped['equal_weighted'])
+    return pd.DataFrame({
+        'cap_weighted_pct': cap_weighted * 100,
+        'equal_weighted_pct': grouped['equal_weighted'].to_numpy() * 100,
+        'constituents': grouped['constituents'].to_numpy(),
+    }, index=grouped.index)
+
+
+def _with_sectors(prices):
+    """Joins ticker/prev_close/close to the cached sector map and share counts."""
+    sectors = DP.get_sector_map()
+    frame = prices[prices['ticker'].isin(sectors.keys())].copy()
+    frame['sector'] = frame['ticker'].map(sectors)
+    shares = DP.get_shares_outstanding(frame['ticker'].tolist())
+    frame['shares'] = frame['ticker'].map(shares).astype(np.float64)
+    return frame
+
+
+def _previous_weekday(day):
+    return day - timedelta(days=3 if day.weekday() == 0 else 1)
+
+
+def _grouped_session(day):
+    """Grouped daily for `day`, or the nearest earlier session if `day` was a holiday."""
+    for _ in range(_MAX_HOLIDAY_LOOKBACK):
+        bars = DP.get_grouped_daily(day)
+        if not bars.empty:
+            return day, bars
+        day = _previous_weekday(day)
+    return day, bars
+
+
+def end_of_day_frame():
+    """Last completed session vs the one before: one grouped call (the previous one is cached)."""
+    day, today = _grouped_session(last_market_close_date())
+    _, prior = _grouped_session(_previous_weekday(day))
+    prices = today[['ticker', 'close']].merge(
+        prior[['ticker', 'close']].rename(columns={'close': 'prev_close'}), on='ticker', how='inner',
+    )
+    return _with_sectors(prices)
+
+
+def intraday_frame():
+    """Live returns from one full-market snapshot call (last trade vs previous close)."""
+    items = DP.get_market_snapshot()
+    tickers, close, prev_close = [], [], []
+    for item in items:
+        last = (item.get('lastTrade') or {}).get('p') or (item.get('day') or {}).get('c')
+        prev = (item.get('prevDay') or {}).get('c')
+        if last and prev:
+            tickers.append(item['ticker'])
+            close.append(last)
+            prev_close.append(prev)
+    prices = pd.DataFrame({'ticker': tickers, 'close': np.array(close, dtype=np.float64),
+                           'prev_close': np.array(prev_close, dtype=np.float64)})
+    return _with_sectors(prices)
+
+
+def upsert_sector_performance(db, results, updated_at):
+    """Writes every sector in one INSERT ... ON CONFLICT DO UPDATE. Caller commits."""
+    rows = [
+        {
+            'sector': sector,
+            'performance_pct': float(row.cap_weighted_pct),
+            'equal_weight_pct': float(row.equal_weighted_pct),
+            'constituents': int(row.constituents),
+            'last_updated': updated_at,
+        }
+        for sector, row in results.iterrows()
+    ]
+    if not rows:
+        return 0
+    dialect = db.get_bind().dialect.name
+    if dialect not in ('postgresql', 'sqlite'):
+        for row in rows:
+            db.merge(SectorPerformance(**row))
+        return len(rows)
+    insert = (postgresql if dialect == 'postgresql' else sqlite).insert
+    stmt = insert(SectorPerformance).values(rows)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['sector'],
+        set_={c: stmt.excluded[c] for c in ('performance_pct', 'equal_weight_pct', 'constituents', 'last_updated')},
+    )
+    db.execute(stmt)
+    return len(rows)
@@ -0,0 +1,178 @@
+import hashlib
+import pickle
+import threading
+import time
+import uuid
+
+import redis
+
+from config import Config
+from provider_transport import current_deadline
+from redis_client import get_redis
+
+LOCK_PREFIX = "singleflight:lock:"
+RESULT_PREFIX = "singleflight:result:"  # + key + ":" + the leader's lock token
+
+# Deletes the lock only if this caller still owns it (it may have expired and been re-taken).
+_RELEASE_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+def flight_key(*parts):
+    """Compact key for a call (long ticker lists are hashed)."""
+    raw = ":".join(str(p) for p in parts)
+    return raw if len(raw) <= 120 else hashlib.sha1(raw.encode()).hexdigest()
+
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Request coalescing: concurrent callers for the same key share one execution.
+
+    - In a process, the first caller (the leader) runs the function; the others wait on
+      it and get the same result or exception.
+    - Across web instances, the leader also holds a short Redis lock and publishes the
+      result (pickled) for SINGLE_FLIGHT_RESULT_TTL seconds. Callers elsewhere that find
+      the lock taken poll for that leader's result (keyed by its lock token, so an earlier
+      leader's result is never mistaken for it), and run the function themselves only if
+      the leader failed, its result was too large to publish, or SINGLE_FLIGHT_LOCK_TTL passed.
+
+    Results are shared objects; callers must treat them as read-only.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._release = None
+        self._retry_at = 0.0
+        self.stats = {"leaders": 0, "coalesced_local": 0, "coalesced_remote": 0,
+                      "remote_fallbacks": 0, "errors": 0}
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def _client(self):
+        if time.monotonic() < self._retry_at:
+            return None
+        client = get_redis()
+        if client is not None and self._release is None:
+            self._release = client.register_script(_RELEASE_LUA)
+        return client
+
+    def _failed(self):
+        self._count("errors")
+        self._retry_at = time.monotonic() + 30
+
+    def do(self, key, fn):
+        """Returns fn(), shared with every concurrent caller of the same key."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.stats["leaders"] += 1
+            else:
+                self.stats["coalesced_local"] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = self._run_shared(key, fn)
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def _run_shared(self, key, fn):
+        """Runs fn() under the cross-instance lock, or waits for another instance's result."""
+        client = self._client()
+        if client is None:
+            return fn()
+
+        token = uuid.uuid4().hex
+        lock_ms = int(Config.SINGLE_FLIGHT_LOCK_TTL * 1000)
+        try:
+            # Take the lock or learn who holds it, atomically
+            pipe = client.pipeline(transaction=True)
+            pipe.set(LOCK_PREFIX + key, token, nx=True, px=lock_ms)
+            pipe.get(LOCK_PREFIX + key)
+            owner, holder = pipe.execute()
+        except redis.exceptions.RedisError:
+            self._failed()
+            return fn()
+
+        if not owner:
+            holder = holder.decode() if isinstance(holder, bytes) else holder
+            found, result = self._wait_for_result(client, key, holder)
+            if found:
+                self._count("coalesced_remote")
+                return result
+            self._count("remote_fallbacks")
+            return fn()
+
+        try:
+            result = fn()
+            self._publish(client, key, token, result)
+            return result
+        finally:
+            try:
+                self._release(keys=[LOCK_PREFIX + key], args=[token], client=client)
+            except redis.exceptions.RedisError:
+                self._failed()
+
+    def _wait_for_result(self, client, key, holder):
+        """(True, result) once leader `holder` (its lock token) publishes, or (False, None) if it never does."""
+        if holder is None:
+            return False, None
+        # A caller with a latency budget (deadline_scope, e.g. a hub section) stops waiting when it runs out
+        deadline = min(time.monotonic() + Config.SINGLE_FLIGHT_LOCK_TTL, current_deadline() or float("inf"))
+        try:
+            while time.monotonic() < deadline:
+                pipe = client.pipeline(transaction=False)
+                pipe.get(f"{RESULT_PREFIX}{key}:{holder}")
+                pipe.get(LOCK_PREFIX + key)
+                blob, locked_by = pipe.execute()
+                if blob is not None:
+                    return True, pickle.loads(blob)
+                if locked_by is None or locked_by.decode() != holder:
+                    return False, None
+                time.sleep(Config.SINGLE_FLIGHT_POLL_INTERVAL)
+        except redis.exceptions.RedisError:
+            self._failed()
+        return False, None
+
+    def _publish(self, client, key, token, result):
+        try:
+            blob = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            return
+        if len(blob) > Config.CACHE_REDIS_MAX_VALUE_BYTES:
+            return  # Waiters elsewhere fall back to their own call
+        try:
+            client.set(f"{RESULT_PREFIX}{key}:{token}", blob, px=int(Config.SINGLE_FLIGHT_RESULT_TTL * 1000))
+        except redis.exceptions.RedisError:
+            self._failed()
+
+# Singleton instance
+SINGLE_FLIGHT = SingleFlight()
@@ -1,13 +1,43 @@
-from celery import Celery
+from celery import Celery, signals
 from celery.schedules import crontab
+import numpy as np
 from config import Config
-from data_providers import DP
-from models import get_db_session, PriceAlert, AlertDirection, SectorPerformance, DeviceToken
+from data_providers import DP, ProviderError
+from models import get_db_session, PriceAlert, StockPick
 from datetime import datetime
-from push_service import PNS # Import the new push service (Gap 1)
+import time
+from alert_engine import AlertBook, REDIS_ALERT_BOOK, deliver_triggered_alerts
+from bar_store import BARS
+from technicals_engine import TE, bar_session, build_close_panel
+from indicator_state import IndicatorState, STATES
+from hub_snapshots import HUB_SNAPSHOTS, is_complete_payload
+from analysis_features import fetch_analysis_hub_data
+from analyzer_runs import ANALYZER_RUNS
+from cache import MARKET_TZ, last_market_close_date
+from concurrent.futures import ThreadPoolExecutor
+from http_cache import set_version, HEATMAP_VERSION_KEY
+from metrics import REGISTRY, ALERT_STAGE_DURATION, TASK_DURATION
+from redis_client import get_redis
+from sector_heatmap import sector_returns, end_of_day_frame, intraday_frame, upsert_sector_performance
 
 # Initialize Celery
 celery_app = Celery('tasks', broker=Config.REDIS_URL, backend=Config.REDIS_URL)
+# Every crontab below is US market time (ET), not the worker's UTC clock
+celery_app.conf.timezone = 'America/New_York'
+
+# --- Metrics: run time of every task; each task flushes so short-lived workers lose nothing ---
+_task_started = {}
+
+@signals.task_prerun.connect
+def _record_task_start(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+@signals.task_postrun.connect
+def _record_task_duration(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_DURATION.observe(time.perf_counter() - started, task=task.name, state=state or "UNKNOWN")
+    REGISTRY.flush()
 
 # (Existing tasks: run_daily_analysis, ingest_catalysts, process_news_sentiment)
 
@@ -15,80 +45,222 @@ celery_app = Celery('tasks', broker=Config.REDIS_URL, backend=Config.REDIS_URL)
 @celery_app.task(name="tasks.monitor_price_alerts")
 def monitor_price_alerts():
     """Runs every minute to check active price alerts."""
+    if Config.ALERT_STREAM_ENABLED:
+        # alert_stream.py evaluates alerts on every trade; polling would double-notify.
+        return {"status": "skipped", "reason": "alert stream enabled"}
     
     # Use the context manager for safer db sessions
     with get_db_session() as db:
         try:
-            # 1. Fetch all active alerts
-            active_alerts = db.query(PriceAlert).filter(PriceAlert.is_active == True).all()
-            if not active_alerts: 
+            # 1. Per-ticker sorted thresholds: the shared Redis book once reconcile has seeded it,
+            #    otherwise all active alerts loaded from the database
+            with ALERT_STAGE_DURATION.time(stage="load"):
+                shared = REDIS_ALERT_BOOK.ready()
+                book = REDIS_ALERT_BOOK if shared else AlertBook.load(db)
+                tickers = book.tickers()
+            if not tickers:
                 return {"status": "no_active_alerts"}
 
-            # 2. Get unique tickers and fetch bulk prices (Polygon)
-            tickers = list(set(alert.ticker for alert in active_alerts))
-            if not tickers:
-                return {"status": "no_tickers_in_alerts"}
-                
-            current_prices = DP.get_latest_trades_bulk(tickers)
-            
-            # 3. Evaluate conditions
-            triggered_alerts = []
-            for alert in active_alerts:
-                current_price = current_prices.get(alert.ticker)
-                if current_price is None: 
-                    continue
-
-                if alert.direction == AlertDirection.ABOVE and current_price >= alert.target_price:
-                    triggered_alerts.append((alert, current_price)) # Pass price for the message
-                elif alert.direction == AlertDirection.BELOW and current_price <= alert.target_price:
-                    triggered_alerts.append((alert, current_price)) # Pass price for the message
+            # 2. Fetch bulk prices for the alerted tickers (Polygon)
+            try:
+                with ALERT_STAGE_DURATION.time(stage="prices"):
+                    current_prices = DP.get_latest_trades_bulk(tickers)
+            except ProviderError as e:
+                print(f"monitor_price_alerts: price fetch failed: {e}")
+                return {"status": "provider_error", "throttled": e.throttled, "retries": e.retries, "message": str(e)}
             
+            # 3. Evaluate conditions (ZRANGEBYSCORE per ticker and direction, or one binary search
+            #    on the local book). The Redis book pops fired alerts atomically, so overlapping
+            #    runs never fire the same alert twice.
+            with ALERT_STAGE_DURATION.time(stage="evaluate"):
+                triggered_alerts = book.evaluate(current_prices, pop=shared)
             if not triggered_alerts:
                 return {"status": "success", "triggered": 0}
 
-            # 4. Trigger notifications and deactivate alerts
-            for alert, price in triggered_alerts:
-                print(f"ALERT TRIGGERED: {alert.ticker} hit target {alert.target_price}. Current: {price}")
-                
-                # --- Push Notification Logic (Gap 1) ---
-                # Find all devices for the user who owns the alert
-                user_tokens = db.query(DeviceToken).filter(DeviceToken.user_uid == alert.user_uid).all()
-                
-                alert_title = f"Price Alert: {alert.ticker}"
-                alert_body = f"{alert.ticker} has reached your target of ${alert.target_price:.2f}. Current price: ${price:.2f}"
-                
-                for token in user_tokens:
-                    PNS.send_notification(token.token, alert_title, alert_body)
-                # --- End Push Logic ---
-
-                alert.is_active = False
-                db.add(alert)
-            
-            db.commit()
-            return {"status": "success", "triggered": len(triggered_alerts)}
+            # 4. Deactivate, notify (one concurrent push batch) and prune dead device tokens
+            with ALERT_STAGE_DURATION.time(stage="deliver"):
+                summary = deliver_triggered_alerts(db, triggered_alerts)
+            return {"status": "success", **summary}
 
         except Exception as e:
             db.rollback()
             print(f"Error in monitor_price_alerts: {e}")
             return {"status": "error", "message": str(e)}
 
+@celery_app.task(name="tasks.reconcile_alert_book")
+def reconcile_alert_book():
+    """Repairs drift between the Redis alert book and the active alerts in the database."""
+    if get_redis() is None:
+        return {"status": "skipped", "reason": "redis not configured"}
+    with get_db_session() as db:
+        counts = REDIS_ALERT_BOOK.reconcile(db)
+    return {"status": "success", **counts}
+
 # Feature: Sector Heatmap Calculation
 @celery_app.task(name="tasks.calculate_sector_heatmap")
-def calculate_sector_heatmap():
-    """Calculates daily sector performance."""
-    # IMPLEMENTATION REQUIRED: Use Polygon/Tiingo to calculate actual sector performance.
-    # Simulated Results
-    heatmap_data = {
-        "Technology": 2.5, "Healthcare": 1.1, "Energy": -0.5, "Industrials": 0.2,
-    }
-    
-    # Save/Update results in the database
+def calculate_sector_heatmap(intraday=False):
+    """
+    Sector performance (market-cap and equal weighted) for the whole market. End of day:
+    one grouped-daily pull vs the previous session. Intraday: one full-market snapshot.
+    Sector map and share counts come from the provider cache (refreshed weekly).
+    """
+    try:
+        frame = intraday_frame() if intraday else end_of_day_frame()
+    except ProviderError as e:
+        print(f"calculate_sector_heatmap: market data unavailable: {e}")
+        return {"status": "provider_error", "throttled": e.throttled, "retries": e.retries, "message": str(e)}
+    results = sector_returns(frame)
+    if results.empty:
+        return {"status": "no_data"}
+
+    # Save/Update results in the database (one bulk upsert)
+    updated_at = datetime.utcnow()
     with get_db_session() as db:
-        for sector, performance in heatmap_data.items():
-            # (SQLAlchemy logic to update SectorPerformance table)
-            pass
-        db.commit()
-    return {"status": "success"}
+        try:
+            sectors = upsert_sector_performance(db, results, updated_at)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Error in calculate_sector_heatmap: {e}")
+            return {"status": "error", "message": str(e)}
+    # Stamp the new version so /market/heatmap can answer 304s without a query
+    set_version(HEATMAP_VERSION_KEY, updated_at.isoformat())
+    return {"status": "success", "sectors": sectors, "tickers": int(results['constituents'].sum())}
+
+def tracked_tickers():
+    """Tickers we precompute data for: active alerts and published picks."""
+    with get_db_session() as db:
+        alert_tickers = [t for (t,) in db.query(PriceAlert.ticker).filter(PriceAlert.is_active == True).distinct()]
+        pick_tickers = [t for (t,) in db.query(StockPick.ticker).distinct()]
+    return sorted(set(alert_tickers) | set(pick_tickers))
+
+# Performance: Local Daily Bar Store Backfill
+@celery_app.task(name="tasks.backfill_bar_store")
+def backfill_bar_store(tickers=None):
+    """Syncs the local daily bar store after the close for the screened universe (see hub_universe)."""
+    tickers = hub_universe() if tickers is None else tickers
+    results = DP.backfill_daily_bars(tickers)
+    failed = {t: r for t, r in results.items() if isinstance(r, str)}
+    for ticker, error in failed.items():
+        print(f"backfill_bar_store: {ticker} failed: {error}")
+    return {"status": "success", "synced": len(results) - len(failed), "failed": len(failed)}
+
+# Performance: Universe-wide Batched Technicals
+@celery_app.task(name="tasks.compute_universe_technicals")
+def compute_universe_technicals(tickers=None):
+    """Computes technicals for the screened universe (see hub_universe) in one panel pass and publishes them for the hub."""
+    if BARS is None:
+        return {"status": "skipped", "reason": "bar store disabled"}
+    tickers = hub_universe() if tickers is None else tickers
+    closes, as_of = {}, {}
+    for ticker in tickers:
+        bars = BARS.read(ticker)
+        if len(bars):
+            closes[ticker] = bars['close'][-260:]
+            as_of[ticker] = bar_session(bars['t'][-1])
+    if not closes:
+        return {"status": "success", "tickers": 0}
+
+    panel, panel_tickers = build_close_panel(closes, n_bars=260)
+    result = TE.compute(panel, panel_tickers)
+    TE.store_latest(result, as_of)
+    return {"status": "success", "tickers": len(panel_tickers)}
+
+# Performance: Incremental Indicator State
+def _advance_indicator_state(ticker, state):
+    """Applies new stored bars to `state` (O(1) per bar); rebuilds it if history was re-adjusted."""
+    bars = BARS.read(ticker)
+    if not len(bars):
+        return state
+    if state is not None and state.last_t is not None:
+        i = np.searchsorted(bars['t'], state.last_t)
+        adjusted = i >= len(bars) or bars['t'][i] != state.last_t or not np.isclose(bars['close'][i], state.window[-1])
+        if not adjusted:
+            for t, close in zip(bars['t'][i + 1:], bars['close'][i + 1:]):
+                state.update(t, close)
+            return state
+    return IndicatorState.from_bars(ticker, bars['t'], bars['close'])
+
+@celery_app.task(name="tasks.update_indicator_states")
+def update_indicator_states(tickers=None):
+    """After the close: advances each screened ticker's rolling SMA/RSI state by the new bars and publishes signals."""
+    if BARS is None:
+        return {"status": "skipped", "reason": "bar store disabled"}
+    tickers = hub_universe() if tickers is None else tickers
+    states = STATES.load_many(tickers)
+    updated = [s for s in (_advance_indicator_state(t, states.get(t)) for t in tickers) if s is not None]
+    STATES.save_many(updated)
+    published = [s for s in updated if s.last_t is not None]
+    TE.store_payloads({s.ticker: s.payload() for s in published}, {s.ticker: bar_session(s.last_t) for s in published})
+    return {"status": "success", "tickers": len(updated)}
+
+@celery_app.task(name="tasks.refresh_intraday_technicals")
+def refresh_intraday_technicals(tickers=None):
+    """During market hours: previews today's in-progress bar against stored state (no history recompute)."""
+    tickers = tracked_tickers() if tickers is None else tickers
+    states = STATES.load_many(tickers)
+    if not states:
+        return {"status": "success", "tickers": 0}
+    try:
+        prices = DP.get_latest_trades_bulk(list(states))
+    except ProviderError as e:
+        return {"status": "provider_error", "throttled": e.throttled, "retries": e.retries, "message": str(e)}
+    today = datetime.now(MARKET_TZ).date()  # Previews include today's in-progress bar
+    previews = {t: states[t].preview(p) for t, p in prices.items() if t in states}
+    TE.store_payloads(previews, {t: today for t in previews})
+    return {"status": "success", "tickers": len(prices)}
+
+# Performance: Precomputed Analysis Hub Snapshots
+def candidate_tickers(limit=None):
+    """Tickers of the latest completed analyzer run, best first (at most HUB_SNAPSHOT_MAX_CANDIDATES)."""
+    limit = Config.HUB_SNAPSHOT_MAX_CANDIDATES if limit is None else limit
+    try:
+        with get_db_session() as db:
+            run = ANALYZER_RUNS.latest_completed(db)
+            rows = ANALYZER_RUNS.rows(run) if run is not None else []
+    except Exception as e:
+        print(f"candidate_tickers: no stored analyzer run, using tracked tickers only: {e}")
+        rows = []
+    return [row['Ticker'] for row in rows[:limit]]
+
+def hub_universe():
+    """Candidates from the latest stored analyzer run plus every alerted / published ticker."""
+    return sorted(set(candidate_tickers()) | set(tracked_tickers()))
+
+@celery_app.task(name="tasks.precompute_hub_snapshots")
+def precompute_hub_snapshots(tickers=None):
+    """After the close: builds each hub payload once and stores it versioned by session date."""
+    tickers = hub_universe() if tickers is None else tickers
+    as_of = last_market_close_date()
+    with ThreadPoolExecutor(max_workers=Config.HUB_PRECOMPUTE_WORKERS) as pool:
+        payloads = dict(zip(tickers, pool.map(fetch_analysis_hub_data, tickers)))
+
+    # Partial payloads are skipped; those tickers are built live on read instead.
+    complete = {t: p for t, p in payloads.items() if is_complete_payload(p)}
+    with get_db_session() as db:
+        try:
+            for ticker, payload in complete.items():
+                HUB_SNAPSHOTS.save(db, ticker, as_of, payload)
+            pruned = HUB_SNAPSHOTS.prune(db)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"Error in precompute_hub_snapshots: {e}")
+            return {"status": "error", "message": str(e)}
+    return {"status": "success", "as_of": as_of.isoformat(), "stored": len(complete),
+            "incomplete": len(payloads) - len(complete), "pruned": pruned}
+
+# Performance: Versioned Analyzer Runs
+@celery_app.task(name="tasks.refresh_analyzer_run")
+def refresh_analyzer_run(force=False, lock_held=False):
+    """Recomputes the analyzer ranking in the background. Only one refresh runs at a time."""
+    if not lock_held and not ANALYZER_RUNS.try_acquire_refresh():
+        return {"status": "skipped", "reason": "refresh already running"}
+    try:
+        run_key = ANALYZER_RUNS.run(force=force)
+    finally:
+        ANALYZER_RUNS.release_refresh()
+    return {"status": "success", "run_key": run_key}
 
 # Celery Beat Schedule
 celery_app.conf.beat_schedule = {
@@ -98,8 +270,42 @@ celery_app.conf.beat_schedule = {
         # 9 AM to 5 PM ET, Mon-Fri (Adjust as needed, e.g., 9:30-16:00 for market hours)
         'schedule': crontab(minute='*', hour='9-17', day_of_week='1-5'),
     },
+    'reconcile-alert-book': {
+        'task': 'tasks.reconcile_alert_book',
+        'schedule': crontab(minute='*/15'), # Also seeds the book after a Redis flush
+    },
+    'backfill-bar-store-daily': {
+        'task': 'tasks.backfill_bar_store',
+        'schedule': crontab(hour=16, minute=45, day_of_week='1-5'), # After the close, ET
+    },
+    'update-indicator-states-daily': {
+        'task': 'tasks.update_indicator_states',
+        'schedule': crontab(hour=17, minute=15, day_of_week='1-5'), # After the bar store backfill
+    },
+    'refresh-analyzer-run-daily': {
+        'task': 'tasks.refresh_analyzer_run',
+        'schedule': crontab(hour=16, minute=30, day_of_week='1-5'), # New data version each session; the jobs below read its candidates
+    },
+    'precompute-hub-snapshots-daily': {
+        'task': 'tasks.precompute_hub_snapshots',
+        'schedule': crontab(hour=17, minute=45, day_of_week='1-5'), # After bars and technicals are updated
+    },
+    'refresh-intraday-technicals': {
+        'task': 'tasks.refresh_intraday_technicals',
+        'schedule': crontab(minute='*/5', hour='9-16', day_of_week='1-5'),
+    },
+    'compute-universe-technicals-weekly': {
+        # Full panel recompute (screening + a check on the incremental state)
+        'task': 'tasks.compute_universe_technicals',
+        'schedule': crontab(hour=18, minute=30, day_of_week='5'),
+    },
     'calculate-heatmap-daily': {
         'task': 'tasks.calculate_sector_heatmap',
-        'schedule': crontab(hour=18, minute=0), # 6 PM ET
+        'schedule': crontab(hour=18, minute=0, day_of_week='1-5'), # 6 PM ET, final grouped bars
+    },
+    'calculate-heatmap-intraday': {
+        'task': 'tasks.calculate_sector_heatmap',
+        'schedule': crontab(minute='*/5', hour='9-16', day_of_week='1-5'),
+        'kwargs': {'intraday': True},
     },
 }
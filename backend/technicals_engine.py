@@ -0,0 +1,275 @@
+import json
+from datetime import date, datetime
+
+import numpy as np
+import redis
+
+from cache import MARKET_TZ, last_market_close_date, ttl_until_next_market_close
+from redis_client import get_redis
+
+try:
+    import talib
+except ImportError:
+    talib = None
+
+LATEST_KEY = "technicals:latest"  # Redis hash: ticker -> {"asOf": session date, "payload": ...}
+MIN_BARS = 50
+
+
+# --- Indicators on a (bars x tickers) close panel ---
+# Each column is one ticker's bar sequence, right-aligned (newest bar in the last row) and
+# NaN-padded at the top, so every column sees exactly the bars TA-Lib would see per ticker.
+
+def sma_panel(close, period):
+    """Simple moving average per column. NaN until `period` valid bars are in the window."""
+    valid = ~np.isnan(close)
+    csum = np.cumsum(np.where(valid, close, 0.0), axis=0)
+    ccount = np.cumsum(valid, axis=0)
+    window_sum = csum.copy()
+    window_sum[period:] -= csum[:-period]
+    window_count = ccount.copy()
+    window_count[period:] -= ccount[:-period]
+    out = window_sum / period
+    out[window_count < period] = np.nan
+    return out
+
+
+def rsi_panel(close, period=14):
+    """
+    Wilder RSI per column, matching TA-Lib's RSI: the first value uses the simple mean of
+    the first `period` gains/losses, then Wilder smoothing. Vectorized across tickers;
+    one step per bar.
+    """
+    n_bars, n_tickers = close.shape
+    out = np.full((n_bars, n_tickers), np.nan)
+    if n_bars < 2:
+        return out
+    diff = np.diff(close, axis=0)
+    gains, losses = np.clip(diff, 0, None), np.clip(-diff, 0, None)
+    seen = np.zeros(n_tickers, dtype=np.int64)
+    avg_gain = np.zeros(n_tickers)
+    avg_loss = np.zeros(n_tickers)
+    for t in range(n_bars - 1):
+        ok = ~np.isnan(diff[t])
+        seen += ok
+        seeding = ok & (seen <= period)
+        avg_gain[seeding] += gains[t, seeding] / period
+        avg_loss[seeding] += losses[t, seeding] / period
+        smoothing = ok & (seen > period)
+        avg_gain[smoothing] = (avg_gain[smoothing] * (period - 1) + gains[t, smoothing]) / period
+        avg_loss[smoothing] = (avg_loss[smoothing] * (period - 1) + losses[t, smoothing]) / period
+        emit = ok & (seen >= period)
+        total = avg_gain[emit] + avg_loss[emit]
+        with np.errstate(invalid="ignore", divide="ignore"):
+            out[t + 1, emit] = np.where(total > 0, 100 * avg_gain[emit] / total, 0.0)
+    return out
+
+
+def _talib_panel(func, close, **kwargs):
+    """Runs a TA-Lib indicator column by column on each ticker's own (non-padded) bars."""
+    out = np.full(close.shape, np.nan)
+    for j in range(close.shape[1]):
+        column = close[:, j]
+        start = np.argmax(~np.isnan(column)) if (~np.isnan(column)).any() else len(column)
+        if start < len(column):
+            out[start:, j] = func(np.ascontiguousarray(column[start:]), **kwargs)
+    return out
+
+
+def build_close_panel(closes_by_ticker, n_bars=260):
+    """Right-aligns each ticker's close series into a (n_bars x tickers) float64 panel."""
+    tickers = list(closes_by_ticker)
+    panel = np.full((n_bars, len(tickers)), np.nan)
+    for j, ticker in enumerate(tickers):
+        closes = np.asarray(closes_by_ticker[ticker], dtype=np.float64)[-n_bars:]
+        if len(closes):
+            panel[-len(closes):, j] = closes
+    return panel, tickers
+
+
+class TechnicalsResult:
+    """Latest-bar technicals for every ticker in a panel (arrays aligned with `tickers`)."""
+
+    def __init__(self, tickers, n_bars, price, sma_50, sma_200, prev_sma_50, prev_sma_200, rsi):
+        self.tickers = tickers
+        self._index = {t: i for i, t in enumerate(tickers)}
+        self.n_bars = n_bars
+        self.price, self.sma_50, self.sma_200, self.rsi = price, sma_50, sma_200, rsi
+
+        has_200 = n_bars >= 200
+        with np.errstate(invalid="ignore"):
+            self.golden_cross = has_200 & (sma_50 > sma_200) & (prev_sma_50 <= prev_sma_200)
+            self.death_cross = has_200 & (sma_50 < sma_200) & (prev_sma_50 >= prev_sma_200)
+            self.trend = np.where(~has_200, "Neutral", np.select(
+                [
+                    (price > sma_50) & (sma_50 > sma_200),
+                    (price < sma_50) & (sma_50 < sma_200),
+                    (price > sma_50) & (price > sma_200),
+                    (price < sma_50) & (price < sma_200),
+                ],
+                ["Strong Uptrend", "Strong Downtrend", "Uptrend", "Downtrend"],
+                default="Neutral",
+            ))
+
+    def __contains__(self, ticker):
+        return ticker in self._index
+
+    def payload(self, ticker):
+        """The analyze_technicals response for one ticker."""
+        i = self._index[ticker]
+        if self.n_bars[i] < MIN_BARS:
+            return {"error": "Insufficient historical data."}
+
+        signals = []
+        if self.golden_cross[i]:
+            signals.append({
+                "signal": "Golden Cross",
+                "sentiment": "Bullish",
+                "description": "Strong bullish signal: 50-day SMA crossed above 200-day SMA.",
+            })
+        elif self.death_cross[i]:
+            signals.append({
+                "signal": "Death Cross",
+                "sentiment": "Bearish",
+                "description": "Strong bearish signal: 50-day SMA crossed below 200-day SMA.",
+            })
+
+        rsi = float(self.rsi[i])
+        if rsi > 70:
+            signals.append({
+                "signal": "Overbought",
+                "sentiment": "Bearish",
+                "description": "RSI_14 is over 70, indicating a potential pullback.",
+            })
+        elif rsi < 30:
+            signals.append({
+                "signal": "Oversold",
+                "sentiment": "Bullish",
+                "description": "RSI_14 is under 30, indicating a potential bounce.",
+            })
+
+        return {
+            "trend": str(self.trend[i]),
+            "indicators": {
+                "RSI_14": rsi,
+                "SMA_50": float(self.sma_50[i]),
+                "SMA_200": float(self.sma_200[i]) if self.n_bars[i] >= 200 else None,
+            },
+            "signals": signals,
+            "error": None
+        }
+
+
+class TechnicalsEngine:
+    """
+    Batch technicals (SMA-50/200, RSI-14, golden/death cross, trend) for a whole panel in
+    one vectorized pass. Uses TA-Lib when installed, otherwise the pure-NumPy indicators
+    above (which match TA-Lib to floating-point tolerance).
+    """
+
+    def __init__(self, use_talib=None):
+        self.use_talib = (talib is not None) if use_talib is None else use_talib
+
+    def compute(self, close, tickers):
+        close = np.asarray(close, dtype=np.float64)
+        if self.use_talib:
+            sma_50 = _talib_panel(talib.SMA, close, timeperiod=50)
+            sma_200 = _talib_panel(talib.SMA, close, timeperiod=200)
+            rsi = _talib_panel(talib.RSI, close, timeperiod=14)
+        else:
+            sma_50 = sma_panel(close, 50)
+            sma_200 = sma_panel(close, 200)
+            rsi = rsi_panel(close, 14)
+
+        prev = max(close.shape[0] - 2, 0)
+        return TechnicalsResult(
+            tickers=tickers,
+            n_bars=(~np.isnan(close)).sum(axis=0),
+            price=close[-1],
+            sma_50=sma_50[-1],
+            sma_200=sma_200[-1],
+            prev_sma_50=sma_50[prev],
+            prev_sma_200=sma_200[prev],
+            rsi=rsi[-1],
+        )
+
+    # --- Universe results shared through Redis (written by tasks.compute_universe_technicals) ---
+
+    def store_latest(self, result, as_of):
+        """
+        Publishes every ticker's payload until the next market close. `as_of` maps each
+        ticker to the session date of its last bar; lookups skip entries older than the
+        last completed session, so a ticker whose bars lag is computed live instead.
+        """
+        client = get_redis()
+        if client is None or not result.tickers:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            pipe.delete(LATEST_KEY)
+            pipe.hset(LATEST_KEY, mapping={t: _entry(result.payload(t), as_of[t]) for t in result.tickers})
+            pipe.expire(LATEST_KEY, ttl_until_next_market_close())
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            print(f"Could not store universe technicals: {e}")
+
+    def store_payloads(self, payloads, as_of):
+        """Publishes {ticker: payload} (as of {ticker: session date}) without clearing other tickers."""
+        client = get_redis()
+        if client is None or not payloads:
+            return
+        try:
+            pipe = client.pipeline(transaction=False)
+            pipe.hset(LATEST_KEY, mapping={t: _entry(p, as_of[t]) for t, p in payloads.items()})
+            pipe.expire(LATEST_KEY, ttl_until_next_market_close())
+            pipe.execute()
+        except redis.exceptions.RedisError as e:
+            print(f"Could not store technicals: {e}")
+
+    def lookup(self, ticker):
+        """Payload from the last universe run, or None (also when it predates the last close)."""
+        client = get_redis()
+        if client is None:
+            return None
+        try:
+            raw = client.hget(LATEST_KEY, ticker)
+        except redis.exceptions.RedisError:
+            return None
+        return _current_payload(raw, last_market_close_date())
+
+    def lookup_many(self, tickers):
+        """{ticker: payload} from the last universe run in one HMGET; absent tickers are left out."""
+        client = get_redis()
+        if client is None or not tickers:
+            return {}
+        try:
+            raw = client.hmget(LATEST_KEY, list(tickers))
+        except redis.exceptions.RedisError:
+            return {}
+        session = last_market_close_date()
+        current = {t: _current_payload(r, session) for t, r in zip(tickers, raw)}
+        return {t: p for t, p in current.items() if p is not None}
+
+
+def bar_session(t_ms):
+    """Session date (ET) of a bar timestamp (epoch ms)."""
+    return datetime.fromtimestamp(t_ms / 1000, MARKET_TZ).date()
+
+
+def _entry(payload, as_of):
+    return json.dumps({"asOf": as_of.isoformat(), "payload": payload})
+
+
+def _current_payload(raw, session):
+    """The stored payload, unless it is missing or computed before `session` closed."""
+    if not raw:
+        return None
+    entry = json.loads(raw)
+    as_of = entry.get("asOf")
+    if as_of is None or date.fromisoformat(as_of) < session:
+        return None
+    return entry["payload"]
+
+
+# Singleton instance
+TE = TechnicalsEngine()